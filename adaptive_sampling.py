@@ -0,0 +1,82 @@
+"""
+adaptive_sampling.py. Confidence intervals of the win probability of every hand class while
+the simulations run, used to stop once the estimates have converged.
+The win probability of a class is estimated as wins / times dealt, the same quantity that
+data_science.generate_matrices estimates from the winner counts only. Its confidence interval is
+the Wilson score interval, which behaves well for the rare classes with few samples.
+"""
+from statistics import NormalDist
+
+import numpy as np
+
+from combos import CLASS_OF_CARDS, HAND_CLASSES, HAND_CLASS_INDEX
+
+
+class ConvergenceTracker:
+    """Wins and deals per hand class, with the convergence curve of the confidence intervals.
+    cells is an optional list of hand classes (as classify_hand) to watch, all by default.
+    Raises ValueError for unknown hand classes."""
+
+    def __init__(self, cells=None, confidence=0.95):
+        unknown = [cell for cell in cells or () if cell not in HAND_CLASS_INDEX]
+        if unknown:
+            raise ValueError(f"Unknown hand classes {', '.join(unknown)}.")
+        self.cells = np.arange(len(HAND_CLASSES)) if cells is None else np.array(
+            [HAND_CLASS_INDEX[cell] for cell in cells])
+        self.z_value = NormalDist().inv_cdf((1 + confidence) / 2)
+        self.wins = np.zeros(len(HAND_CLASSES))
+        self.dealt = np.zeros(len(HAND_CLASSES))
+        # Independent samples of every class, the deals unless added with add
+        self.samples = np.zeros(len(HAND_CLASSES))
+        self.simulations = 0
+        self.curve = []
+
+    def update(self, hands, winners):
+        """Count a batch of simulations: hands (boards, players, 2) and winners (boards, 2) of
+        integer encoded cards."""
+        dealt = np.bincount(CLASS_OF_CARDS[hands[..., 0], hands[..., 1]].ravel(),
+                            minlength=len(HAND_CLASSES))
+        self.add(np.bincount(CLASS_OF_CARDS[winners[:, 0], winners[:, 1]],
+                             minlength=len(HAND_CLASSES)), dealt, dealt, len(winners))
+
+    def add(self, wins, dealt, samples, simulations):
+        """Count wins, deals and independent samples per hand class (arrays in HAND_CLASSES
+        order) of a number of simulations, as the weighted samples of stratified_sampling.py."""
+        self.wins += wins
+        self.dealt += dealt
+        self.samples += samples
+        self.simulations += simulations
+
+    def estimates(self):
+        """Win probability of every hand class."""
+        return np.divide(self.wins, self.dealt, out=np.zeros_like(self.wins),
+                         where=self.dealt > 0)
+
+    def half_widths(self):
+        """Half width of the Wilson score interval of every hand class, inf without samples."""
+        samples = np.where(self.samples > 0, self.samples, 1)
+        probability = self.estimates()
+        z_square = self.z_value ** 2
+        half_width = (self.z_value / (1 + z_square / samples)
+                      * np.sqrt(probability * (1 - probability) / samples
+                                + z_square / (4 * samples ** 2)))
+        return np.where(self.samples > 0, half_width, np.inf)
+
+    def checkpoint(self):
+        """Add a point to the convergence curve. Output: widest half width of the cells."""
+        half_widths = self.half_widths()[self.cells]
+        self.curve.append({"simulations": self.simulations,
+                           "max_half_width": float(half_widths.max()),
+                           "mean_half_width": float(half_widths.mean()),
+                           "widest_cell": HAND_CLASSES[self.cells[half_widths.argmax()]]})
+        return self.curve[-1]["max_half_width"]
+
+    def summary(self):
+        """Estimates, half widths and convergence curve as a dictionary (JSON friendly)."""
+        half_widths = self.half_widths()
+        return {"simulations": self.simulations,
+                "z_value": self.z_value,
+                "cells": [HAND_CLASSES[cell] for cell in self.cells],
+                "estimates": dict(zip(HAND_CLASSES, self.estimates().tolist())),
+                "half_widths": dict(zip(HAND_CLASSES, half_widths.tolist())),
+                "curve": self.curve}
@@ -0,0 +1,79 @@
+"""
+aggregate_store.py. Persistent store of the aggregated counts of every simulation file.
+A file is identified by its absolute path, size and modification time, so a report only parses
+the files which are new or changed since the last run and merges the saved counts of the rest.
+The store is a JSON file, saved with an atomic replace every CHECKPOINT_FILES parsed files and
+at the end of every report, so an interrupted report keeps most of the files already parsed
+without writing the whole store again for every file.
+"""
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import json
+import os
+
+# Parsed files between two saves of the store
+CHECKPOINT_FILES = 64
+
+
+def file_identity(file_name):
+    """Identity key of a file: absolute path, size and modification time."""
+    file_stat = os.stat(file_name)
+    return f"{os.path.abspath(file_name)}|{file_stat.st_size}|{file_stat.st_mtime_ns}"
+
+
+class AggregateStore:
+    """Counts per file identity saved in store_file."""
+
+    def __init__(self, store_file):
+        self.store_file = store_file
+        self.entries = {}
+        if os.path.exists(store_file):
+            with open(store_file, "r", encoding="utf-8") as saved_store:
+                self.entries = json.load(saved_store)
+        # Identity of the entry of every path
+        self.paths = {identity.rsplit("|", 2)[0]: identity for identity in self.entries}
+
+    def save(self):
+        """Save the store, replacing the previous file only once it is fully written."""
+        temporary_file = self.store_file + ".tmp"
+        with open(temporary_file, "w", encoding="utf-8") as store:
+            json.dump(self.entries, store)
+        os.replace(temporary_file, self.store_file)
+
+    def add(self, file_name, identity, counts):
+        """Add the counts of a file, dropping the entry of a previous version of it. The store
+        is not saved, see save."""
+        path = identity.rsplit("|", 2)[0]
+        self.entries.pop(self.paths.get(path), None)
+        self.paths[path] = identity
+        self.entries[identity] = {"file_name": file_name, "counts": dict(counts)}
+
+    def counts(self, file_list, count_function, jobs=1):
+        """Merged Counter of the files in file_list. Files missing in the store are parsed with
+        count_function (file name -> Counter), in jobs processes if jobs > 1, and the store is
+        saved every CHECKPOINT_FILES of them and at the end.
+        Output: merged Counter, list of the files parsed in this call."""
+        identities = {file_name: file_identity(file_name) for file_name in file_list}
+        new_files = list(dict.fromkeys(file_name for file_name, identity in identities.items()
+                                       if identity not in self.entries))
+        if jobs > 1 and len(new_files) > 1:
+            with ProcessPoolExecutor(max_workers=jobs) as executor:
+                futures = {executor.submit(count_function, file_name): file_name
+                           for file_name in new_files}
+                for parsed, future in enumerate(as_completed(futures), 1):
+                    file_name = futures[future]
+                    self.add(file_name, identities[file_name], future.result())
+                    if parsed % CHECKPOINT_FILES == 0:
+                        self.save()
+        else:
+            for parsed, file_name in enumerate(new_files, 1):
+                self.add(file_name, identities[file_name], count_function(file_name))
+                if parsed % CHECKPOINT_FILES == 0:
+                    self.save()
+        if new_files:
+            self.save()
+
+        merged = Counter()
+        for file_name in file_list:
+            merged.update(self.entries[identities[file_name]]["counts"])
+        return merged, new_files
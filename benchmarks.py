@@ -0,0 +1,236 @@
+"""
+benchmarks.py. Benchmark suite of the simulator with fixed seeds and JSON results.
+Every benchmark runs a function a number of times per repeat and keeps the best and the median
+time per operation of the repeats. Every benchmark gets the scale of its operations, and the
+benchmarks writing files a temporary directory, removed after the run. The results are saved as
+JSON with the machine details, and compare reports the benchmarks slower than a baseline file
+beyond a threshold, the benchmarks of the baseline missing in the results and the new ones.
+Usage:
+    python benchmarks.py run [-o results.json] [--quick] [--only NAME ...]
+    python benchmarks.py compare baseline.json results.json [--threshold 0.1]
+"""
+import argparse
+import contextlib
+from datetime import datetime
+import inspect
+import io
+import itertools
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+from time import perf_counter_ns
+
+import numpy as np
+
+import monte_carlo
+from data_science import process_file
+
+SEED = 20241001
+DEFAULT_THRESHOLD = 0.10
+
+
+def measure(function, number, repeat):
+    """Run function number times per repeat. Output: best and median seconds per call."""
+    times = []
+    for _ in range(repeat):
+        start = perf_counter_ns()
+        for _ in range(number):
+            function()
+        times.append((perf_counter_ns() - start) / number / 1e9)
+    return min(times), statistics.median(times)
+
+
+def _random_hands(cards, count):
+    """count random hands of cards string cards, dealt with the fixed seed."""
+    deck = monte_carlo.create_deck()
+    return [random.sample(deck, cards) for _ in range(count)]
+
+
+def _cycle(function, inputs):
+    """Function of no arguments calling function with the next item of inputs on every call."""
+    iterator = itertools.cycle(inputs)
+    return lambda: function(next(iterator))
+
+
+def bench_evaluate_hand(scale):
+    """evaluate_hand on random 5 cards hands."""
+    return _cycle(monte_carlo.evaluate_hand, _random_hands(5, 1000)), 2000 * scale, "hand"
+
+
+def bench_best_hand(scale):
+    """best_hand on random 7 cards hands (21 evaluate_hand calls)."""
+    return _cycle(monte_carlo.best_hand, _random_hands(7, 1000)), 100 * scale, "hand"
+
+
+def bench_evaluate_full_hand(scale):
+    """evaluate_full_hand on random 7 cards hands."""
+    return _cycle(monte_carlo.evaluate_full_hand, _random_hands(7, 1000)), 2000 * scale, "hand"
+
+
+def bench_hand_strength(scale):
+    """Integer evaluator on random 7 cards hands."""
+    return _cycle(monte_carlo.hand_strength, _random_hands(7, 1000)), 10000 * scale, "hand"
+
+
+def bench_deal_9_hands(scale):
+    """all_possible_hands dealing 9 hands without repeated cards."""
+    boards = _random_hands(5, 1000)
+    return _cycle(lambda board: monte_carlo.all_possible_hands(board, 9), boards), \
+        2000 * scale, "board"
+
+
+def bench_deal_all_hands(scale):
+    """all_possible_hands dealing all the 1081 hands in random order."""
+    boards = _random_hands(5, 1000)
+    return _cycle(lambda board: monte_carlo.all_possible_hands(board, 1081, True), boards), \
+        20 * scale, "board"
+
+
+def _training(number_of_hands, batch_size=None):
+    """One simulation of monte_carlo_training with its output discarded."""
+    rng = np.random.default_rng(SEED)
+    output = io.StringIO()
+
+    def run():
+        output.seek(0)
+        with contextlib.redirect_stdout(output):
+            monte_carlo.monte_carlo_training(1 if batch_size is None else batch_size,
+                                             number_of_hands, batch_size, rng)
+    return run
+
+
+def bench_training_2_hands(scale):
+    """End to end monte_carlo_training with 2 hands."""
+    return _training(2), 1000 * scale, "simulation"
+
+
+def bench_training_9_hands(scale):
+    """End to end monte_carlo_training with 9 hands."""
+    return _training(9), 500 * scale, "simulation"
+
+
+def bench_training_all_hands(scale):
+    """End to end monte_carlo_training with all the 1081 hands."""
+    return _training(1081), 10 * scale, "simulation"
+
+
+def bench_batch_training_9_hands(scale):
+    """monte_carlo_training with 9 hands in batches of 1000 boards (time per batch)."""
+    return _training(9, 1000), 2 * scale, "batch of 1000 simulations"
+
+
+def _process_file_bench(binary, scale, directory):
+    """process_file on a simulation file of 10000 rows generated with the fixed seed."""
+    file_name = os.path.join(directory, "poker_benchmark" + (".bin" if binary else ".csv"))
+    with contextlib.redirect_stdout(io.StringIO()):
+        monte_carlo.simulation_shard(file_name, 10000, np.random.SeedSequence(SEED),
+                                     monte_carlo.ShardSettings(9, 1000, binary))
+    return lambda: process_file(file_name), max(1, scale // 2), "file of 10000 rows"
+
+
+def bench_process_csv_file(scale, directory):
+    """data_science.process_file ingestion of a CSV file."""
+    return _process_file_bench(False, scale, directory)
+
+
+def bench_process_binary_file(scale, directory):
+    """data_science.process_file ingestion of a binary record file."""
+    return _process_file_bench(True, scale, directory)
+
+
+BENCHMARKS = {name[len("bench_"):]: function for name, function in globals().items()
+              if name.startswith("bench_")}
+
+
+def run_benchmarks(names=None, quick=False, repeat=5):
+    """Run the benchmarks in names (all by default). quick runs a fifth of the operations and 3
+    repeats. Output: dictionary with the machine details and the results."""
+    scale, repeat = (1, 3) if quick else (5, repeat)
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for name in names or BENCHMARKS:
+            random.seed(SEED)
+            benchmark = BENCHMARKS[name]
+            if "directory" in inspect.signature(benchmark).parameters:
+                function, number, unit = benchmark(scale, directory)
+            else:
+                function, number, unit = benchmark(scale)
+            best, median = measure(function, number, repeat)
+            results[name] = {"unit": unit, "best_seconds": best, "median_seconds": median,
+                             "per_second": 1 / best if best else 0, "number": number,
+                             "repeat": repeat}
+            print(f"{name:26} best {best * 1e6:12.2f} us/{unit}, "
+                  f"median {median * 1e6:12.2f} us", file=sys.stderr)
+    return {"metadata": {"date": datetime.now().isoformat(timespec="seconds"),
+                         "python": platform.python_version(),
+                         "numpy": np.__version__,
+                         "machine": platform.platform(),
+                         "processor": platform.processor(),
+                         "seed": SEED,
+                         "quick": quick},
+            "results": results}
+
+
+def compare_results(baseline, current, threshold=DEFAULT_THRESHOLD):
+    """Compare the best times of 2 result dictionaries. Output: list of (name, baseline seconds,
+    current seconds, ratio), list of the regressions, ratio above 1 + threshold, list of the
+    baseline benchmarks missing in the current results and list of the new current benchmarks,
+    not in the baseline."""
+    rows = []
+    missing = [name for name in baseline["results"] if name not in current["results"]]
+    new = [name for name in current["results"] if name not in baseline["results"]]
+    for name, result in current["results"].items():
+        if name in new:
+            continue
+        base_time = baseline["results"][name]["best_seconds"]
+        rows.append((name, base_time, result["best_seconds"],
+                     result["best_seconds"] / base_time if base_time else float("inf")))
+    return rows, [row for row in rows if row[3] > 1 + threshold], missing, new
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmarks of the poker simulator.')
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    run_parser = subparsers.add_parser("run")
+    run_parser.add_argument('-o', '--output', help='JSON results file, printed by default')
+    run_parser.add_argument('--quick', action='store_true', help='fewer operations and repeats')
+    run_parser.add_argument('--only', nargs='+', choices=list(BENCHMARKS),
+                            help='run only these benchmarks')
+    compare_parser = subparsers.add_parser("compare")
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current')
+    compare_parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                                help='slowdown ratio flagged as regression, 0.1 is 10%%')
+    args = parser.parse_args()
+
+    if args.command == "run":
+        benchmark_results = run_benchmarks(args.only, args.quick)
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as results_file:
+                json.dump(benchmark_results, results_file, indent=1)
+            print("results file_name:", args.output)
+        else:
+            print(json.dumps(benchmark_results, indent=1))
+    else:
+        with open(args.baseline, "r", encoding="utf-8") as baseline_file:
+            baseline_results = json.load(baseline_file)
+        with open(args.current, "r", encoding="utf-8") as current_file:
+            current_results = json.load(current_file)
+        comparison, regressions, missing_benchmarks, new_benchmarks = compare_results(
+            baseline_results, current_results, args.threshold)
+        for row in comparison:
+            flag = "REGRESSION" if row in regressions else ""
+            print(f"{row[0]:26} {row[1] * 1e6:12.2f} us -> {row[2] * 1e6:12.2f} us "
+                  f"x{row[3]:.2f} {flag}")
+        for benchmark_name in missing_benchmarks:
+            print(f"{benchmark_name:26} MISSING in the results")
+        for benchmark_name in new_benchmarks:
+            print(f"{benchmark_name:26} new, not in the baseline")
+        print(f"{len(regressions)} regressions above {args.threshold:.0%}, "
+              f"{len(missing_benchmarks)} baseline benchmarks missing in the results, "
+              f"{len(new_benchmarks)} new benchmarks.")
+        sys.exit(1 if regressions or missing_benchmarks else 0)
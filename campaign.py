@@ -0,0 +1,277 @@
+"""
+campaign.py. Long simulation campaigns split in numbered work units, resumable and shared by any
+number of worker processes on any number of hosts.
+A campaign is a SQLite file (the coordinator) with its settings and one row per work unit. Every
+unit has a fixed number of simulations and a deterministic random stream, the spawn key unit of
+the campaign seed (numpy SeedSequence), so a unit gives the same simulations whoever runs it and
+however many times. A worker claims the next pending unit in a transaction, saves its simulations
+in a unit file next to the campaign file (CSV or binary records, see monte_carlo.simulation_shard)
+and marks it done with its counts of winner hand classes. The unit files are written under a
+temporary name of the worker and renamed once complete, so a done unit always has a complete
+file. A unit claimed by a worker which crashed is claimed again once its lease expires, and
+running the workers again resumes the campaign: the done units are skipped. A worker which lost
+its lease while running a unit discards its file, the unit belongs to the worker which claimed
+it again. merge adds the saved counts
+of the done units and reports them with data_science.report_generator, a manifest of the unit
+files can also be used as list file (-l) in data_science.py.
+Usage:
+    python campaign.py create CAMPAIGN_FILE number_of_simulations number_of_players
+                       [-u UNIT_SIZE] [-b BATCH_SIZE] [-s SEED] [--binary] [--memo_size SIZE]
+    python campaign.py work CAMPAIGN_FILE [--worker NAME] [--lease SECONDS] [--max_units N]
+    python campaign.py status CAMPAIGN_FILE
+    python campaign.py merge CAMPAIGN_FILE [-o OUTPUT_PATH] [--no_report]
+"""
+import argparse
+from collections import Counter
+import json
+import os
+import socket
+import sqlite3
+import time
+
+import numpy as np
+
+from data_science import count_file, report_generator
+from monte_carlo import ShardSettings, check_memo, simulation_shard
+
+DEFAULT_UNIT_SIZE = 10000
+# Seconds before the unit of a worker which stopped answering can be claimed again
+DEFAULT_LEASE = 3600
+PENDING, RUNNING, DONE = "pending", "running", "done"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS settings (name TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS units (
+    unit INTEGER PRIMARY KEY,
+    simulations INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    worker TEXT,
+    claimed REAL,
+    finished REAL,
+    file_name TEXT,
+    counts TEXT
+);
+"""
+
+
+def connect(campaign_file):
+    """Connection to a campaign file, in autocommit mode with explicit transactions."""
+    connection = sqlite3.connect(campaign_file, timeout=60, isolation_level=None)
+    connection.executescript(SCHEMA)
+    return connection
+
+
+def unit_seed(seed, unit):
+    """Seed sequence of a unit, the same as np.random.SeedSequence(seed).spawn(...)[unit]."""
+    return np.random.SeedSequence(seed, spawn_key=(unit,))
+
+
+def create_campaign(campaign_file, simulations, n_players, unit_size=DEFAULT_UNIT_SIZE,
+                    batch_size=None, seed=None, binary=False, memo_size=0):
+    """Save a campaign of simulations with n_players in units of unit_size simulations.
+    Raises ValueError if campaign_file already has a campaign or if the workers would not use
+    the showdown memo (see monte_carlo.check_memo). Output: the settings."""
+    if unit_size < 1:
+        raise ValueError("The units need at least 1 simulation.")
+    check_memo(memo_size, n_players, batch_size)
+    seed = seed if seed is not None else np.random.SeedSequence().entropy
+    settings = {"simulations": simulations, "n_players": n_players, "unit_size": unit_size,
+                "batch_size": batch_size, "seed": seed, "binary": binary,
+                "memo_size": memo_size}
+    connection = connect(campaign_file)
+    try:
+        connection.execute("BEGIN IMMEDIATE")
+        if connection.execute("SELECT COUNT(*) FROM settings").fetchone()[0]:
+            connection.execute("ROLLBACK")
+            raise ValueError(f"{campaign_file} already has a campaign.")
+        connection.executemany("INSERT INTO settings VALUES (?, ?)",
+                               [(name, json.dumps(value)) for name, value in settings.items()])
+        connection.executemany(
+            "INSERT INTO units (unit, simulations, status) VALUES (?, ?, ?)",
+            [(unit, min(unit_size, simulations - start), PENDING)
+             for unit, start in enumerate(range(0, simulations, unit_size))])
+        connection.execute("COMMIT")
+    finally:
+        connection.close()
+    return settings
+
+
+def campaign_settings(connection):
+    """Settings of the campaign as a dictionary."""
+    settings = {name: json.loads(value)
+                for name, value in connection.execute("SELECT name, value FROM settings")}
+    if not settings:
+        raise ValueError("The file has no campaign, create it first.")
+    return settings
+
+
+def claim_unit(connection, worker, lease=DEFAULT_LEASE):
+    """Claim the next pending unit, or a running unit whose lease expired, for worker.
+    Output: unit number and simulations, None when no unit is left."""
+    now = time.time()
+    connection.execute("BEGIN IMMEDIATE")
+    row = connection.execute(
+        "SELECT unit, simulations FROM units WHERE status = ? OR (status = ? AND claimed < ?) "
+        "ORDER BY unit LIMIT 1", (PENDING, RUNNING, now - lease)).fetchone()
+    if row is not None:
+        connection.execute("UPDATE units SET status = ?, worker = ?, claimed = ? WHERE unit = ?",
+                           (RUNNING, worker, now, row[0]))
+    connection.execute("COMMIT")
+    return row
+
+
+def unit_file_name(campaign_file, unit, binary):
+    """File of the simulations of a unit, next to the campaign file."""
+    return f"{os.path.splitext(campaign_file)[0]}_unit{unit}.{'bin' if binary else 'csv'}"
+
+
+def run_unit(campaign_file, settings, unit, simulations, worker):
+    """Run the simulations of a unit in a temporary file of worker, unique to the worker even
+    if the unit is claimed again by another one.
+    Output: temporary file name and Counter of the winner hand classes."""
+    worker_name = "".join(character if character.isalnum() else "_" for character in worker)
+    temporary_file = (f"{unit_file_name(campaign_file, unit, settings['binary'])}."
+                      f"{worker_name}.{os.getpid()}.tmp")
+    simulation_shard(temporary_file, simulations, unit_seed(settings["seed"], unit),
+                     ShardSettings(settings["n_players"], settings["batch_size"],
+                                   settings["binary"], memo_size=settings["memo_size"]))
+    return temporary_file, count_file(temporary_file)
+
+
+def finish_unit(connection, campaign_file, settings, unit, worker, temporary_file, counts):
+    """Mark a unit run by worker as done with its counts and rename its temporary file to the
+    unit file, in one transaction, if the worker still holds the unit. The file is removed
+    otherwise. Output: True if the unit was marked done."""
+    file_name = unit_file_name(campaign_file, unit, settings["binary"])
+    connection.execute("BEGIN IMMEDIATE")
+    updated = connection.execute(
+        "UPDATE units SET status = ?, finished = ?, file_name = ?, counts = ? "
+        "WHERE unit = ? AND worker = ? AND status = ?",
+        (DONE, time.time(), os.path.relpath(file_name, os.path.dirname(
+            os.path.abspath(campaign_file))), json.dumps(dict(counts)), unit, worker,
+         RUNNING)).rowcount
+    if updated:
+        os.replace(temporary_file, file_name)
+    connection.execute("COMMIT")
+    if not updated:
+        os.remove(temporary_file)
+    return bool(updated)
+
+
+def work(campaign_file, worker=None, lease=DEFAULT_LEASE, max_units=None):
+    """Run the units of a campaign until none is left (or max_units of them).
+    worker is the name saved with the claimed units, host and process id by default. A unit
+    whose lease was lost while it ran is discarded and not counted.
+    Output: number of units run."""
+    worker = worker or f"{socket.gethostname()}:{os.getpid()}"
+    connection = connect(campaign_file)
+    try:
+        settings = campaign_settings(connection)
+        units_run = 0
+        while max_units is None or units_run < max_units:
+            claimed = claim_unit(connection, worker, lease)
+            if claimed is None:
+                break
+            unit, simulations = claimed
+            start = time.time()
+            temporary_file, counts = run_unit(campaign_file, settings, unit, simulations, worker)
+            if not finish_unit(connection, campaign_file, settings, unit, worker, temporary_file,
+                               counts):
+                print(f"worker {worker}: lost the lease of unit {unit}, discarded.")
+                continue
+            units_run += 1
+            print(f"worker {worker}: unit {unit}, {simulations} simulations in "
+                  f"{time.time() - start:.1f} seconds.")
+    finally:
+        connection.close()
+    return units_run
+
+
+def campaign_status(campaign_file):
+    """Units and simulations of a campaign per status, as a dictionary."""
+    connection = connect(campaign_file)
+    try:
+        settings = campaign_settings(connection)
+        status = {"simulations": settings["simulations"], "n_players": settings["n_players"]}
+        for state in (PENDING, RUNNING, DONE):
+            units, simulations = connection.execute(
+                "SELECT COUNT(*), COALESCE(SUM(simulations), 0) FROM units WHERE status = ?",
+                (state,)).fetchone()
+            status[state] = {"units": units, "simulations": simulations}
+    finally:
+        connection.close()
+    return status
+
+
+def merge_campaign(campaign_file, output="", report=True):
+    """Merge the counts of the done units and report them as data_science.py does. A manifest
+    of the unit files is saved next to the campaign file.
+    Output: merged Counter of the winner hand classes."""
+    connection = connect(campaign_file)
+    try:
+        settings = campaign_settings(connection)
+        rows = connection.execute("SELECT file_name, counts FROM units WHERE status = ? "
+                                  "ORDER BY unit", (DONE,)).fetchall()
+        pending = connection.execute("SELECT COUNT(*) FROM units WHERE status != ?",
+                                     (DONE,)).fetchone()[0]
+    finally:
+        connection.close()
+    if pending:
+        print(f"Warning: {pending} units are not done, merging {len(rows)} done units.")
+    counts = Counter()
+    for _, unit_counts in rows:
+        counts.update(json.loads(unit_counts))
+    campaign_directory = os.path.dirname(os.path.abspath(campaign_file))
+    manifest_name = f"{os.path.splitext(campaign_file)[0]}_manifest.txt"
+    with open(manifest_name, "w", encoding="utf-8") as manifest:
+        for file_name, _ in rows:
+            manifest.write(os.path.join(campaign_directory, file_name) + "\n")
+    print("manifest file_name:", manifest_name)
+    report_generator([], settings["n_players"], output, report, counts=counts)
+    return counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Resumable simulation campaigns shared by workers on several hosts.')
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    create_parser = subparsers.add_parser("create")
+    create_parser.add_argument('campaign_file')
+    create_parser.add_argument('number_of_simulations', type=int)
+    create_parser.add_argument('number_of_players', type=int)
+    create_parser.add_argument('-u', '--unit_size', type=int, default=DEFAULT_UNIT_SIZE,
+                               help='simulations per work unit')
+    create_parser.add_argument('-b', '--batch_size', type=int,
+                               help='deal and evaluate the boards in numpy batches of this size')
+    create_parser.add_argument('-s', '--seed', type=int,
+                               help='master seed of the random streams of the units')
+    create_parser.add_argument('--binary', action='store_true',
+                               help='save binary record files (sim_records.py) instead of CSV')
+    create_parser.add_argument('--memo_size', type=int, default=0,
+                               help='showdown memo size of the workers, see monte_carlo.py')
+    work_parser = subparsers.add_parser("work")
+    work_parser.add_argument('campaign_file')
+    work_parser.add_argument('--worker', help='worker name, host:pid by default')
+    work_parser.add_argument('--lease', type=float, default=DEFAULT_LEASE,
+                             help='seconds before an unfinished unit can be claimed again')
+    work_parser.add_argument('--max_units', type=int, help='stop after this number of units')
+    status_parser = subparsers.add_parser("status")
+    status_parser.add_argument('campaign_file')
+    merge_parser = subparsers.add_parser("merge")
+    merge_parser.add_argument('campaign_file')
+    merge_parser.add_argument('-o', '--output_path', default="", help='path of the report file')
+    merge_parser.add_argument('--no_report', action='store_true',
+                              help='print the final report instead of saving a report file')
+    args = parser.parse_args()
+
+    if args.command == "create":
+        campaign = create_campaign(args.campaign_file, args.number_of_simulations,
+                                   args.number_of_players, args.unit_size, args.batch_size,
+                                   args.seed, args.binary, args.memo_size)
+        print(f"campaign: {campaign}")
+    elif args.command == "work":
+        print(f"{work(args.campaign_file, args.worker, args.lease, args.max_units)} units run.")
+    elif args.command == "status":
+        print(json.dumps(campaign_status(args.campaign_file), indent=1))
+    else:
+        merge_campaign(args.campaign_file, args.output_path, not args.no_report)
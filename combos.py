@@ -0,0 +1,77 @@
+"""
+combos.py. Precomputed index of the 1326 hole card combinations of integer encoded cards (see
+hand_evaluator.py), shared by the dealers, the evaluators and the reports.
+Every combination is a pair of cards, lowest first, in itertools.combinations order, with its 52
+bit card mask and its hand class (the data_science.classify_hand labels, as "AAP", "KAS" or
+"KAN"), also as string cards for the string based functions of monte_carlo.py. The
+combinations without board cards are a single mask test (board_combos), and iter_combos yields
+them lazily without building lists of tuples or string labels.
+PAIR_POSITIONS are the same combinations over the positions of the 47 cards left after a full
+board, as dealt by dealer.Dealer and enumerated by preflop_equity.
+"""
+import itertools
+
+import numpy as np
+
+from hand_evaluator import CARD_NAMES, VALUES
+
+COMBOS = np.array(list(itertools.combinations(range(52), 2)))
+COMBO_LIST = [tuple(pair) for pair in COMBOS.tolist()]
+COMBO_NAME_LIST = [(CARD_NAMES[first], CARD_NAMES[second]) for first, second in COMBO_LIST]
+COMBO_MASK_LIST = [1 << first | 1 << second for first, second in COMBO_LIST]
+COMBO_MASKS = np.array(COMBO_MASK_LIST, dtype=np.uint64)
+# Combination index of every 2 cards, in both orders, -1 for the same card twice
+COMBO_INDEX = np.full((52, 52), -1, dtype=np.int64)
+COMBO_INDEX[COMBOS[:, 0], COMBOS[:, 1]] = COMBO_INDEX[COMBOS[:, 1], COMBOS[:, 0]] = np.arange(
+    len(COMBOS))
+
+
+def combo_class(first, second):
+    """Hand class label of 2 integer encoded cards, the same as data_science.classify_hand."""
+    low, high = sorted((first, second), key=lambda card: card >> 2)
+    if low >> 2 == high >> 2:
+        return VALUES[low >> 2] * 2 + "P"
+    return VALUES[low >> 2] + VALUES[high >> 2] + ("S" if low & 3 == high & 3 else "N")
+
+
+# Every class label, its position is the class index
+HAND_CLASSES = sorted({combo_class(first, second) for first, second in COMBO_LIST})
+HAND_CLASS_INDEX = {hand_class: index for index, hand_class in enumerate(HAND_CLASSES)}
+COMBO_CLASSES = np.array([HAND_CLASS_INDEX[combo_class(first, second)]
+                          for first, second in COMBO_LIST])
+# Class index of every 2 integer encoded cards
+CLASS_OF_CARDS = np.zeros((52, 52), dtype=np.int64)
+CLASS_OF_CARDS[COMBOS[:, 0], COMBOS[:, 1]] = CLASS_OF_CARDS[COMBOS[:, 1], COMBOS[:, 0]] = \
+    COMBO_CLASSES
+# Class label of every 2 string cards, in both orders
+CLASS_OF_NAMES = {(CARD_NAMES[first], CARD_NAMES[second]): HAND_CLASSES[COMBO_CLASSES[index]]
+                  for index, (first, second) in enumerate(COMBO_LIST)}
+CLASS_OF_NAMES.update({(second, first): label for (first, second), label in
+                       list(CLASS_OF_NAMES.items())})
+# Number of combinations of every class (6 pairs, 4 suited, 12 non suited)
+CLASS_COMBINATIONS = np.bincount(COMBO_CLASSES, minlength=len(HAND_CLASSES))
+
+# Positions of all the 2-card combinations of the 47 cards left after the community cards
+PAIR_POSITIONS = np.array(list(itertools.combinations(range(47), 2)))
+PAIR_POSITIONS_LIST = [tuple(pair) for pair in PAIR_POSITIONS.tolist()]
+
+
+def cards_mask(cards):
+    """52 bit mask of integer encoded cards."""
+    mask = 0
+    for card in cards:
+        mask |= 1 << card
+    return mask
+
+
+def board_combos(board):
+    """Indexes of the combinations without cards of board (integer encoded cards)."""
+    return np.flatnonzero((COMBO_MASKS & np.uint64(cards_mask(board))) == 0)
+
+
+def iter_combos(board=()):
+    """Yield the combinations (pairs of integer encoded cards) without cards of board."""
+    board_mask = cards_mask(board)
+    for pair, mask in zip(COMBO_LIST, COMBO_MASK_LIST):
+        if not mask & board_mask:
+            yield pair
@@ -2,12 +2,25 @@
 data_science.py. script to fetch the data from files and to produce analisys and reports.
 Current activities:
     split winner hands and provide a matris of result with coicidences and probabilities
+    split sweep files (monte_carlo.py --sweep) by number of players
+    count the fractional wins of split pot files (monte_carlo.py --split_pots)
+    read hand history stores (hand_history.py) as simulation files
 """
+import abc
 import argparse
+from concurrent.futures import ProcessPoolExecutor
+import copy
+import json
 from collections import Counter
 import os
 import sys
 from datetime import datetime
+import numpy as np
+from aggregate_store import AggregateStore
+from combos import CLASS_OF_CARDS, CLASS_OF_NAMES, HAND_CLASS_INDEX, HAND_CLASSES
+from hand_evaluator import CARD_INDEX, HAND_RANKS_REVERSE
+from hand_history import HandHistoryStore, is_hand_history
+from sim_records import OUTPUT_HEADER, is_record_file, read_records
 
 VALUES = "23456789TJQKA"
 INVERSE_VALUES = VALUES[::-1]
@@ -15,6 +28,34 @@ P_CASES = 6
 S_CASES = 4
 N_CASES = 12
 T_HANDS = 1326
+# Counter keys of the boards split between a number of hands, as "tied_2"
+TIE_PREFIX = "tied_"
+# Counter keys of the weights of every class in stratified files, as "weights_AKS", and of their
+# number of boards
+WEIGHT_PREFIX = "weights_"
+STRATIFIED_BOARDS = "stratified_boards"
+# Stratified files keep only the wins per class, not the rows the aggregates read
+STRATIFIED_AGGREGATES = "--aggregates can not read stratified files (JSON)."
+# Fields of the blocks of file_blocks, CSV rows parsed per block and the default CSV columns
+BLOCK_FIELDS = ("classes", "hand_rank", "community_cards")
+CSV_BLOCK_ROWS = 65536
+OUTPUT_COLUMNS = OUTPUT_HEADER.split("|")
+# Class index of the winner hand column of the CSV files, as "AS,KH", in both orders
+CLASS_INDEX_OF_TEXT = {",".join(cards): HAND_CLASS_INDEX[label]
+                       for cards, label in CLASS_OF_NAMES.items()}
+# Board textures: most cards of a suit (2 or less, 3, 4 or 5) and boards with a pair or more
+SUIT_TEXTURES = ("offsuit", "3 suited", "4 suited", "5 suited")
+BOARD_TEXTURES = [f"{suits} {pairing}" for pairing in ("unpaired", "paired")
+                  for suits in SUIT_TEXTURES]
+# Matrix cell and cases of every class: pairs in the diagonal, suited classes in the top
+# triangle and non suited classes in the bottom one
+CLASS_ROWS = np.array([INVERSE_VALUES.index(hand_class[1] if hand_class[2] == "S"
+                                            else hand_class[0]) for hand_class in HAND_CLASSES])
+CLASS_COLUMNS = np.array([INVERSE_VALUES.index(hand_class[0] if hand_class[2] == "S"
+                                               else hand_class[1])
+                          for hand_class in HAND_CLASSES])
+CLASS_CASES = np.array([{"P": P_CASES, "S": S_CASES}.get(hand_class[2], N_CASES)
+                        for hand_class in HAND_CLASSES])
 
 def card_rank(card):
     """helper function to rank the cards for sorting purposes"""
@@ -36,52 +77,379 @@ def classify_hand(cards):
         return ''.join(ranks) + 'S'
     return ''.join(ranks) + 'N'
 
-def process_file(file_path):
-    """Function to process the file"""
-    result = []
+def players_key(hand_class, n_players):
+    """Counter key of a hand class won in a sweep file with n_players, as "3:AKS"."""
+    return f"{n_players}:{hand_class}"
+
+def players_counter(win_counter, n_players):
+    """Counter of the hand classes for n_players. Keys of sweep files (see players_key) count
+    only for their number of players, plain class keys are taken as simulations of
+    n_players. Split pot keys (see tie_counter) are left out."""
+    prefix = f"{n_players}:"
+    counter = Counter()
+    for key, value in win_counter.items():
+        if key.startswith((TIE_PREFIX, WEIGHT_PREFIX)) or key == STRATIFIED_BOARDS:
+            continue
+        if ":" not in key:
+            counter[key] += value
+        elif key.startswith(prefix):
+            counter[key[len(prefix):]] += value
+    return counter
+
+def stratified_counter(win_counter, n_players):
+    """Counter of the hand classes of stratified files (see count_file), None if there are
+    none. The weighted wins / weights of every class are its win probability, converted to the
+    wins that uniform simulations of the same number of boards would count on average, so
+    generate_matrices reports the probabilities of the stratified samples."""
+    boards = win_counter.get(STRATIFIED_BOARDS)
+    if not boards:
+        return None
+    counter = Counter()
+    for key, weights in win_counter.items():
+        if key.startswith(WEIGHT_PREFIX) and weights:
+            hand_class = key[len(WEIGHT_PREFIX):]
+            cases = {"P": P_CASES, "S": S_CASES}.get(hand_class[2], N_CASES)
+            counter[hand_class] = (win_counter[hand_class] / weights
+                                   * n_players * cases * boards / T_HANDS)
+    return counter
+
+def tie_counter(win_counter):
+    """Number of boards per number of hands sharing the pot, from the split pot keys of a
+    Counter (empty for files without split pots)."""
+    return Counter({int(key[len(TIE_PREFIX):]): round(value)
+                    for key, value in win_counter.items() if key.startswith(TIE_PREFIX)})
+
+def counter_players(win_counter):
+    """Numbers of players found in the keys of sweep files of a Counter."""
+    return sorted({int(key.split(":")[0]) for key in win_counter if ":" in key})
+
+def _csv_block(rows, columns, fields):
+    """Block of file_blocks from CSV rows (lists of fields) with the columns (name -> index) of
+    their header."""
+    block = {name: np.array([row[columns[name]] for row in rows], dtype=np.int64)
+             for name in ("n_players", "tied") if name in columns}
+    if "classes" in fields:
+        hand_column = columns["hand"]
+        block["classes"] = np.array([CLASS_INDEX_OF_TEXT[row[hand_column]] for row in rows],
+                                    dtype=np.int64)
+    if "hand_rank" in fields:
+        block["hand_rank"] = np.array([row[columns["hand_result_1"]] for row in rows],
+                                      dtype=np.int64)
+    if "community_cards" in fields:
+        board_column = columns["community_cards"]
+        block["community_cards"] = np.array(
+            [CARD_INDEX[card] for row in rows for card in row[board_column].split(",")],
+            dtype=np.int64).reshape(-1, 5)
+    return block
+
+def file_blocks(file_path, fields=BLOCK_FIELDS):
+    """Blocks of the rows of a simulation file, CSV or binary records, as dictionaries of arrays
+    of the fields: classes (class index of the winner hand), hand_rank (category of the winner
+    hand, 1 to 10) and community_cards (integer encoded cards). The n_players column of sweep
+    files and the tied column of split pot files are always in the blocks of their files. The
+    CSV columns are found by name in the header line, files without header use the default
+    column order. Hand history stores (hand_history.py) are read per segment, with the n_players
+    column of sweep files."""
+    if is_hand_history(file_path):
+        yield from HandHistoryStore(file_path, create=False).blocks(fields)
+        return
+    if is_record_file(file_path):
+        for records in read_records(file_path):
+            if not len(records):
+                continue
+            block = {name: records[name].astype(np.int64) for name in ("n_players", "tied")
+                     if name in records.dtype.names}
+            if "classes" in fields:
+                hands = records["hand"]
+                block["classes"] = CLASS_OF_CARDS[hands[:, 0], hands[:, 1]]
+            if "hand_rank" in fields:
+                block["hand_rank"] = records["hand_rank"].astype(np.int64)
+            if "community_cards" in fields:
+                block["community_cards"] = records["community_cards"].astype(np.int64)
+            yield block
+        return
+    columns = {name: index for index, name in enumerate(OUTPUT_COLUMNS)}
+    rows = []
     with open(file_path, 'r', encoding="utf-8") as simulation_file:
         for sim_line in simulation_file:
-            sim_line = sim_line.strip()
-            if not sim_line:
+            row = sim_line.strip().split('|')
+            if len(row) < 2:
                 continue
-            fields = sim_line.split('|')
-            if fields[1] == "hand":
+            if "hand" in row:
+                if rows:
+                    yield _csv_block(rows, columns, fields)
+                    rows = []
+                columns = {name: index for index, name in enumerate(row)}
                 continue
-            second_field = fields[1].split(',')
-            classification = classify_hand(second_field)
-            result.append(classification)
+            rows.append(row)
+            if len(rows) == CSV_BLOCK_ROWS:
+                yield _csv_block(rows, columns, fields)
+                rows = []
+    if rows:
+        yield _csv_block(rows, columns, fields)
+
+def count_classes(classes):
+    """Counter by hand class of an array of class indexes (see CLASS_OF_CARDS)."""
+    block_counts = np.bincount(classes, minlength=len(HAND_CLASSES))
+    return Counter({HAND_CLASSES[index]: int(count)
+                    for index, count in enumerate(block_counts) if count})
+
+def _accumulate(total, counts):
+    """Sum of 2 arrays of counts, the shorter one padded with zeros along the first axis."""
+    result = np.zeros((max(len(total), len(counts)),) + total.shape[1:])
+    result[:len(total)] += total
+    result[:len(counts)] += counts
     return result
 
-def generate_matrices(win_counter, total_players):
-    """Function to generate matrices"""
-    o_coincidence_matrix = [[0 for _ in range(len(VALUES))] for _ in range(len(VALUES))]
-    o_probability_matrix = [[0 for _ in range(len(VALUES))] for _ in range(len(VALUES))]
-    num_simulations = sum(item[1] for item in win_counter.most_common(len(win_counter)))
-    cases = 1
-    for key, value in win_counter.items():
-        row_rank, col_rank = "", ""
-        if key[2] == "P":
-            row_rank = key[0]
-            col_rank = key[1]
-            cases = P_CASES
-        elif key[2] == "S":
-            row_rank = key[1]
-            col_rank = key[0]
-            cases = S_CASES
-        else:
-            row_rank = key[0]
-            col_rank = key[1]
-            cases = N_CASES
-        row_idx = INVERSE_VALUES.index(row_rank)
-        col_idx = INVERSE_VALUES.index(col_rank)
-        value_probability = value*T_HANDS/(total_players*cases*num_simulations)
-        o_coincidence_matrix[row_idx][col_idx] = value
-        o_probability_matrix[row_idx][col_idx] = value_probability
+def board_textures(community_cards):
+    """BOARD_TEXTURES index of every board of integer encoded community cards (boards, 5)."""
+    suit_counts = (community_cards[:, :, None] & 3) == np.arange(4)
+    suited = np.clip(suit_counts.sum(axis=1).max(axis=1) - 2, 0, 3)
+    ranks = np.sort(community_cards >> 2, axis=1)
+    paired = (np.diff(ranks, axis=1) == 0).any(axis=1)
+    return paired * len(SUIT_TEXTURES) + suited
+
+
+class Aggregate(abc.ABC):
+    """Base of the aggregates computed in a single pass over the simulation files (see
+    aggregate_files). An aggregate reads the fields of the blocks of file_blocks and keeps its
+    results in numpy arrays, the aggregates of several files are merged adding them.
+    n_players keeps only the rows of that number of players of sweep files. In split pot files
+    every hand tied for the best counts 1 / tied."""
+    fields = ("classes",)
+
+    def __init__(self, n_players=None):
+        self.n_players = n_players
+
+    def rows(self, block):
+        """Selected rows of a block (slice or boolean mask) and their weights (None for 1)."""
+        selected = slice(None)
+        if self.n_players is not None and "n_players" in block:
+            selected = block["n_players"] == self.n_players
+        weights = 1 / block["tied"][selected] if "tied" in block else None
+        return selected, weights
+
+    @abc.abstractmethod
+    def update(self, block):
+        """Add a block of rows."""
+
+    def merge(self, other):
+        """Add the arrays of the same aggregate of other files."""
+        for name, value in vars(other).items():
+            if isinstance(value, np.ndarray):
+                setattr(self, name, _accumulate(getattr(self, name), value))
+        return self
+
+    @abc.abstractmethod
+    def report(self, long_report=False):
+        """Print the aggregate as a section of raw_to_matriz_gen."""
+
+
+class ClassWins(Aggregate):
+    """Wins of every hand class (the counts of count_file), per number of players in sweep
+    files, and the boards per number of hands tied in split pot files."""
+
+    def __init__(self, n_players=None):
+        super().__init__(n_players)
+        # Row 0 counts the files without n_players column
+        self.wins = np.zeros((1, len(HAND_CLASSES)))
+        self.ties = np.zeros(1)
+
+    def update(self, block):
+        selected, weights = self.rows(block)
+        classes = block["classes"][selected]
+        players = block["n_players"][selected] if "n_players" in block else 0
+        keys = players * len(HAND_CLASSES) + classes
+        self.wins = _accumulate(self.wins, np.bincount(
+            keys, weights, (keys.max(initial=0) // len(HAND_CLASSES) + 1) * len(HAND_CLASSES)
+        ).reshape(-1, len(HAND_CLASSES)))
+        if weights is not None:
+            self.ties = _accumulate(self.ties, np.bincount(block["tied"][selected], weights))
+
+    def counter(self):
+        """Counter of the wins, as count_file: sweep files with players_key keys and split pot
+        files with fractional wins and TIE_PREFIX keys."""
+        split = bool(self.ties.any())
+        counts = Counter()
+        for players, wins in enumerate(self.wins):
+            for index in np.flatnonzero(wins).tolist():
+                key = HAND_CLASSES[index] if players == 0 else players_key(HAND_CLASSES[index],
+                                                                           players)
+                counts[key] = float(wins[index]) if split else int(wins[index])
+        for tied in np.flatnonzero(self.ties).tolist():
+            if tied > 1:
+                counts[f"{TIE_PREFIX}{tied}"] = float(self.ties[tied])
+        return counts
+
+    def report(self, long_report=False):
+        if long_report:
+            print("Hand classes: wins of every class.")
+        print(Counter(dict(sorted(self.counter().items()))))
+        print()
+
+
+class CategoryWins(Aggregate):
+    """Wins of every winner hand category (HAND_RANKS_REVERSE)."""
+    fields = ("hand_rank",)
+
+    def __init__(self, n_players=None):
+        super().__init__(n_players)
+        self.wins = np.zeros(len(HAND_RANKS_REVERSE) + 1)
+
+    def update(self, block):
+        selected, weights = self.rows(block)
+        self.wins += np.bincount(block["hand_rank"][selected], weights, len(self.wins))
+
+    def report(self, long_report=False):
+        if long_report:
+            print("Winner hand categories: wins and share of the simulations.")
+        total = self.wins.sum()
+        for rank in np.flatnonzero(self.wins).tolist():
+            print(f"{HAND_RANKS_REVERSE[rank - 1]}: {self.wins[rank]:g} "
+                  f"({self.wins[rank] / total:.4f})")
+        print()
+
+
+class ClassCategoryWins(Aggregate):
+    """Wins of every hand class per winner hand category, reported as the probability matrices
+    of winning with every category."""
+    fields = ("classes", "hand_rank")
+
+    def __init__(self, n_players=None):
+        super().__init__(n_players)
+        self.wins = np.zeros((len(HAND_CLASSES), len(HAND_RANKS_REVERSE) + 1))
+
+    def update(self, block):
+        selected, weights = self.rows(block)
+        keys = block["classes"][selected] * self.wins.shape[1] + block["hand_rank"][selected]
+        self.wins += np.bincount(keys, weights, self.wins.size).reshape(self.wins.shape)
+
+    def report(self, long_report=False):
+        simulations = self.wins.sum()
+        for rank in np.flatnonzero(self.wins.sum(axis=0)).tolist():
+            if long_report:
+                print(f"Probability of winning with {HAND_RANKS_REVERSE[rank - 1]}:")
+            else:
+                print(HAND_RANKS_REVERSE[rank - 1])
+            _, probability_matrix = generate_matrices(self.wins[:, rank], self.n_players,
+                                                      simulations)
+            print_matrix(probability_matrix, 0, long_report)
+
+
+class BoardTextureWins(Aggregate):
+    """Wins of every winner hand category per board texture (BOARD_TEXTURES)."""
+    fields = ("hand_rank", "community_cards")
+
+    def __init__(self, n_players=None):
+        super().__init__(n_players)
+        self.wins = np.zeros((len(BOARD_TEXTURES), len(HAND_RANKS_REVERSE) + 1))
+
+    def update(self, block):
+        selected, weights = self.rows(block)
+        keys = (board_textures(block["community_cards"][selected]) * self.wins.shape[1]
+                + block["hand_rank"][selected])
+        self.wins += np.bincount(keys, weights, self.wins.size).reshape(self.wins.shape)
+
+    def report(self, long_report=False):
+        if long_report:
+            print("Board textures: simulations and share of every winner hand category.")
+        categories = np.flatnonzero(self.wins.sum(axis=0)).tolist()
+        print("texture|simulations|" + "|".join(HAND_RANKS_REVERSE[rank - 1]
+                                                for rank in categories))
+        for texture, wins in zip(BOARD_TEXTURES, self.wins):
+            boards = wins.sum()
+            if boards:
+                print(f"{texture}|{boards:g}|" + "|".join(f"{wins[rank] / boards:.4f}"
+                                                          for rank in categories))
+        print()
+
+
+# Aggregates of the --aggregates option
+AGGREGATES = {"categories": CategoryWins, "class_categories": ClassCategoryWins,
+              "textures": BoardTextureWins}
+
+def aggregate_file(file_path, aggregates):
+    """Update the aggregates with every block of a simulation file, read once.
+    Output: the aggregates."""
+    fields = sorted({field for aggregate in aggregates for field in aggregate.fields})
+    for block in file_blocks(file_path, fields):
+        for aggregate in aggregates:
+            aggregate.update(block)
+    return aggregates
+
+def aggregate_files(i_file_list, aggregates, jobs=1):
+    """Compute the aggregates of the files in a single pass over every file, the files are read
+    in jobs processes if jobs > 1. Output: the aggregates."""
+    if jobs > 1 and len(i_file_list) > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            futures = [executor.submit(aggregate_file, file_name, copy.deepcopy(aggregates))
+                       for file_name in i_file_list]
+            for future in futures:
+                for aggregate, file_aggregate in zip(aggregates, future.result()):
+                    aggregate.merge(file_aggregate)
+        return aggregates
+    for file_name in i_file_list:
+        aggregate_file(file_name, aggregates)
+    return aggregates
+
+def count_file(file_path):
+    """Counter of the winner hand classes of a simulation file, CSV or binary records (see
+    ClassWins). Sweep files are counted per number of players, with players_key keys. In split
+    pot files every hand tied for the best counts 1 / tied (a fractional win) and the boards are
+    also counted per number of hands tied, with TIE_PREFIX keys. Stratified files (JSON, see
+    stratified_sampling.py) give the weighted wins and, with WEIGHT_PREFIX keys, the weights of
+    every class."""
+    if file_path.endswith(".json"):
+        with open(file_path, "r", encoding="utf-8") as stratified_file:
+            results = json.load(stratified_file)
+        counts = Counter({STRATIFIED_BOARDS: results["boards"]})
+        for hand_class, cell in results["classes"].items():
+            counts[hand_class] += cell["wins"]
+            counts[f"{WEIGHT_PREFIX}{hand_class}"] += cell["weights"]
+        return counts
+    wins_per_class, = aggregate_file(file_path, [ClassWins()])
+    return wins_per_class.counter()
+
+def process_file(file_path, n_players=None):
+    """Function to process the file. In sweep files only the rows of n_players are kept if
+    given."""
+    result = []
+    for block in file_blocks(file_path, ("classes",)):
+        classes = block["classes"]
+        if n_players is not None and "n_players" in block:
+            classes = classes[block["n_players"] == n_players]
+        result.extend([HAND_CLASSES[index] for index in classes.tolist()])
+    return result
+
+def win_probability(hand_class, wins, total_players, num_simulations):
+    """Probability of winning with a hand class given its wins in num_simulations. A class is
+    dealt to total_players*cases/T_HANDS players per simulation on average."""
+    cases = {"P": P_CASES, "S": S_CASES}.get(hand_class[2], N_CASES)
+    return wins*T_HANDS/(total_players*cases*num_simulations)
+
+def class_wins(win_counter):
+    """Array of the wins of every hand class (HAND_CLASSES order) of a Counter, integer if all
+    the wins are."""
+    return np.array([win_counter.get(hand_class, 0) for hand_class in HAND_CLASSES])
+
+def generate_matrices(win_counter, total_players, num_simulations=None):
+    """Function to generate matrices of 13x13 numpy arrays. win_counter is a Counter or an array
+    of the wins of every hand class (see class_wins), num_simulations is its total by
+    default."""
+    wins = class_wins(win_counter) if isinstance(win_counter, Counter) else win_counter
+    if num_simulations is None:
+        num_simulations = wins.sum()
+    o_coincidence_matrix = np.zeros((len(VALUES), len(VALUES)), dtype=wins.dtype)
+    o_probability_matrix = np.zeros((len(VALUES), len(VALUES)))
+    o_coincidence_matrix[CLASS_ROWS, CLASS_COLUMNS] = wins
+    o_probability_matrix[CLASS_ROWS, CLASS_COLUMNS] = (
+        wins * T_HANDS / (total_players * CLASS_CASES * num_simulations))
     return o_coincidence_matrix, o_probability_matrix
 
 def print_matrix(matrix, threshold=0, long_report=False):
     """Function to print matrices. Threshold is used to set values with low posibility to 0."""
-    min_val, max_val = 0, max(value for row in matrix for value in row)
+    min_val, max_val = 0, matrix.max()
+    integer = np.issubdtype(matrix.dtype, np.integer)
 
     def get_grayscale(value):
         """Helper function for print_matrix.
@@ -93,11 +461,8 @@ def print_matrix(matrix, threshold=0, long_report=False):
         grayscale_level = int(normalized * 255)
         return f"\033[38;2;0;{max(100-grayscale_level,0)};{grayscale_level}m"
 
-    max_width = 1
-    for row in matrix:
-        for value in row:
-            value_lenght = len(f'{value}') if isinstance(value, int) else len(f'{value:.4f}')
-            max_width = max(max_width, value_lenght)
+    max_width = max(len(f'{value}') if integer else len(f'{value:.4f}')
+                    for value in matrix.flat)
 
     print('  ' + ' '.join(f'{rank:>{max_width+1}}' for rank in INVERSE_VALUES))
     for i, rank in enumerate(INVERSE_VALUES):
@@ -108,7 +473,7 @@ def print_matrix(matrix, threshold=0, long_report=False):
                 row.append(f'{"":>{max_width}}')
                 continue
             color_code = get_grayscale(value)
-            f_v = f'{value:>{max_width}}' if isinstance(value, int) else f'{value:>{max_width}.4f}'
+            f_v = f'{value:>{max_width}}' if integer else f'{value:>{max_width}.4f}'
             f_v = f'{f_v}' if long_report else f'{color_code}{f_v}\033[0m'
             row.append(f"{f_v}")
 
@@ -117,8 +482,24 @@ def print_matrix(matrix, threshold=0, long_report=False):
     print("\n")
 
 ## generators
-def report_generator(i_file_list, n_players, output="", report=True):
-    """Take input parameters to make a report file with the required analisys."""
+def file_counts(i_file_list, store_file=None, jobs=1):
+    """Merged Counter of the winner hand classes of the files (see count_file). With store_file
+    the counts of every file are kept in an aggregate store (see aggregate_store.py) and only
+    the new files are parsed, in jobs processes. Output: Counter, files parsed."""
+    if store_file is not None:
+        return AggregateStore(store_file).counts(i_file_list, count_file, jobs)
+    winner_counter = Counter()
+    for file_name in i_file_list:
+        winner_counter.update(count_file(file_name))
+    return winner_counter, list(i_file_list)
+
+def report_generator(i_file_list, n_players, output="", report=True, store_file=None, jobs=1,
+                     counts=None, aggregates=()):
+    """Take input parameters to make a report file with the required analisys.
+    With store_file the counts of every file are kept in an aggregate store (see
+    aggregate_store.py) and only the new files are parsed, in jobs processes.
+    counts is an optional Counter already read with file_counts. aggregates are names of
+    AGGREGATES reported after the matrices, computed in the same pass over the files."""
     if report:
         if output=="":
             file_path = os.getenv("POKER_OUT_FILE_PATH", "") + "reports\\"
@@ -132,40 +513,78 @@ def report_generator(i_file_list, n_players, output="", report=True):
         with open(file_name, "w", encoding="utf-8") as report_file:
             previous_output = sys.stdout
             sys.stdout = report_file
-            raw_to_matriz_gen(i_file_list, n_players, long_report=True)
+            raw_to_matriz_gen(i_file_list, n_players, long_report=True,
+                              store_file=store_file, jobs=jobs, counts=counts,
+                              aggregates=aggregates)
             sys.stdout = previous_output
         return
 
-    raw_to_matriz_gen(i_file_list, n_players)
+    raw_to_matriz_gen(i_file_list, n_players, store_file=store_file, jobs=jobs, counts=counts,
+                      aggregates=aggregates)
     return
 
+def sweep_report_generator(i_file_list, output="", report=True, store_file=None, jobs=1):
+    """report_generator for every number of players found in sweep files, the files are read
+    once."""
+    counts, _ = file_counts(i_file_list, store_file, jobs)
+    for n_players in counter_players(counts):
+        report_generator(i_file_list, n_players, output, report, counts=counts)
+
 
 
-def raw_to_matriz_gen(i_file_list, n_players, long_report=False):
+def raw_to_matriz_gen(i_file_list, n_players, long_report=False, store_file=None, jobs=1,
+                      counts=None, aggregates=()):
     """Function raw_to_matriz_gen. Based on an input file list and the number of players based
-        on the simulations create a report of the card wins and the pobability of winning."""
+        on the simulations create a report of the card wins and the pobability of winning.
+        store_file, jobs, counts and aggregates as in report_generator. Sweep files only count
+        the simulations of n_players. With aggregates every file is read once for the counts
+        and all the aggregates, without the aggregate store."""
     if long_report:
         print("In raw_to_matriz_gen from data_science.py")
         print(f"input: \n Files: {i_file_list}, \n number of Players: {n_players}")
 
-    winner_counter = Counter()
-    for file_name in i_file_list:
-        winner_counter += Counter(process_file(file_name))
-        simulations_read = sum(item[1] for item in winner_counter.most_common(len(winner_counter)))
+    if aggregates and any(file_name.endswith(".json") for file_name in i_file_list):
+        raise ValueError(STRATIFIED_AGGREGATES)
+    extra_aggregates = [AGGREGATES[name](n_players) for name in aggregates]
+    if extra_aggregates and counts is None:
+        wins_per_class = ClassWins()
+        aggregate_files(i_file_list, [wins_per_class] + extra_aggregates, jobs)
+        counts = wins_per_class.counter()
+    elif extra_aggregates:
+        aggregate_files(i_file_list, extra_aggregates, jobs)
+    if counts is None:
+        counts, parsed_files = file_counts(i_file_list, store_file, jobs)
+        if long_report and store_file is not None:
+            print(f"Aggregate store: {store_file}, files parsed: {len(parsed_files)}, "
+                  f"files from the store: {len(i_file_list) - len(parsed_files)}")
+    winner_counter = stratified_counter(counts, n_players)
+    stratified = winner_counter is not None
+    if not stratified:
+        winner_counter = players_counter(counts, n_players)
+    simulations_read = sum(winner_counter.values())
+    split_pots = tie_counter(counts)
     if long_report:
         print("Wins counter per card combinations.")
         print("Combination format: [card_a][card_b][combination_type].")
         print("Combination types: P=Pairs ; S=Suits ; N=Non pairs or suits.")
         print()
-    print(winner_counter)
+    # Sorted by wins and then by class, the same for any order of the files or counts
+    print(Counter(dict(sorted(winner_counter.items()))))
 
     if long_report:
         print(f"Number of combinations: {len(winner_counter)}")
-        print(f"Number of simulations found: {simulations_read}")
+        print(f"Number of simulations found: {simulations_read:g}")
+        if stratified:
+            print(f"Stratified samples of {counts[STRATIFIED_BOARDS]} boards, the wins are the "
+                  "weighted estimates of every class (see stratified_sampling.py).")
+        if split_pots:
+            print("Split pots, every hand tied for the best wins 1/tied of the simulation.")
+            print(f"Boards per number of hands tied: {dict(sorted(split_pots.items()))}")
         print()
         print()
 
-    coincidence_matrix, probability_matrix = generate_matrices(winner_counter, n_players)
+    coincidence_matrix, probability_matrix = generate_matrices(
+        winner_counter, n_players, counts[STRATIFIED_BOARDS] if stratified else None)
 
     if long_report:
         print("Coincidence matrix:")
@@ -190,6 +609,8 @@ def raw_to_matriz_gen(i_file_list, n_players, long_report=False):
             print(f"Threshold: {threshold}")
         print_matrix(probability_matrix, threshold, long_report)
     print()
+    for aggregate in extra_aggregates:
+        aggregate.report(long_report)
 
 
 if __name__ == "__main__":
@@ -197,14 +618,23 @@ if __name__ == "__main__":
 
     parser = argparse.ArgumentParser(
         description='Data Analysis App for Monte Carlo Poker simulations.')
-    parser.add_argument('number_of_players')
+    parser.add_argument('number_of_players',
+                        help='number of players, or sweep for a report of every number of '
+                             'players of the sweep files')
     parser.add_argument('-f', '--file')
     parser.add_argument('-o', '--output_path')
     parser.add_argument('-l', '--list_file')
+    parser.add_argument('-s', '--store_file',
+                        help='aggregate store, only files not in the store are parsed')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='processes to parse the new files')
+    parser.add_argument('-a', '--aggregates', nargs='+', choices=list(AGGREGATES), default=[],
+                        help='also report these aggregates, computed in the same pass over the '
+                             'files (without the aggregate store)')
     args = parser.parse_args()
 
     print(args)
-    numner_players = int(args.number_of_players)
+    numner_players = args.number_of_players
 
     input_file_list = [args.file] if args.file is not None else []
     if args.list_file is not None:
@@ -212,8 +642,17 @@ if __name__ == "__main__":
             for line in input_list_file:
                 input_file_list.append(line.strip())
 
-    output_path = [args.output_path] if args.output_path is not None else ""
+    output_path = args.output_path if args.output_path is not None else ""
 
     print(f"numner_players: {numner_players}, output_path: {output_path}")
     print(f"input_file_list: {input_file_list}")
-    report_generator(input_file_list, numner_players, output_path)
+    if args.aggregates and numner_players == "sweep":
+        parser.error("--aggregates needs a number of players.")
+    if args.aggregates and any(file_name.endswith(".json") for file_name in input_file_list):
+        parser.error(STRATIFIED_AGGREGATES)
+    if numner_players == "sweep":
+        sweep_report_generator(input_file_list, output_path, store_file=args.store_file,
+                               jobs=args.jobs)
+    else:
+        report_generator(input_file_list, int(numner_players), output_path,
+                         store_file=args.store_file, jobs=args.jobs, aggregates=args.aggregates)
@@ -0,0 +1,91 @@
+"""
+dealer.py. Deals boards and hole cards from a preallocated deck of integer encoded cards
+(see hand_evaluator.py).
+deal shuffles only the cards it needs in place (partial Fisher-Yates), so a board with N players
+moves 5 + 2N cards instead of building, filtering and sampling a deck of strings. deal_batch
+deals many boards at once from a numpy Generator.
+With more than 23 players the 47 cards left are not enough, so as in
+monte_carlo.all_possible_hands the hands are taken in random order from the 1081 possible hands
+of the cards left, and the cards repeat between players. More than MAX_HANDS (1081) players
+raise ValueError.
+"""
+import random
+
+import numpy as np
+
+from combos import PAIR_POSITIONS, PAIR_POSITIONS_LIST
+
+DECK_SIZE = 52
+BOARD_SIZE = 5
+REMAINING_CARDS = DECK_SIZE - BOARD_SIZE
+MAX_DISTINCT_HANDS = REMAINING_CARDS // 2
+MAX_HANDS = len(PAIR_POSITIONS_LIST)
+
+
+def check_hands(number_of_hands):
+    """Raise ValueError if there are not number_of_hands different hole pairs to deal."""
+    if number_of_hands > MAX_HANDS:
+        raise ValueError(f"Cannot deal {number_of_hands} hands, the {REMAINING_CARDS} cards left "
+                         f"by the board make {MAX_HANDS} hands.")
+
+
+class Dealer:
+    """Dealer of integer encoded cards. deal draws from random (the random module, seeded with
+    random.seed) or from a random.Random of seed. deal_batch draws from rng, a numpy Generator."""
+
+    def __init__(self, seed=None, rng=None):
+        self.random = random if seed is None else random.Random(seed)
+        self.seed = seed
+        self.rng = rng
+        self.deck = list(range(DECK_SIZE))
+        self.pair_order = None
+        self.batch_decks = np.empty((0, DECK_SIZE), dtype=np.int64)
+
+    def _shuffle_prefix(self, items, count):
+        """Partial Fisher-Yates: move count random items of items to its first positions."""
+        uniform = self.random.random
+        size = len(items)
+        for i in range(count):
+            j = i + int(uniform() * (size - i))
+            items[i], items[j] = items[j], items[i]
+
+    def deal(self, number_of_hands=9):
+        """Deal a board and number_of_hands hole pairs.
+        Output: community_cards (list of 5 cards) and hands (list of tuples of 2 cards)."""
+        deck = self.deck
+        if number_of_hands <= MAX_DISTINCT_HANDS:
+            end = BOARD_SIZE + 2 * number_of_hands
+            self._shuffle_prefix(deck, end)
+            return deck[:BOARD_SIZE], list(zip(deck[BOARD_SIZE:end:2], deck[BOARD_SIZE + 1:end:2]))
+        check_hands(number_of_hands)
+        self._shuffle_prefix(deck, BOARD_SIZE)
+        remaining = deck[BOARD_SIZE:]
+        if self.pair_order is None:
+            self.pair_order = list(range(len(PAIR_POSITIONS_LIST)))
+        order = self.pair_order
+        self._shuffle_prefix(order, number_of_hands)
+        pairs = PAIR_POSITIONS_LIST
+        return deck[:BOARD_SIZE], [(remaining[pairs[index][0]], remaining[pairs[index][1]])
+                                   for index in order[:number_of_hands]]
+
+    def deal_batch(self, batch_size, number_of_hands=9):
+        """Deal batch_size boards with number_of_hands players each.
+        Output: community_cards array (batch_size, 5) and hands array
+        (batch_size, number_of_hands, 2)."""
+        check_hands(number_of_hands)
+        if self.rng is None:
+            self.rng = np.random.default_rng(self.seed)
+        if len(self.batch_decks) != batch_size:
+            self.batch_decks = np.tile(np.arange(DECK_SIZE), (batch_size, 1))
+        # Shuffling the previous shuffle in place is as random as shuffling a new deck
+        decks = self.rng.permuted(self.batch_decks, axis=1, out=self.batch_decks)
+        community_cards = decks[:, :BOARD_SIZE].copy()
+        if number_of_hands <= MAX_DISTINCT_HANDS:
+            hands = decks[:, BOARD_SIZE:BOARD_SIZE + number_of_hands * 2].reshape(
+                batch_size, number_of_hands, 2).copy()
+            return community_cards, hands
+        order = self.rng.random((batch_size, len(PAIR_POSITIONS))).argsort(axis=1)[
+            :, :number_of_hands]
+        hands = np.take_along_axis(decks[:, BOARD_SIZE:, None],
+                                   PAIR_POSITIONS[order].reshape(batch_size, -1, 1), axis=1)
+        return community_cards, hands.reshape(batch_size, number_of_hands, 2)
@@ -0,0 +1,211 @@
+"""
+enumerate_hands.py. Exhaustive enumeration of all the 133,784,560 seven card hands, counting the
+hand categories with an evaluator and checking them against the known frequencies.
+The hands are enumerated by their 2 lowest cards (1326 prefixes, less with a smaller deck), the
+5 higher cards of every prefix come from a table of the 5 card combinations in colexicographic
+order, where the combinations of the n lowest cards are its first C(n, 5) rows. The prefixes are
+the work chunks of a process pool, every chunk evaluates its hands in numpy batches of
+BATCH_HANDS, and the progress is printed as the chunks finish.
+The evaluator is hand_evaluator.evaluate_batch by default, any other one can be plugged in by
+name (see EVALUATORS) or as module:function, a function taking an (hands, 7) array of integer
+encoded cards and returning their integer strengths. With --reference every hand is also
+evaluated with monte_carlo.evaluate_full_hand, the pure Python reference, and the evaluations
+are compared (a long run, about 200 times slower than the enumeration alone).
+--deck enumerates the hands of the lowest cards only (no known frequencies), for quick checks.
+Usage:
+    python enumerate_hands.py [-e EVALUATOR] [--reference] [-w WORKERS] [--deck DECK_SIZE]
+                              [-o OUTPUT]
+"""
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import importlib
+import itertools
+import json
+import math
+import os
+import sys
+import time
+
+import numpy as np
+
+from hand_evaluator import (CARD_NAMES, HAND_RANKS_REVERSE, evaluate_batch, evaluate_cards,
+                            pack_strength)
+from monte_carlo import evaluate_full_hand
+
+BATCH_HANDS = 1 << 20
+# Mismatches kept as examples per chunk with --reference
+MAX_EXAMPLES = 5
+# Known hands of every category (hand rank 1 to 10) of the 52 card deck, the 41,584 straight
+# flushes are 37,260 plus 4,324 royal flushes
+KNOWN_CATEGORY_COUNTS = [0, 23294460, 58627800, 31433400, 6461620, 6180020, 4047644, 3473184,
+                         224848, 37260, 4324]
+TOTAL_HANDS = math.comb(52, 7)
+# 5 card combinations of the 50 cards above the lowest prefix (2 cards), in colexicographic
+# order
+_lex = np.fromiter(itertools.chain.from_iterable(itertools.combinations(range(50), 5)),
+                   dtype=np.int8).reshape(-1, 5)
+SUFFIXES = _lex[np.lexsort(_lex.T)]
+del _lex
+
+
+def _per_hand(function):
+    """Evaluator of (hands, 7) arrays from a function evaluating a list of 7 cards."""
+    return lambda hands: np.array([function(cards) for cards in hands.tolist()],
+                                  dtype=np.int64)
+
+
+EVALUATORS = {"batch": lambda: evaluate_batch,
+              "cards": lambda: _per_hand(evaluate_cards)}
+
+
+def load_evaluator(name):
+    """Evaluator of (hands, 7) arrays of a name of EVALUATORS or of a module:function."""
+    if name in EVALUATORS:
+        return EVALUATORS[name]()
+    module_name, _, function_name = name.partition(":")
+    if not function_name:
+        raise ValueError(f"Unknown evaluator {name}, use {', '.join(EVALUATORS)} or "
+                         "module:function.")
+    return getattr(importlib.import_module(module_name), function_name)
+
+
+def reference_strengths(hands):
+    """Integer strengths of monte_carlo.evaluate_full_hand for an (hands, 7) array."""
+    return np.array([pack_strength(*evaluate_full_hand([CARD_NAMES[card] for card in cards]))
+                     for cards in hands.tolist()], dtype=np.int64)
+
+
+def prefixes(deck_size=52):
+    """The 2 lowest cards of the 7 card hands of a deck, with the number of their hands."""
+    return [(first, second, math.comb(deck_size - second - 1, 5))
+            for first, second in itertools.combinations(range(deck_size - 5), 2)]
+
+
+def enumerate_chunk(first, second, deck_size=52, evaluator="batch", reference=False):
+    """Evaluate all the hands with first and second as lowest cards.
+    Output: hands per category (hand rank 1 to 10), number of hands, number of mismatches with
+    the reference and up to MAX_EXAMPLES of them as (cards, strength, reference strength)."""
+    evaluate = load_evaluator(evaluator)
+    suffixes = SUFFIXES[:math.comb(deck_size - second - 1, 5)]
+    counts = np.zeros(len(KNOWN_CATEGORY_COUNTS), dtype=np.int64)
+    mismatches, examples = 0, []
+    for start in range(0, len(suffixes), BATCH_HANDS):
+        batch = suffixes[start:start + BATCH_HANDS]
+        hands = np.empty((len(batch), 7), dtype=np.int64)
+        hands[:, 0], hands[:, 1] = first, second
+        hands[:, 2:] = batch + (second + 1)
+        strengths = np.asarray(evaluate(hands), dtype=np.int64)
+        counts += np.bincount(strengths >> 20, minlength=len(counts))
+        if reference:
+            expected = reference_strengths(hands)
+            different = np.flatnonzero(strengths != expected)
+            mismatches += len(different)
+            examples.extend(([CARD_NAMES[card] for card in hands[row].tolist()],
+                             int(strengths[row]), int(expected[row]))
+                            for row in different[:MAX_EXAMPLES - len(examples)].tolist())
+    return counts, len(suffixes), mismatches, examples
+
+
+def enumerate_hands(evaluator="batch", reference=False, workers=None, deck_size=52,
+                    progress=True):
+    """Enumerate all the 7 card hands of the deck_size lowest cards in a pool of workers
+    processes (one process without pool for workers=1), printing the progress if progress.
+    Output: dictionary with the hands per category, the number of hands, the mismatches with
+    the reference and their examples, and the seconds of the run."""
+    workers = workers or os.cpu_count()
+    chunks = prefixes(deck_size)
+    total = sum(hands for _, _, hands in chunks)
+    counts = np.zeros(len(KNOWN_CATEGORY_COUNTS), dtype=np.int64)
+    result = {"hands": 0, "mismatches": 0, "examples": []}
+    start = last_report = time.time()
+
+    def add(chunk_result):
+        chunk_counts, hands, mismatches, examples = chunk_result
+        counts[:] += chunk_counts
+        result["hands"] += hands
+        result["mismatches"] += mismatches
+        result["examples"].extend(examples[:MAX_EXAMPLES - len(result["examples"])])
+
+    def report(final=False):
+        nonlocal last_report
+        if progress and (final or time.time() - last_report >= 5):
+            elapsed = time.time() - start
+            rate = result["hands"] / elapsed if elapsed else 0
+            print(f"{result['hands']}/{total} hands ({100 * result['hands'] / total:.1f}%), "
+                  f"{rate / 1e6:.2f}M hands/second, "
+                  f"ETA {(total - result['hands']) / rate if rate else 0:.0f} seconds.")
+            sys.stdout.flush()
+            last_report = time.time()
+
+    if workers == 1:
+        for first, second, _ in chunks:
+            add(enumerate_chunk(first, second, deck_size, evaluator, reference))
+            report()
+    else:
+        # The largest chunks first, so the last ones keep every worker busy
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(enumerate_chunk, first, second, deck_size, evaluator,
+                                       reference)
+                       for first, second, _ in sorted(chunks, key=lambda chunk: -chunk[2])]
+            for future in as_completed(futures):
+                add(future.result())
+                report()
+    report(final=True)
+    result["categories"] = counts.tolist()
+    result["seconds"] = time.time() - start
+    return result
+
+
+def check_categories(categories):
+    """Compare the hands per category with KNOWN_CATEGORY_COUNTS.
+    Output: list of (category name, count, known count) of the different categories."""
+    return [(HAND_RANKS_REVERSE[rank - 1], categories[rank], known)
+            for rank, known in enumerate(KNOWN_CATEGORY_COUNTS)
+            if rank and categories[rank] != known]
+
+
+def print_categories(result, deck_size=52):
+    """Print the hands per category, against the known frequencies with the full deck."""
+    known = deck_size == 52
+    rows = [(HAND_RANKS_REVERSE[rank - 1], result["categories"][rank], KNOWN_CATEGORY_COUNTS[rank])
+            for rank in range(len(KNOWN_CATEGORY_COUNTS) - 1, 0, -1)]
+    rows.append(("total", result["hands"], TOTAL_HANDS))
+    print("category|hands|frequency" + ("|known|check" if known else ""))
+    for category, count, known_count in rows:
+        row = f"{category}|{count}|{count / result['hands']:.8f}"
+        if known:
+            row += f"|{known_count}|{'ok' if count == known_count else 'DIFFERENT'}"
+        print(row)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Exhaustive enumeration of the 7 card hands to validate the evaluators.')
+    parser.add_argument('-e', '--evaluator', default="batch",
+                        help=f'{", ".join(EVALUATORS)} or module:function evaluating an '
+                             f'(hands, 7) array of integer encoded cards')
+    parser.add_argument('--reference', action='store_true',
+                        help='compare every evaluation with monte_carlo.evaluate_full_hand')
+    parser.add_argument('-w', '--workers', type=int,
+                        help='processes of the pool, the number of CPUs by default')
+    parser.add_argument('--deck', type=int, default=52,
+                        help='enumerate the hands of the lowest cards of the deck only')
+    parser.add_argument('-o', '--output', help='save the results in this JSON file')
+    args = parser.parse_args()
+    if not 7 <= args.deck <= 52:
+        parser.error("--deck needs 7 to 52 cards.")
+
+    enumeration = enumerate_hands(args.evaluator, args.reference, args.workers, args.deck)
+    print_categories(enumeration, args.deck)
+    different_categories = check_categories(enumeration["categories"]) if args.deck == 52 else []
+    if args.reference:
+        print(f"Mismatches with evaluate_full_hand: {enumeration['mismatches']}")
+        for cards, strength, expected_strength in enumeration["examples"]:
+            print(f"{','.join(cards)}: {strength} instead of {expected_strength}")
+    print(f"Execution time: {enumeration['seconds']:.1f} seconds")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output_file:
+            json.dump(enumeration, output_file, indent=1)
+        print("file_name:", args.output)
+    if different_categories or enumeration["mismatches"]:
+        sys.exit(1)
@@ -0,0 +1,319 @@
+"""
+equity_server.py. asyncio server answering equity queries for real time analysis.
+A query gives the hole cards, the known board (0 to 5 cards) and the number of opponents, the
+answer is the win, tie and equity (win plus the shares of the split pots) probabilities,
+estimated by simulating the unknown cards. It is served as HTTP on localhost or on a Unix socket:
+    GET /equity?hand=AS,KS&board=2C,7D,9H&opponents=2[&samples=20000][&deadline_ms=200]
+    GET /stats
+The queries waiting at the same time are simulated together, every round deals a chunk of
+samples for each of them and evaluates all the 7 card hands in a single
+hand_evaluator.evaluate_batch call (same results as monte_carlo.evaluate_full_hand). Identical
+queries in flight share one simulation, every request waiting for it keeps its own samples and
+deadline and is answered with the samples simulated when it reaches one of them, after at least
+one round. The finished results are kept in a bounded LRU cache (lru.py) keyed by the canonical
+query: the data_science.classify_hand class (combos.py) of the hole cards before the flop, the
+cards with the suits renamed to their smallest form (suit isomorphism) after it. A query
+needing more samples than its cached result continues the simulation from them.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+from time import perf_counter_ns
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+
+from combos import CLASS_OF_CARDS, HAND_CLASSES
+from hand_evaluator import CARD_INDEX, evaluate_batch
+from instrumentation import Instrumentation
+from lru import LRUCache
+
+DEFAULT_SAMPLES = 20000
+DEFAULT_DEADLINE_MS = 200
+CHUNK_SAMPLES = 2000
+MAX_OPPONENTS = 22
+SUIT_PERMUTATIONS = list(itertools.permutations(range(4)))
+
+
+def parse_query(hand, board="", opponents=1):
+    """Validate a query of string cards. Output: hand and board as integer encoded cards and the
+    number of opponents. Raises ValueError for invalid queries."""
+    hand_cards = [card for card in hand.split(",") if card]
+    board_cards = [card for card in board.split(",") if card]
+    unknown = [card for card in hand_cards + board_cards if card not in CARD_INDEX]
+    if unknown:
+        raise ValueError(f"Unknown cards {unknown}, use cards as AS,KD.")
+    if len(hand_cards) != 2 or len(board_cards) not in (0, 3, 4, 5):
+        raise ValueError("Use 2 hole cards and 0, 3, 4 or 5 board cards.")
+    if len(set(hand_cards + board_cards)) != len(hand_cards) + len(board_cards):
+        raise ValueError("Repeated cards.")
+    opponents = int(opponents)
+    if not 1 <= opponents <= MAX_OPPONENTS:
+        raise ValueError(f"Use 1 to {MAX_OPPONENTS} opponents.")
+    return ([CARD_INDEX[card] for card in hand_cards], [CARD_INDEX[card] for card in board_cards],
+            opponents)
+
+
+def canonical_query(hand, board, opponents):
+    """Cache key of a query: hand class before the flop, after it the sorted hand and board
+    cards with the smallest renaming of the suits, the same for all the suit isomorphic
+    queries."""
+    if not board:
+        return HAND_CLASSES[CLASS_OF_CARDS[hand[0], hand[1]]], opponents
+    return min((tuple(sorted(card & ~3 | suits[card & 3] for card in hand)),
+                tuple(sorted(card & ~3 | suits[card & 3] for card in board)))
+               for suits in SUIT_PERMUTATIONS) + (opponents,)
+
+
+def deal_samples(rng, hand, board, opponents, samples):
+    """Deal the unknown cards of samples simulations of a query.
+    Output: (samples, 1 + opponents, 7) integer encoded cards, the hero hand first."""
+    remaining = np.setdiff1d(np.arange(52), hand + board)
+    missing = 5 - len(board)
+    unknown = rng.permuted(np.tile(remaining, (samples, 1)), axis=1)[:, :missing + 2 * opponents]
+    boards = np.concatenate([np.tile(board, (samples, 1)).astype(unknown.dtype),
+                             unknown[:, :missing]], axis=1)
+    hole_cards = np.concatenate([np.tile(hand, (samples, 1)), unknown[:, missing:]],
+                                axis=1).reshape(samples, 1 + opponents, 2)
+    return np.concatenate(
+        [np.broadcast_to(boards[:, None, :], (samples, 1 + opponents, 5)), hole_cards], axis=2)
+
+
+def score_samples(strengths):
+    """Wins, ties and equity (sum of the pot shares) of the hero, strengths column 0, in an array
+    of strengths (samples, 1 + opponents)."""
+    best_opponent = strengths[:, 1:].max(axis=1)
+    hero = strengths[:, 0]
+    tied = hero == best_opponent
+    shares = np.where(tied, 1 / (1 + (strengths[:, 1:] == hero[:, None]).sum(axis=1)), 0)
+    wins = int((hero > best_opponent).sum())
+    return wins, int(tied.sum()), wins + float(shares.sum())
+
+
+class Waiter:
+    """A request waiting for a query in flight, with its own samples and deadline. rounds is the
+    number of rounds of the query when the request joined it."""
+
+    def __init__(self, samples, deadline, rounds):
+        self.samples = samples
+        self.deadline = deadline
+        self.rounds = rounds
+        self.future = asyncio.get_running_loop().create_future()
+
+
+class EquityQuery:
+    """A query in flight, shared by the identical requests waiting for it. cached is an optional
+    result of the same query (see result), the simulation continues from its samples."""
+
+    def __init__(self, hand, board, opponents, cached=None):
+        self.hand, self.board, self.opponents = hand, board, opponents
+        self.samples = self.wins = self.ties = self.rounds = 0
+        self.equity = 0.0
+        if cached is not None:
+            self.samples = cached["samples"]
+            self.wins = round(cached["win"] * self.samples)
+            self.ties = round(cached["tie"] * self.samples)
+            self.equity = cached["equity"] * self.samples
+        self.waiters = []
+
+    def target_samples(self):
+        """Samples of the request waiting for the most of them."""
+        return max(waiter.samples for waiter in self.waiters)
+
+    def result(self):
+        """Probabilities estimated so far as a dictionary."""
+        samples = max(self.samples, 1)
+        return {"win": self.wins / samples, "tie": self.ties / samples,
+                "equity": self.equity / samples, "samples": self.samples}
+
+
+class EquityServer:
+    """Batched simulation of the equity queries with a result cache."""
+
+    def __init__(self, cache_size=4096, samples=DEFAULT_SAMPLES,
+                 deadline_ms=DEFAULT_DEADLINE_MS, chunk_samples=CHUNK_SAMPLES, seed=None):
+        self.cache = LRUCache(cache_size)
+        self.samples = samples
+        self.deadline_ms = deadline_ms
+        self.chunk_samples = chunk_samples
+        self.rng = np.random.default_rng(seed)
+        self.active = {}
+        self.pending = asyncio.Event()
+        self.instrumentation = Instrumentation()
+        self.counters = {"requests": 0, "errors": 0, "coalesced": 0, "rounds": 0,
+                         "samples": 0, "deadline_stops": 0, "failed_rounds": 0}
+        self.batcher = None
+
+    def start(self):
+        """Start the simulation task, called from the running event loop."""
+        self.batcher = asyncio.create_task(self._simulate())
+
+    async def equity(self, hand, board, opponents, samples=None, deadline_ms=None):
+        """Equity of a validated query (see parse_query) as a dictionary, from the cache or
+        simulated until samples or deadline_ms, after at least one round. Identical queries in
+        flight share the simulation, each request with its own samples and deadline."""
+        samples = self.samples if samples is None else samples
+        deadline_ms = self.deadline_ms if deadline_ms is None else deadline_ms
+        key = canonical_query(hand, board, opponents)
+        cached = self.cache.get(key)
+        if cached is not None and cached["samples"] >= samples:
+            return dict(cached, cached=True)
+        deadline = asyncio.get_running_loop().time() + deadline_ms / 1000
+        query = self.active.get(key)
+        if query is None:
+            query = self.active[key] = EquityQuery(hand, board, opponents, cached)
+            self.pending.set()
+        else:
+            self.counters["coalesced"] += 1
+            if query.samples >= samples:
+                return dict(query.result(), cached=False)
+        waiter = Waiter(samples, deadline, query.rounds)
+        query.waiters.append(waiter)
+        return dict(await waiter.future, cached=False)
+
+    def _simulate_round(self, queries):
+        """Simulate one chunk of samples of every query with a single evaluate_batch call."""
+        deals = [deal_samples(self.rng, query.hand, query.board, query.opponents,
+                              min(self.chunk_samples,
+                                  max(1, query.target_samples() - query.samples)))
+                 for query in queries]
+        strengths = evaluate_batch(np.concatenate([deal.reshape(-1, 7) for deal in deals]))
+        offset = 0
+        for query, deal in zip(queries, deals):
+            size = deal.shape[0] * deal.shape[1]
+            wins, ties, equity = score_samples(
+                strengths[offset:offset + size].reshape(deal.shape[:2]))
+            offset += size
+            query.samples += deal.shape[0]
+            query.wins += wins
+            query.ties += ties
+            query.equity += equity
+            query.rounds += 1
+        return sum(deal.shape[0] for deal in deals)
+
+    async def _simulate(self):
+        """Simulation rounds while there are queries in flight. If a round fails, the requests
+        waiting for its queries get the error and the next queries are simulated."""
+        loop = asyncio.get_running_loop()
+        while True:
+            await self.pending.wait()
+            self.pending.clear()
+            while self.active:
+                start = perf_counter_ns()
+                queries = list(self.active.values())
+                try:
+                    self.counters["samples"] += await loop.run_in_executor(
+                        None, self._simulate_round, queries)
+                except Exception as error:  # pylint: disable=broad-except
+                    self.counters["failed_rounds"] += 1
+                    for query in queries:
+                        for waiter in query.waiters:
+                            if not waiter.future.done():
+                                waiter.future.set_exception(error)
+                    self.active = {key: query for key, query in self.active.items()
+                                   if query not in queries}
+                    continue
+                self.counters["rounds"] += 1
+                self.instrumentation.record("round", start, len(queries))
+                self._answer_waiters(loop.time())
+
+    def _answer_waiters(self, now):
+        """Answer the requests which reached their samples, or their deadline after at least
+        one round, and end the queries without requests left, keeping their results in the
+        cache."""
+        for key, query in list(self.active.items()):
+            waiting = []
+            for waiter in query.waiters:
+                if waiter.future.done():
+                    continue
+                if query.samples >= waiter.samples or (now >= waiter.deadline
+                                                       and query.rounds > waiter.rounds):
+                    if query.samples < waiter.samples:
+                        self.counters["deadline_stops"] += 1
+                    waiter.future.set_result(query.result())
+                else:
+                    waiting.append(waiter)
+            query.waiters = waiting
+            if not waiting:
+                cached = self.cache.get(key)
+                if cached is None or cached["samples"] < query.samples:
+                    self.cache.put(key, query.result())
+                del self.active[key]
+
+    def stats(self):
+        """Counters, cache statistics and latency percentiles as a dictionary."""
+        return {"counters": self.counters, "active_queries": len(self.active),
+                "cache": self.cache.stats(), "timers": self.instrumentation.summary()}
+
+    async def handle(self, reader, writer):
+        """Answer one HTTP request of a connection."""
+        start = perf_counter_ns()
+        status, body = 200, {}
+        try:
+            request_line = (await reader.readline()).decode("latin-1").split()
+            while (await reader.readline()).strip():
+                pass
+            if len(request_line) < 2 or request_line[0] != "GET":
+                raise ValueError("Only GET requests are supported.")
+            url = urlsplit(request_line[1])
+            parameters = {name: values[-1] for name, values in parse_qs(url.query).items()}
+            if url.path == "/stats":
+                body = self.stats()
+            elif url.path == "/equity":
+                self.counters["requests"] += 1
+                hand, board, opponents = parse_query(parameters.get("hand", ""),
+                                                     parameters.get("board", ""),
+                                                     parameters.get("opponents", 1))
+                samples = parameters.get("samples")
+                deadline_ms = parameters.get("deadline_ms")
+                body = await self.equity(hand, board, opponents,
+                                         None if samples is None else max(1, int(samples)),
+                                         None if deadline_ms is None else float(deadline_ms))
+                self.instrumentation.record("request", start)
+            else:
+                status, body = 404, {"error": f"Unknown path {url.path}, use /equity or /stats."}
+        except ValueError as error:
+            self.counters["errors"] += 1
+            status, body = 400, {"error": str(error)}
+        except Exception as error:  # pylint: disable=broad-except
+            self.counters["errors"] += 1
+            status, body = 500, {"error": f"Simulation failed: {error!r}"}
+        data = json.dumps(body).encode("utf-8")
+        reason = {200: "OK", 400: "Bad Request", 404: "Not Found",
+                  500: "Internal Server Error"}[status]
+        writer.write(f"HTTP/1.1 {status} {reason}\r\nContent-Type: application/json\r\n"
+                     f"Content-Length: {len(data)}\r\nConnection: close\r\n\r\n".encode("latin-1")
+                     + data)
+        await writer.drain()
+        writer.close()
+
+
+async def serve(equity_server, host="127.0.0.1", port=8765, unix_socket=None):
+    """Run equity_server on localhost host:port, or on unix_socket if given."""
+    equity_server.start()
+    if unix_socket is not None:
+        server = await asyncio.start_unix_server(equity_server.handle, path=unix_socket)
+    else:
+        server = await asyncio.start_server(equity_server.handle, host, port)
+    print("serving on", unix_socket or f"http://{host}:{port}")
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Equity server for real time analysis.')
+    parser.add_argument('--host', default="127.0.0.1")
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--unix_socket', help='serve on this Unix socket instead of TCP')
+    parser.add_argument('--cache_size', type=int, default=4096,
+                        help='results kept in the LRU cache')
+    parser.add_argument('--samples', type=int, default=DEFAULT_SAMPLES,
+                        help='default samples per query')
+    parser.add_argument('--deadline_ms', type=float, default=DEFAULT_DEADLINE_MS,
+                        help='default deadline per query in milliseconds')
+    parser.add_argument('-s', '--seed', type=int)
+    args = parser.parse_args()
+    asyncio.run(serve(EquityServer(args.cache_size, args.samples, args.deadline_ms,
+                                   seed=args.seed),
+                      args.host, args.port, args.unix_socket))
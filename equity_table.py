@@ -0,0 +1,220 @@
+"""
+equity_table.py. Precomputed equity table with constant time lookups.
+The table is a binary file: a JSON header followed by a float32 array with shape
+(players, 1 + flops, 169, 3). The players axis holds the player counts listed in the header,
+the flop axis holds the preflop values (index 0) and, optionally, one entry per canonical flop
+(suit isomorphism class, 1755 flops), the class axis follows data_science.HAND_CLASSES and the
+last axis is (win, tie, samples). samples are the simulations of the entry, or in the tables of
+the exact enumeration (preflop_equity.py) the boards enumerated for every class.
+The loader memory maps the values, so the processes using the same file share one copy and
+only the pages read are loaded.
+"""
+import argparse
+from functools import lru_cache
+import itertools
+import json
+import mmap
+import os
+import struct
+
+import numpy as np
+
+from combos import COMBO_CLASSES, COMBO_MASKS, HAND_CLASSES, HAND_CLASS_INDEX, cards_mask
+from data_science import classify_hand, file_blocks
+from hand_evaluator import CARD_INDEX
+from preflop_equity import (MORE_PLAYERS, SUPPORTED_PLAYERS, canonical_board_key,
+                            canonical_boards, exact_preflop_equity)
+
+MAGIC = b"PKEQ"
+VERSION = 1
+HEADER_ALIGNMENT = 64
+FIELDS = ["win", "tie", "samples"]
+ROW_SIZE = 4 * len(FIELDS)
+FLOP_CARDS = [cards for cards, _ in canonical_boards(3)]
+FLOP_INDEX = {canonical_board_key(cards): index for index, cards in enumerate(FLOP_CARDS)}
+
+
+def flop_index(flop):
+    """Position of a flop (3 string cards) in the flop axis of the table."""
+    return 1 + FLOP_INDEX[canonical_board_key([CARD_INDEX[card] for card in flop])]
+
+
+@lru_cache(maxsize=1)
+def _flop_positions():
+    """Array (52, 52, 52) of the position in the flop axis of every flop of integer encoded
+    cards, in any order."""
+    positions = np.zeros((52, 52, 52), dtype=np.int64)
+    for flop in itertools.combinations(range(52), 3):
+        position = 1 + FLOP_INDEX[canonical_board_key(flop)]
+        for cards in itertools.permutations(flop):
+            positions[cards] = position
+    return positions
+
+
+def flop_positions(community_cards):
+    """Positions in the flop axis of the flops (first 3 cards) of an array of boards of
+    integer encoded cards."""
+    return _flop_positions()[community_cards[:, 0], community_cards[:, 1], community_cards[:, 2]]
+
+
+def live_combos(cards=()):
+    """Combinations of every hand class (HAND_CLASSES order) which do not share a card with
+    cards (integer encoded), the same for every flop of a suit isomorphism class."""
+    live = (COMBO_MASKS & np.uint64(cards_mask(cards))) == 0
+    return np.bincount(COMBO_CLASSES[live], minlength=len(HAND_CLASSES))
+
+
+def class_probabilities(wins, n_players, simulations, cards=()):
+    """Win probability of every hand class given its wins in simulations with n_players, dealt
+    after cards (the flop of the simulations, or none preflop). A class is dealt to
+    n_players * live / total hands per simulation on average, with the live combinations of the
+    class and the total combinations left by cards."""
+    live = live_combos(cards)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        probabilities = wins * live.sum() / (n_players * live * simulations)
+    return np.where(live > 0, probabilities, 0)
+
+
+def save_table(file_name, players, values):
+    """Save values, an array (players, 1 + flops, 169, 3), as an equity table file."""
+    header = json.dumps({"version": VERSION, "players": list(players),
+                         "flops": values.shape[1] - 1, "classes": HAND_CLASSES,
+                         "fields": FIELDS}).encode("utf-8")
+    # Values start aligned after MAGIC, header length and the padded header
+    padding = -(len(MAGIC) + 4 + len(header)) % HEADER_ALIGNMENT
+    header += b" " * padding
+    with open(file_name, "wb") as table_file:
+        table_file.write(MAGIC)
+        table_file.write(len(header).to_bytes(4, "little"))
+        table_file.write(header)
+        table_file.write(np.ascontiguousarray(values, dtype="<f4").tobytes())
+
+
+class EquityTable:
+    """Memory mapped equity table. lookup returns the (win, tie) probabilities of a hand class
+    for a number of players, preflop or given a flop."""
+
+    def __init__(self, file_name):
+        with open(file_name, "rb") as table_file:
+            if table_file.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{file_name} is not an equity table file.")
+            header_length = int.from_bytes(table_file.read(4), "little")
+            self.header = json.loads(table_file.read(header_length))
+        if self.header["version"] != VERSION or self.header["classes"] != HAND_CLASSES:
+            raise ValueError(f"{file_name} has an unsupported table version.")
+        self.player_index = {players: index
+                             for index, players in enumerate(self.header["players"])}
+        self.offset = len(MAGIC) + 4 + header_length
+        self.flop_stride = len(HAND_CLASSES) * ROW_SIZE
+        self.players_stride = (1 + self.header["flops"]) * self.flop_stride
+        with open(file_name, "rb") as table_file:
+            self.table_map = mmap.mmap(table_file.fileno(), 0, access=mmap.ACCESS_READ)
+        # Zero copy array view of the memory map
+        self.values = np.frombuffer(
+            self.table_map, dtype="<f4", offset=self.offset,
+            count=len(self.player_index) * self.players_stride // 4).reshape(
+                len(self.player_index), 1 + self.header["flops"], len(HAND_CLASSES), len(FIELDS))
+
+    def lookup(self, hand_class, n_players, flop=None):
+        """(win, tie) probabilities for a hand class (as classify_hand) and n_players. flop is an
+        optional list of 3 string cards."""
+        if n_players not in self.player_index:
+            raise ValueError(f"The table has no values of {n_players} players, only of "
+                             f"{self.header['players']}.")
+        if flop is not None and not self.header["flops"]:
+            raise ValueError("The table has no flop values, build it with --flops.")
+        position = (self.offset + self.player_index[n_players] * self.players_stride
+                    + HAND_CLASS_INDEX[hand_class] * ROW_SIZE)
+        if flop is not None:
+            position += flop_index(flop) * self.flop_stride
+        return struct.unpack_from("<2f", self.table_map, position)
+
+    def lookup_hand(self, cards, n_players, flop=None):
+        """(win, tie) probabilities for 2 string hole cards."""
+        return self.lookup(classify_hand(cards), n_players, flop)
+
+
+def values_from_exact(players):
+    """Table values from the exact preflop enumeration (see preflop_equity.py)."""
+    values = np.zeros((len(players), 1, len(HAND_CLASSES), len(FIELDS)), dtype=np.float32)
+    for player_index, n_players in enumerate(players):
+        equity, statistics = exact_preflop_equity(n_players)
+        for hand_class, (win, tie, _) in equity.items():
+            values[player_index, 0, HAND_CLASS_INDEX[hand_class]] = (
+                win, tie, statistics["boards"])
+    return values
+
+
+def values_from_simulations(file_lists, flops=False):
+    """Table values from simulation files. file_lists is a dictionary of number of players to
+    the list of simulation files. The winner of every simulation is counted for its hand class,
+    and optionally for the canonical flop made by the first 3 community cards. The flop entries
+    are normalized by the combinations of every class left by the flop (see
+    class_probabilities). In split pot files every tied hand counts its share of the pot. The
+    tie probability is left at 0."""
+    players = sorted(file_lists)
+    n_flops = len(FLOP_INDEX) if flops else 0
+    wins = np.zeros((len(players), 1 + n_flops, len(HAND_CLASSES)))
+    for player_index, n_players in enumerate(players):
+        for file_name in file_lists[n_players]:
+            for block in file_blocks(file_name, ("classes", "community_cards")[:1 + flops]):
+                selected = (block["n_players"] == n_players if "n_players" in block
+                            else slice(None))
+                classes = block["classes"][selected]
+                shares = 1 / block["tied"][selected] if "tied" in block else 1
+                np.add.at(wins[player_index, 0], classes, shares)
+                if flops:
+                    np.add.at(wins[player_index],
+                              (flop_positions(block["community_cards"][selected]), classes),
+                              shares)
+
+    values = np.zeros((len(players), 1 + n_flops, len(HAND_CLASSES), len(FIELDS)),
+                      dtype=np.float32)
+    for player_index, n_players in enumerate(players):
+        for flop in range(1 + n_flops):
+            simulations = wins[player_index, flop].sum()
+            if simulations == 0:
+                continue
+            values[player_index, flop, :, 0] = class_probabilities(
+                wins[player_index, flop], n_players, simulations,
+                FLOP_CARDS[flop - 1] if flop else ())
+            values[player_index, flop, :, 2] = simulations
+    return players, values
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Build or query an equity table file.')
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build_parser = subparsers.add_parser("build")
+    build_parser.add_argument('table_file')
+    build_parser.add_argument('--exact', type=int, nargs='+', metavar='PLAYERS',
+                              help='exact enumeration for these numbers of players '
+                                   f'{SUPPORTED_PLAYERS}')
+    build_parser.add_argument('-l', '--list_file', nargs=2, action='append',
+                              metavar=('PLAYERS', 'LIST_FILE'),
+                              help='simulation files of a number of players, repeatable')
+    build_parser.add_argument('--flops', action='store_true',
+                              help='add the canonical flop entries from the simulations')
+    lookup_parser = subparsers.add_parser("lookup")
+    lookup_parser.add_argument('table_file')
+    lookup_parser.add_argument('hand_class')
+    lookup_parser.add_argument('number_of_players', type=int)
+    lookup_parser.add_argument('flop', nargs='*')
+    args = parser.parse_args()
+
+    if args.command == "build" and set(args.exact or ()) - set(SUPPORTED_PLAYERS):
+        parser.error(MORE_PLAYERS.format(SUPPORTED_PLAYERS))
+    if args.command == "build":
+        if args.exact:
+            save_table(args.table_file, args.exact, values_from_exact(args.exact))
+        else:
+            input_lists = {}
+            for players_arg, list_file_name in args.list_file or []:
+                with open(list_file_name, 'r', encoding="utf-8") as input_list_file:
+                    input_lists[int(players_arg)] = [line.strip() for line in input_list_file
+                                                     if line.strip()]
+            save_table(args.table_file, *values_from_simulations(input_lists, args.flops))
+        print("table file_name:", args.table_file, os.path.getsize(args.table_file), "bytes")
+    else:
+        table = EquityTable(args.table_file)
+        print(table.lookup(args.hand_class, args.number_of_players, args.flop or None))
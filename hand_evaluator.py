@@ -0,0 +1,281 @@
+"""
+hand_evaluator.py. Integer card encoding and lookup table hand evaluation.
+Cards are encoded as an index from 0 to 51 (rank * 4 + suit), following the create_deck order
+of monte_carlo.py, so "2C" is 0, "2D" is 1 ... "AS" is 51.
+A hand strength is a single integer which keeps the same ordering as the (rank, tiebreaker list)
+tuples returned by monte_carlo.evaluate_full_hand:
+    strength = hand_rank << 20 | v0 << 16 | v1 << 12 | v2 << 8 | v3 << 4 | v4
+Evaluation adds one precomputed key per card and resolves the sum with a rank table, or with a
+flush table when five or more cards share a suit.
+evaluate_batch does the same work with NumPy for an (N, 7) array of hands at once, and
+hand_strengths_batch for every hole pair of a batch of boards.
+BoardEvaluator analyzes the 5 community cards once (rank key, suit counts and the rank mask of
+the only suit which can still make a flush), so every hole pair only adds its 2 card keys.
+"""
+import itertools
+from math import comb
+
+import numpy as np
+
+VALUES = "23456789TJQKA"
+SUITS = "CDHS"  # Clubs, Diamonds, Hearts, Spades
+
+CARD_NAMES = [rank + suit for rank in VALUES for suit in SUITS]
+CARD_INDEX = {name: index for index, name in enumerate(CARD_NAMES)}
+
+# Hand rankings in poker from highest to lowest
+HAND_RANKS = {
+    "Royal Flush": 10,
+    "Straight Flush": 9,
+    "Four of a Kind": 8,
+    "Full House": 7,
+    "Flush": 6,
+    "Straight": 5,
+    "Three of a Kind": 4,
+    "Two Pair": 3,
+    "One Pair": 2,
+    "High Card": 1
+}
+
+HAND_RANKS_REVERSE = [
+    "High Card",
+    "One Pair",
+    "Two Pair",
+    "Three of a Kind",
+    "Straight",
+    "Flush",
+    "Full House",
+    "Four of a Kind",
+    "Straight Flush",
+    "Royal Flush"
+]
+
+# Number of tiebreaker values used by every hand rank (see HAND_RANKS).
+RESULT_LENGTH = [0, 5, 4, 3, 3, 1, 5, 2, 2, 1, 1]
+
+# Card key: 3 bits per rank count (13 ranks) and 4 bits per suit count above them.
+RANK_BITS = 3
+SUIT_SHIFT = 13 * RANK_BITS
+RANK_KEY_MASK = (1 << SUIT_SHIFT) - 1
+CARD_KEY = [(1 << (RANK_BITS * (card >> 2))) | (1 << (SUIT_SHIFT + 4 * (card & 3)))
+            for card in range(52)]
+RANK_CARD_KEY = [key & ((1 << SUIT_SHIFT) - 1) for key in CARD_KEY]
+# A suit nibble reaches the 4th bit after adding 3 only when it counts 5 or more cards.
+FLUSH_CHECK_ADD = 0x3333
+FLUSH_CHECK_MASK = 0x8888
+
+WHEEL_MASK = 0b1000000001111  # A-2-3-4-5
+
+
+def pack_strength(hand_rank, hand_value):
+    """Pack a hand rank and its tiebreaker values into a single comparable integer."""
+    strength = hand_rank << 20
+    for position, value in enumerate(hand_value):
+        strength |= value << (16 - 4 * position)
+    return strength
+
+
+def unpack_strength(strength):
+    """Convert an integer strength back into the (rank, tiebreaker list) tuple format."""
+    hand_rank = strength >> 20
+    hand_value = [(strength >> (16 - 4 * position)) & 15
+                  for position in range(RESULT_LENGTH[hand_rank])]
+    return (hand_rank, hand_value)
+
+
+def straight_top(rank_mask):
+    """Returns the top rank of the best straight in a 13 bit rank mask, -1 if there is none."""
+    for top in range(12, 3, -1):
+        straight = 0b11111 << (top - 4)
+        if rank_mask & straight == straight:
+            return top
+    if rank_mask & WHEEL_MASK == WHEEL_MASK:  # Special case for A-2-3-4-5
+        return 3
+    return -1
+
+
+STRAIGHT_TOP = [straight_top(mask) for mask in range(1 << 13)]
+
+
+def flush_strength(rank_mask):
+    """Strength of the best hand made with the ranks of a single suit (5 or more ranks)."""
+    top = STRAIGHT_TOP[rank_mask]
+    if top >= 0:
+        return pack_strength(10 if top == 12 else 9, [top])
+    ranks = [rank for rank in range(12, -1, -1) if rank_mask >> rank & 1]
+    return pack_strength(6, ranks[:5])
+
+
+def rank_strength(counts):
+    """Strength of a non flush hand given the count of cards of every rank."""
+    ranks = [rank for rank in range(12, -1, -1) if counts[rank]]
+    # Ranks in order of frequency and card value
+    ranked_values = sorted(ranks, key=lambda rank: (counts[rank], rank), reverse=True)
+    top = STRAIGHT_TOP[sum(1 << rank for rank in ranks)]
+    most_common = counts[ranked_values[0]]
+
+    if most_common == 4:
+        return pack_strength(8, [ranked_values[0], max(ranked_values[1:])])
+    if most_common == 3 and counts[ranked_values[1]] >= 2:
+        pair_value = max(rank for rank in ranks if counts[rank] >= 2 and rank != ranked_values[0])
+        return pack_strength(7, [ranked_values[0], pair_value])
+    if top >= 0:
+        return pack_strength(5, [top])
+    if most_common == 3:
+        return pack_strength(4, ranked_values[:3])
+    if most_common == 2 and counts[ranked_values[1]] == 2:
+        return pack_strength(3, ranked_values[:2] + [max(ranked_values[2:])])
+    if most_common == 2:
+        return pack_strength(2, ranked_values[:4])
+    return pack_strength(1, ranks[:5])
+
+
+def _build_rank_table():
+    """Strength of every rank multiset of 5, 6 and 7 cards indexed by its summed rank key."""
+    table = {}
+    for size in (5, 6, 7):
+        for combination in itertools.combinations_with_replacement(range(13), size):
+            counts = [0] * 13
+            for rank in combination:
+                counts[rank] += 1
+            if max(counts) > 4:
+                continue
+            key = sum(1 << (RANK_BITS * rank) for rank in combination)
+            table[key] = rank_strength(counts)
+    return table
+
+
+def _build_flush_table():
+    """Strength of every 13 bit rank mask of a single suit, 0 for masks under 5 ranks."""
+    return [flush_strength(mask) if bin(mask).count("1") >= 5 else 0
+            for mask in range(1 << 13)]
+
+
+def _build_rank_table_7():
+    """Strength of every 7 cards rank multiset indexed by its combinatorial number.
+    A sorted multiset r0 <= r1 <= ... <= r6 maps to sum(comb(r_i + i, i + 1))."""
+    table = np.zeros(comb(13 + 7 - 1, 7), dtype=np.int32)
+    for combination in itertools.combinations_with_replacement(range(13), 7):
+        key = sum(1 << (RANK_BITS * rank) for rank in combination)
+        if key in RANK_TABLE:
+            index = sum(comb(rank + i, i + 1) for i, rank in enumerate(combination))
+            table[index] = RANK_TABLE[key]
+    return table
+
+
+def _build_column_key():
+    """Key of a card in the column i of a sorted hand: its contribution to the combinatorial
+    number of the ranks in the low 16 bits and its suit count nibble above them."""
+    return np.array([[comb((card >> 2) + i, i + 1) | 1 << (16 + 4 * (card & 3))
+                      for card in range(52)] for i in range(7)], dtype=np.int64)
+
+
+RANK_TABLE = _build_rank_table()
+FLUSH_TABLE = _build_flush_table()
+
+# NumPy versions of the tables for evaluate_batch
+RANK_TABLE_7 = _build_rank_table_7()
+FLUSH_TABLE_ARRAY = np.array(FLUSH_TABLE, dtype=np.int32)
+COLUMN_KEY = _build_column_key()
+
+
+def evaluate_cards(cards):
+    """Evaluates 5 to 7 integer encoded cards and returns the hand strength as an integer."""
+    key = 0
+    for card in cards:
+        key += CARD_KEY[card]
+    flush = ((key >> SUIT_SHIFT) + FLUSH_CHECK_ADD) & FLUSH_CHECK_MASK
+    if flush:
+        # Only one suit can hold 5 cards, and then no full house or four of a kind is possible.
+        suit = flush.bit_length() // 4 - 1
+        rank_mask = 0
+        for card in cards:
+            if card & 3 == suit:
+                rank_mask |= 1 << (card >> 2)
+        return FLUSH_TABLE[rank_mask]
+    return RANK_TABLE[key & RANK_KEY_MASK]
+
+
+def evaluate_batch(cards):
+    """Evaluates an (N, 7) array of integer encoded cards and returns an (N,) array of hand
+    strengths, the same values as evaluate_cards for every row."""
+    # Sorting the cards also sorts their ranks (rank = card >> 2)
+    cards = np.sort(np.asarray(cards), axis=1)
+    key = COLUMN_KEY[0][cards[:, 0]]
+    for i in range(1, 7):
+        key += COLUMN_KEY[i][cards[:, i]]
+    strength = RANK_TABLE_7[key & 0xFFFF]
+
+    flush = ((key >> 16) + FLUSH_CHECK_ADD) & FLUSH_CHECK_MASK
+    flush_rows = np.flatnonzero(flush)
+    if flush_rows.size:
+        # Flush bit at 4 * suit + 3, only one suit can hold 5 cards
+        flush_suit = (flush[flush_rows, None] > [0x8, 0x80, 0x800]).sum(axis=1)
+        flush_cards = cards[flush_rows]
+        in_suit = (flush_cards & 3) == flush_suit[:, None]
+        rank_masks = np.where(in_suit, 1 << (flush_cards >> 2), 0).sum(axis=1)
+        strength[flush_rows] = FLUSH_TABLE_ARRAY[rank_masks]
+    return strength
+
+
+class BoardEvaluator:
+    """Evaluator of hole pairs against a fixed board of 5 integer encoded cards. Returns the
+    same strengths as evaluate_cards(board + [first, second])."""
+
+    def __init__(self, board):
+        key = 0
+        for card in board:
+            key += CARD_KEY[card]
+        self.rank_key = key & RANK_KEY_MASK
+        # Only a suit with 3 or more board cards can make a flush with 2 hole cards
+        suit_counts = [(key >> (SUIT_SHIFT + 4 * suit)) & 15 for suit in range(4)]
+        self.flush_suit = next((suit for suit in range(4) if suit_counts[suit] >= 3), -1)
+        self.flush_needed = 5 - suit_counts[self.flush_suit] if self.flush_suit >= 0 else 3
+        self.flush_mask = 0
+        for card in board:
+            if card & 3 == self.flush_suit:
+                self.flush_mask |= 1 << (card >> 2)
+
+    def evaluate(self, first, second):
+        """Strength of the board with the hole cards first and second."""
+        suit = self.flush_suit
+        if suit >= 0:
+            rank_mask, suited = self.flush_mask, 0
+            if first & 3 == suit:
+                rank_mask |= 1 << (first >> 2)
+                suited += 1
+            if second & 3 == suit:
+                rank_mask |= 1 << (second >> 2)
+                suited += 1
+            if suited >= self.flush_needed:
+                return FLUSH_TABLE[rank_mask]
+        return RANK_TABLE[self.rank_key + RANK_CARD_KEY[first] + RANK_CARD_KEY[second]]
+
+    def evaluate_hands(self, hands):
+        """Strengths of a list of hole pairs, in the same order."""
+        rank_key, rank_table, rank_card_key = self.rank_key, RANK_TABLE, RANK_CARD_KEY
+        if self.flush_suit < 0:
+            return [rank_table[rank_key + rank_card_key[first] + rank_card_key[second]]
+                    for first, second in hands]
+        return [self.evaluate(first, second) for first, second in hands]
+
+
+def hand_strengths_batch(community_cards, hands):
+    """Strengths (batch_size, number_of_hands) of every hand of a batch of community_cards
+    (batch_size, 5) and hands (batch_size, number_of_hands, 2), as dealer.Dealer.deal_batch
+    deals them."""
+    batch_size, number_of_hands = hands.shape[:2]
+    seven_card_hands = np.concatenate(
+        [np.broadcast_to(community_cards[:, None, :], (batch_size, number_of_hands, 5)), hands],
+        axis=2)
+    return evaluate_batch(seven_card_hands.reshape(-1, 7)).reshape(batch_size, -1)
+
+
+def encode_cards(cards):
+    """Convert 2 caracter string cards into integer encoded cards."""
+    return [CARD_INDEX[card] for card in cards]
+
+
+def decode_cards(cards):
+    """Convert integer encoded cards into 2 caracter string cards."""
+    return [CARD_NAMES[card] for card in cards]
@@ -0,0 +1,317 @@
+"""
+hand_history.py. Append-only store of hand histories, simulated or real: the community cards and
+the hole cards of every player (integer encoded, see hand_evaluator.py), their strengths, the
+winner and its hand category, with secondary indexes to query them without a full scan.
+The store is a directory of immutable segments and a manifest (JSON, replaced atomically) of
+the segments. Every append writes a new segment with the hands of one number of players, as
+numpy .npy columns read memory mapped, and its indexes: the sorted rows of every hole card class
+and of every board card (posting lists in CSR form, offsets and rows). A query keeps the
+segments of its number of players from the manifest, intersects the posting lists of its class
+and board cards and only checks the hands of the rows left. As in monte_carlo.py the first hand
+dealt wins the ties, the tied column keeps the number of hands tied for the best.
+Appends are not meant to be concurrent, a single process writes a store. simulate_history
+appends simulated hands in segments of SEGMENT_BOARDS boards, dealt and evaluated in numpy
+batches, any other source appends its hands with HandHistoryStore.append.
+data_science.py reads a store directory as a simulation file (see data_science.file_blocks):
+the winners are counted per number of players (sweep keys), so report_generator reports the
+hands of its n_players.
+Usage:
+    python hand_history.py simulate STORE number_of_simulations number_of_players
+                           [-b BATCH_SIZE] [-s SEED]
+    python hand_history.py query STORE [-p N_PLAYERS] [-c CLASS] [--board CARDS]
+                           [--outcome {won,lost}] [--category CATEGORY] [--limit N]
+    python hand_history.py info STORE
+"""
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+from combos import CLASS_OF_CARDS, HAND_CLASS_INDEX, HAND_CLASSES
+from dealer import Dealer
+from hand_evaluator import (CARD_INDEX, CARD_NAMES, HAND_RANKS_REVERSE, VALUES,
+                            hand_strengths_batch)
+
+MANIFEST_FILE = "manifest.json"
+SEGMENT_BOARDS = 1 << 18
+DEFAULT_BATCH_SIZE = 10000
+# Columns of a segment and the dtype they are saved with
+COLUMNS = {"community_cards": np.uint8, "hands": np.uint8, "strengths": np.int32,
+           "winners": np.uint16, "tied": np.uint16, "categories": np.uint8}
+OUTCOMES = ("won", "lost")
+
+
+def posting_lists(keys, n_keys):
+    """Posting lists of a (rows, k) array of keys: offsets (n_keys + 1) and the sorted rows of
+    every key, a row is listed once per key."""
+    rows = np.repeat(np.arange(len(keys), dtype=np.uint32), keys.shape[1])
+    keys = keys.reshape(-1).astype(np.uint8)
+    # A stable sort of small integer keys is a radix sort and keeps the rows sorted per key
+    order = np.argsort(keys, kind="stable")
+    keys, rows = keys[order], rows[order]
+    unique = np.ones(len(keys), dtype=bool)
+    unique[1:] = (keys[1:] != keys[:-1]) | (rows[1:] != rows[:-1])
+    offsets = np.zeros(n_keys + 1, dtype=np.int64)
+    np.cumsum(np.bincount(keys[unique], minlength=n_keys), out=offsets[1:])
+    return offsets, rows[unique]
+
+
+def class_index(label):
+    """Class index of a hand class label of HAND_CLASSES ("KAS") or of range notation ("AKs",
+    "AKo", "AA"). Raises ValueError for unknown labels."""
+    label = label.strip().upper()
+    if label in HAND_CLASS_INDEX:
+        return HAND_CLASS_INDEX[label]
+    if len(label) in (2, 3) and all(rank in VALUES for rank in label[:2]):
+        low, high = sorted(label[:2], key=VALUES.index)
+        kind = "P" if low == high else {"S": "S", "O": "N", "N": "N"}.get(label[2:], "")
+        if low + high + kind in HAND_CLASS_INDEX:
+            return HAND_CLASS_INDEX[low + high + kind]
+    raise ValueError(f"Unknown hand class {label}.")
+
+
+def category_rank(category):
+    """Hand rank (1 to 10) of a category name of HAND_RANKS_REVERSE or of its number."""
+    if isinstance(category, int) or str(category).isdigit():
+        return int(category)
+    names = [name.lower() for name in HAND_RANKS_REVERSE]
+    if category.lower() not in names:
+        raise ValueError(f"Unknown hand category {category}.")
+    return names.index(category.lower()) + 1
+
+
+class HandHistoryStore:
+    """Hand histories saved in a directory of segments, see the module docstring."""
+
+    def __init__(self, directory, create=True):
+        """Open the store of a directory, created if create (else ValueError if it is not a
+        store)."""
+        if create:
+            os.makedirs(directory, exist_ok=True)
+        elif not is_hand_history(directory):
+            raise ValueError(f"{directory} is not a hand history store.")
+        self.directory = directory
+        self.manifest_file = os.path.join(directory, MANIFEST_FILE)
+        self.segments = []
+        if os.path.exists(self.manifest_file):
+            with open(self.manifest_file, "r", encoding="utf-8") as manifest:
+                self.segments = json.load(manifest)["segments"]
+
+    def save(self):
+        """Save the manifest, replaced atomically."""
+        temporary_file = self.manifest_file + ".tmp"
+        with open(temporary_file, "w", encoding="utf-8") as manifest:
+            json.dump({"segments": self.segments}, manifest, indent=1)
+        os.replace(temporary_file, self.manifest_file)
+
+    def segment_name(self):
+        """Name of the next segment, skipping the directories of segments left out of the
+        manifest by a crash between their rename and the save of the manifest."""
+        number = len(self.segments)
+        while os.path.exists(os.path.join(self.directory, f"segment{number:06d}")):
+            number += 1
+        return f"segment{number:06d}"
+
+    def append(self, community_cards, hands, strengths=None, source="simulation"):
+        """Append a segment of hands: community_cards (boards, 5) and hands (boards, players, 2)
+        as dealt by dealer.Dealer.deal_batch, with their strengths (boards, players) if already
+        evaluated. Output: manifest entry of the segment."""
+        community_cards = np.asarray(community_cards)
+        hands = np.asarray(hands)
+        boards, n_players = hands.shape[:2]
+        if not boards:
+            return None
+        if strengths is None:
+            strengths = hand_strengths_batch(community_cards, hands)
+        best = strengths.max(axis=1)
+        columns = {"community_cards": community_cards, "hands": hands, "strengths": strengths,
+                   "winners": strengths.argmax(axis=1),
+                   "tied": (strengths == best[:, None]).sum(axis=1),
+                   "categories": best >> 20}
+        name = self.segment_name()
+        temporary_directory = os.path.join(self.directory, name + ".tmp")
+        os.makedirs(temporary_directory, exist_ok=True)
+        for column, dtype in COLUMNS.items():
+            np.save(os.path.join(temporary_directory, column), columns[column].astype(dtype))
+        indexes = {"class": (CLASS_OF_CARDS[hands[..., 0], hands[..., 1]], len(HAND_CLASSES)),
+                   "card": (community_cards, len(CARD_NAMES))}
+        for index, (keys, n_keys) in indexes.items():
+            offsets, rows = posting_lists(keys, n_keys)
+            np.save(os.path.join(temporary_directory, f"{index}_offsets"), offsets)
+            np.save(os.path.join(temporary_directory, f"{index}_rows"), rows)
+        os.replace(temporary_directory, os.path.join(self.directory, name))
+        segment = {"name": name, "boards": int(boards), "n_players": int(n_players),
+                   "source": source, "created": time.time()}
+        self.segments.append(segment)
+        self.save()
+        return segment
+
+    def load(self, segment, name):
+        """Column or index array of a segment, memory mapped."""
+        return np.load(os.path.join(self.directory, segment["name"], f"{name}.npy"),
+                       mmap_mode="r")
+
+    def posting_list(self, segment, index, key):
+        """Sorted rows of a segment with key in an index ("class" or "card")."""
+        offsets = self.load(segment, f"{index}_offsets")
+        return np.asarray(self.load(segment, f"{index}_rows")[offsets[key]:offsets[key + 1]],
+                          dtype=np.int64)
+
+    def query(self, n_players=None, hand_class=None, board_cards=(), outcome=None,
+              winner_category=None):
+        """Boards of the store with n_players, a hand of hand_class (class index or label) and
+        all the board_cards (integer encoded or names), where a hand of the class won (tied for
+        the best) or lost with outcome, and whose winner has winner_category (hand rank or
+        name). Yields per segment a dictionary of the arrays of the boards found
+        (community_cards, hands, strengths, winners, tied, categories), with their rows in the
+        segment and the segment entry."""
+        if outcome is not None and outcome not in OUTCOMES:
+            raise ValueError(f"Unknown outcome {outcome}, use {' or '.join(OUTCOMES)}.")
+        if outcome is not None and hand_class is None:
+            raise ValueError("The outcome needs a hand class.")
+        if isinstance(hand_class, str):
+            hand_class = class_index(hand_class)
+        board_cards = [CARD_INDEX[card] if isinstance(card, str) else card
+                       for card in board_cards]
+        rank = category_rank(winner_category) if winner_category is not None else None
+        for segment in self.segments:
+            if n_players is not None and segment["n_players"] != n_players:
+                continue
+            postings = [self.posting_list(segment, "card", card) for card in board_cards]
+            if hand_class is not None:
+                postings.append(self.posting_list(segment, "class", hand_class))
+            rows = None
+            for posting in sorted(postings, key=len):
+                rows = posting if rows is None else np.intersect1d(rows, posting,
+                                                                   assume_unique=True)
+            if rows is None:
+                rows = np.arange(segment["boards"])
+            if rank is not None and len(rows):
+                rows = rows[self.load(segment, "categories")[rows] == rank]
+            if outcome is not None and len(rows):
+                hands = self.load(segment, "hands")[rows]
+                strengths = self.load(segment, "strengths")[rows]
+                is_class = CLASS_OF_CARDS[hands[..., 0], hands[..., 1]] == hand_class
+                won = (is_class & (strengths == strengths.max(axis=1)[:, None])).any(axis=1)
+                rows = rows[won if outcome == "won" else ~won]
+            if len(rows):
+                found = {column: np.asarray(self.load(segment, column)[rows])
+                         for column in COLUMNS}
+                found["rows"] = rows
+                found["segment"] = segment
+                yield found
+
+    def blocks(self, fields=("classes", "hand_rank", "community_cards")):
+        """Blocks of every segment as data_science.file_blocks: classes (class index of the
+        winner hand), hand_rank (category of the winner hand) and community_cards, with the
+        n_players column of sweep files."""
+        for segment in self.segments:
+            block = {"n_players": np.full(segment["boards"], segment["n_players"],
+                                          dtype=np.int64)}
+            if "classes" in fields:
+                hands = self.load(segment, "hands")
+                winners = np.asarray(self.load(segment, "winners"), dtype=np.int64)
+                rows = np.arange(segment["boards"])
+                block["classes"] = CLASS_OF_CARDS[hands[rows, winners, 0],
+                                                  hands[rows, winners, 1]]
+            if "hand_rank" in fields:
+                block["hand_rank"] = np.asarray(self.load(segment, "categories"),
+                                                dtype=np.int64)
+            if "community_cards" in fields:
+                block["community_cards"] = np.asarray(self.load(segment, "community_cards"),
+                                                      dtype=np.int64)
+            yield block
+
+    def info(self):
+        """Segments and boards of the store per number of players, as a dictionary."""
+        players = {}
+        for segment in self.segments:
+            entry = players.setdefault(segment["n_players"], {"segments": 0, "boards": 0})
+            entry["segments"] += 1
+            entry["boards"] += segment["boards"]
+        return {"segments": len(self.segments),
+                "boards": sum(segment["boards"] for segment in self.segments),
+                "n_players": dict(sorted(players.items()))}
+
+
+def is_hand_history(path):
+    """True for the directory of a hand history store."""
+    return os.path.isfile(os.path.join(path, MANIFEST_FILE))
+
+
+def simulate_history(store, simulations, n_players, batch_size=DEFAULT_BATCH_SIZE, seed=None,
+                     segment_boards=SEGMENT_BOARDS):
+    """Append simulations boards of n_players to a store, dealt and evaluated in batches of
+    batch_size and saved in segments of segment_boards boards. Output: number of segments."""
+    dealer = Dealer(rng=np.random.default_rng(seed))
+    segments = 0
+    for start in range(0, simulations, segment_boards):
+        boards = min(segment_boards, simulations - start)
+        batches = [dealer.deal_batch(min(batch_size, boards - batch_start), n_players)
+                   for batch_start in range(0, boards, batch_size)]
+        strengths = np.concatenate([hand_strengths_batch(community_cards, hands)
+                                    for community_cards, hands in batches])
+        store.append(np.concatenate([community_cards for community_cards, _ in batches]),
+                     np.concatenate([hands for _, hands in batches]), strengths)
+        segments += 1
+    return segments
+
+
+def print_boards(found, limit):
+    """Print up to limit boards of a query result, the winner hand marked with *."""
+    for board in range(min(limit, len(found["rows"]))):
+        winner = int(found["winners"][board])
+        hands = [("*" if seat == winner else "") + ",".join(CARD_NAMES[card] for card in hand)
+                 for seat, hand in enumerate(found["hands"][board].tolist())]
+        print(f"{found['segment']['name']}:{found['rows'][board]}|"
+              f"{','.join(CARD_NAMES[card] for card in found['community_cards'][board])}|"
+              f"{' '.join(hands)}|{HAND_RANKS_REVERSE[found['categories'][board] - 1]}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Append-only hand history store with indexed queries.')
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    simulate_parser = subparsers.add_parser("simulate")
+    simulate_parser.add_argument('store')
+    simulate_parser.add_argument('number_of_simulations', type=int)
+    simulate_parser.add_argument('number_of_players', type=int)
+    simulate_parser.add_argument('-b', '--batch_size', type=int, default=DEFAULT_BATCH_SIZE,
+                                 help='deal and evaluate the boards in numpy batches of this size')
+    simulate_parser.add_argument('-s', '--seed', type=int)
+    query_parser = subparsers.add_parser("query")
+    query_parser.add_argument('store')
+    query_parser.add_argument('-p', '--n_players', type=int)
+    query_parser.add_argument('-c', '--hand_class', help='hole card class, as KAS or AKs')
+    query_parser.add_argument('--board', default="",
+                              help='board cards, comma separated, as AS,KD')
+    query_parser.add_argument('--outcome', choices=OUTCOMES,
+                              help='boards where a hand of the class won or lost')
+    query_parser.add_argument('--category', help='hand category of the winner, as Flush')
+    query_parser.add_argument('--limit', type=int, default=10, help='boards printed')
+    info_parser = subparsers.add_parser("info")
+    info_parser.add_argument('store')
+    args = parser.parse_args()
+
+    if args.command != "simulate" and not is_hand_history(args.store):
+        parser.error(f"{args.store} is not a hand history store.")
+    history = HandHistoryStore(args.store, create=args.command == "simulate")
+    if args.command == "simulate":
+        start_time = time.time()
+        simulate_history(history, args.number_of_simulations, args.number_of_players,
+                         args.batch_size, args.seed)
+        print(f"{args.number_of_simulations} simulations appended in "
+              f"{time.time() - start_time:.1f} seconds.")
+    elif args.command == "query":
+        start_time = time.time()
+        total = 0
+        for result in history.query(args.n_players, args.hand_class,
+                                    [card for card in args.board.split(",") if card],
+                                    args.outcome, args.category):
+            print_boards(result, args.limit - total)
+            total += len(result["rows"])
+        print(f"{total} boards found in {time.time() - start_time:.3f} seconds.")
+    else:
+        print(json.dumps(history.info(), indent=1))
@@ -0,0 +1,114 @@
+"""
+instrumentation.py. Opt-in timers for the simulation hot path.
+Every phase (dealing, evaluation, output) keeps its number of calls, items processed, total
+time and a latency histogram with power of 2 buckets of nanoseconds, measured with the monotonic
+perf_counter_ns clock. The callers keep a reference that is None when instrumentation is off,
+so the disabled cost is one comparison per phase.
+"""
+from contextlib import contextmanager
+import cProfile
+import json
+import pstats
+from time import perf_counter_ns
+
+HISTOGRAM_BUCKETS = 64
+PERCENTILES = (50, 90, 99)
+
+
+class PhaseStats:
+    """Calls, items, total time and latency histogram of a phase."""
+
+    def __init__(self):
+        self.calls = 0
+        self.items = 0
+        self.total_ns = 0
+        self.min_ns = None
+        self.max_ns = 0
+        self.histogram = [0] * HISTOGRAM_BUCKETS
+
+    def add(self, elapsed_ns, items):
+        """Count one call of elapsed_ns nanoseconds processing items."""
+        self.calls += 1
+        self.items += items
+        self.total_ns += elapsed_ns
+        self.min_ns = elapsed_ns if self.min_ns is None else min(self.min_ns, elapsed_ns)
+        self.max_ns = max(self.max_ns, elapsed_ns)
+        self.histogram[min(elapsed_ns.bit_length(), HISTOGRAM_BUCKETS - 1)] += 1
+
+    def percentile(self, percent):
+        """Upper bound in nanoseconds of the histogram bucket holding the percentile."""
+        target = self.calls * percent / 100
+        seen = 0
+        for bucket, count in enumerate(self.histogram):
+            seen += count
+            if count and seen >= target:
+                return 1 << bucket
+        return 0
+
+    def summary(self, wall_ns):
+        """Statistics of the phase as a dictionary."""
+        seconds = self.total_ns / 1e9
+        return {"calls": self.calls,
+                "items": self.items,
+                "total_seconds": seconds,
+                "share_of_wall_time": self.total_ns / wall_ns if wall_ns else 0,
+                "mean_ns": self.total_ns / self.calls if self.calls else 0,
+                "min_ns": self.min_ns,
+                "max_ns": self.max_ns,
+                "percentiles_ns": {f"p{percent}": self.percentile(percent)
+                                   for percent in PERCENTILES},
+                "items_per_second": self.items / seconds if seconds else 0,
+                "histogram_ns": {f"<{1 << bucket}": count
+                                 for bucket, count in enumerate(self.histogram) if count}}
+
+
+class Instrumentation:
+    """Per phase timers. Usage in a hot path:
+        start = perf_counter_ns()
+        ...
+        start = instrumentation.record("deal", start, items)
+    record returns the current time so consecutive phases can be chained."""
+
+    def __init__(self):
+        self.phases = {}
+        self.started_ns = perf_counter_ns()
+
+    def record(self, phase, start_ns, items=1):
+        """Add the time since start_ns to phase. Output: current perf_counter_ns."""
+        now = perf_counter_ns()
+        stats = self.phases.get(phase)
+        if stats is None:
+            stats = self.phases[phase] = PhaseStats()
+        stats.add(now - start_ns, items)
+        return now
+
+    def summary(self):
+        """Statistics of every phase and the wall time as a dictionary."""
+        wall_ns = perf_counter_ns() - self.started_ns
+        return {"wall_seconds": wall_ns / 1e9,
+                "phases": {phase: stats.summary(wall_ns) for phase, stats in self.phases.items()}}
+
+    def dump(self, file_name):
+        """Save the summary as JSON."""
+        with open(file_name, "w", encoding="utf-8") as summary_file:
+            json.dump(self.summary(), summary_file, indent=1)
+
+
+@contextmanager
+def instrumented(file_name, instrument=False, profile=False):
+    """Run a block with optional instrumentation and cProfile. Yields the Instrumentation or
+    None. At exit saves file_name.instrumentation.json and file_name.prof (cProfile stats, also
+    printed, top 20 by cumulative time)."""
+    instrumentation = Instrumentation() if instrument else None
+    profiler = cProfile.Profile() if profile else None
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield instrumentation
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(f"{file_name}.prof")
+            pstats.Stats(profiler).sort_stats("cumulative").print_stats(20)
+        if instrumentation is not None:
+            instrumentation.dump(f"{file_name}.instrumentation.json")
@@ -0,0 +1,99 @@
+"""
+isomorphism.py. Suit isomorphism canonicalization of integer encoded cards (see hand_evaluator.py)
+and a bounded memo of showdowns in front of it.
+Relabeling the suits never changes a hand strength nor a showdown, so the inputs which are the
+same up to a suit permutation share one key: the rank masks of every suit (one mask per group of
+cards, as board and hole cards) sorted in decreasing order. canonical_suits gives the suit
+permutation to that order, and relabel applies it, so all the isomorphic inputs become the same
+canonical cards.
+IsomorphicMemo keeps the results by canonical key in an LRU cache (lru.py) with hit/miss
+counters. Its showdown serves the all hands deals of dealer.Dealer.deal and
+all_possible_hands(..., repeated=True): the best pairs of a board over all its hole pairs are
+saved once per canonical board and mapped back to the suits of every isomorphic board. A miss
+evaluates the 1081 hole pairs of the board, so the memo only pays off when all the hands are
+dealt (see monte_carlo.check_memo). Single evaluations are not memoized, the canonical key costs
+more than hand_evaluator.evaluate_cards.
+"""
+from combos import iter_combos
+from hand_evaluator import BoardEvaluator
+from lru import LRUCache
+
+DEFAULT_MEMO_SIZE = 200000  # above the 134459 canonical boards of 5 cards
+
+
+def suit_signatures(*groups):
+    """Rank mask of every group of cards, for each of the 4 suits."""
+    signatures = [[0] * len(groups) for _ in range(4)]
+    for position, cards in enumerate(groups):
+        for card in cards:
+            signatures[card & 3][position] |= 1 << (card >> 2)
+    return [tuple(signature) for signature in signatures]
+
+
+def canonical_key(*groups):
+    """Key shared by all the suit permutations of groups (lists of integer encoded cards), the
+    order of the cards inside a group is ignored."""
+    return tuple(sorted(suit_signatures(*groups), reverse=True))
+
+
+def canonical_suits(*groups):
+    """Canonical key of groups and the permutation taking every suit to its canonical suit."""
+    signatures = suit_signatures(*groups)
+    order = sorted(range(4), key=signatures.__getitem__, reverse=True)
+    permutation = [0] * 4
+    for canonical_suit, suit in enumerate(order):
+        permutation[suit] = canonical_suit
+    return tuple(signatures[suit] for suit in order), permutation
+
+
+def relabel(cards, permutation):
+    """Cards with every suit replaced by permutation[suit]."""
+    return [card & ~3 | permutation[card & 3] for card in cards]
+
+
+class IsomorphicMemo:
+    """Showdown results memoized by suit isomorphism class of the board in an LRU cache of
+    max_size entries."""
+
+    def __init__(self, max_size=DEFAULT_MEMO_SIZE):
+        self.cache = LRUCache(max_size)
+
+    def best_pairs(self, board):
+        """Strength and hole pairs (both orders) of the best hands of board over all its hole
+        pairs, in the suits of board."""
+        key, permutation = canonical_suits(board)
+        value = self.cache.get(("best_pairs", key))
+        if value is None:
+            canonical_board = relabel(board, permutation)
+            pairs = list(iter_combos(canonical_board))
+            strengths = BoardEvaluator(canonical_board).evaluate_hands(pairs)
+            best_strength = max(strengths)
+            value = best_strength, [pair for pair, strength in zip(pairs, strengths)
+                                    if strength == best_strength]
+            self.cache.put(("best_pairs", key), value)
+        inverse = [0] * 4
+        for suit, canonical_suit in enumerate(permutation):
+            inverse[canonical_suit] = suit
+        best_strength, canonical_pairs = value
+        best = set()
+        for pair in canonical_pairs:
+            first, second = relabel(pair, inverse)
+            best.update(((first, second), (second, first)))
+        return best_strength, best
+
+    def showdown(self, board, hands):
+        """Position and integer strength of the best of hands (integer encoded hole pairs) with
+        board, the first hand dealt wins the ties as in monte_carlo.best_hand_index. The memo
+        answers when one of the best pairs of the board was dealt, every hand is evaluated
+        otherwise."""
+        best_strength, best = self.best_pairs(board)
+        for position, hand in enumerate(hands):
+            if tuple(hand) in best:
+                return position, best_strength
+        strengths = BoardEvaluator(board).evaluate_hands(hands)
+        best_strength = max(strengths)
+        return strengths.index(best_strength), best_strength
+
+    def stats(self):
+        """Size and hit/miss counters of the cache as a dictionary."""
+        return self.cache.stats()
@@ -0,0 +1,54 @@
+"""
+lru.py. Bounded cache with least recently used eviction and hit/miss counters.
+"""
+from collections import OrderedDict
+
+
+class LRUCache:
+    """Dictionary like cache of at most max_size entries. get marks an entry as recently used,
+    put evicts the least recently used entry once the cache is full."""
+
+    def __init__(self, max_size=1024):
+        if max_size < 1:
+            raise ValueError("max_size should be 1 or more.")
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        """Value of key, or default counting a miss."""
+        try:
+            value = self.entries[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        """Save the value of key, evicting the least recently used entry if needed."""
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        """Remove all the entries, the counters are kept."""
+        self.entries.clear()
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def stats(self):
+        """Size and counters as a dictionary."""
+        lookups = self.hits + self.misses
+        return {"size": len(self.entries), "max_size": self.max_size, "hits": self.hits,
+                "misses": self.misses, "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0}
@@ -5,7 +5,21 @@ Here in version 2 we are combining the 42 posible combinations into a single eva
 to improve the performance.
 Version1 average performance: 0.26 seconds per evaluation
 Version2 average performance: 0.01 seconds per evaluation
+Version3 encodes the cards as integers (see hand_evaluator.py) and resolves a 7 cards hand with
+precomputed lookup tables into a single comparable integer. evaluate_full_hand is kept as the
+reference implementation.
+Version3 average performance: 0.0000014 seconds per 7 cards evaluation (0.00003 for version2)
+best_possible_hand analyzes the board once and scores every hole pair against it, around
+0.0000008 seconds per hand with all the 1081 hands.
 """
+import argparse
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+import contextlib
+from dataclasses import dataclass
+import io
+import json
+import math
 import os
 import sys
 import itertools
@@ -13,42 +27,48 @@ import time
 from collections import Counter
 import timeit
 import random
+import tempfile
 from datetime import datetime
-
-# Hand rankings in poker from highest to lowest
-HAND_RANKS = {
-    "Royal Flush": 10,
-    "Straight Flush": 9,
-    "Four of a Kind": 8,
-    "Full House": 7,
-    "Flush": 6,
-    "Straight": 5,
-    "Three of a Kind": 4,
-    "Two Pair": 3,
-    "One Pair": 2,
-    "High Card": 1
-}
-
-HAND_RANKS_REVERSE = [
-    "High Card",
-    "One Pair",
-    "Two Pair",
-    "Three of a Kind",
-    "Straight",
-    "Flush",
-    "Full House",
-    "Four of a Kind",
-    "Straight Flush",
-    "Royal Flush"
-]
-
-
-
+from time import perf_counter_ns
+import numpy as np
+from hand_evaluator import (CARD_INDEX, CARD_NAMES, HAND_RANKS, HAND_RANKS_REVERSE,
+                            BoardEvaluator, evaluate_cards, hand_strengths_batch, pack_strength,
+                            unpack_strength)
+from combos import (CLASS_OF_CARDS, COMBO_LIST, COMBO_NAME_LIST, HAND_CLASS_INDEX, HAND_CLASSES,
+                    PAIR_POSITIONS, board_combos, cards_mask, combo_class)
+from dealer import Dealer, check_hands
+from sim_records import (BLOCK_RECORDS, OUTPUT_HEADER, RECORD_DTYPE, SPLIT_RECORD_DTYPE,
+                         SWEEP_RECORD_DTYPE, RecordWriter, read_records, records_from_results)
+from adaptive_sampling import ConvergenceTracker
+from aggregate_store import AggregateStore
+from data_science import (STRATIFIED_AGGREGATES, BoardTextureWins, CategoryWins, ClassCategoryWins,
+                          ClassWins, aggregate_file, count_file, players_counter,
+                          raw_to_matriz_gen, report_generator)
+from equity_server import EquityServer
+from equity_table import EquityTable, save_table, values_from_simulations
+from hand_history import HandHistoryStore
+from instrumentation import HISTOGRAM_BUCKETS, PhaseStats, instrumented
+from isomorphism import IsomorphicMemo
+from postflop_equity import exact_postflop_equity
+from preflop_equity import canonical_board_key
+from ranges import COMBOS, parse_range, range_equity
+from stratified_sampling import stratified_sampling
 
 # Example card ranks and suits for simulation
 VALUES = "23456789TJQKA"
 SUITS = "CDHS"  # Clubs, Diamonds, Hearts, Spades
 WORST_POSSIBLE_HAND = (1, [6,4,3,2,1])
+WORST_POSSIBLE_STRENGTH = pack_strength(*WORST_POSSIBLE_HAND)
+DEFAULT_BATCH_HANDS = 200000  # 7-card hands evaluated per batch when the batch size is not set
+TIMED_BLOCK = 1000  # simulations timed together for the execution_time column
+# Sweep files have one row per board and number of players
+SWEEP_OUTPUT_HEADER = OUTPUT_HEADER + "|n_players"
+# Split pot files have one row per hand tied for the best, tied is the number of those hands
+SPLIT_OUTPUT_HEADER = OUTPUT_HEADER + "|tied"
+# Phase timers of the running simulations (instrumentation.Instrumentation), None when disabled
+INSTRUMENTATION = None
+# Showdowns memoized by suit isomorphism class (isomorphism.IsomorphicMemo), None when disabled
+EVALUATION_MEMO = None
 
 # Helper functions
 def card_value(card):
@@ -239,6 +259,16 @@ def evaluate_full_hand(full_hand):
 
     return (HAND_RANKS[hand_type], hand_value)
 
+def hand_strength(full_hand):
+    """Adapter for the integer evaluator. Evaluates a hand of 5 to 7 string cards and returns a
+    single integer, ordered as the evaluate_full_hand results."""
+    return evaluate_cards([CARD_INDEX[card] for card in full_hand])
+
+def evaluate_full_hand_fast(full_hand):
+    """Evaluates a hand of 7 cards with the integer evaluator and returns the same rank and
+    tiebreaker values as evaluate_full_hand."""
+    return unpack_strength(hand_strength(full_hand))
+
 
 def create_deck():
     """ Helper function to create a full deck of cards. """
@@ -265,13 +295,16 @@ def all_possible_hands(community_cards, number_of_hands=None, repeated=False):
     """Generate number_of_hands for possible players, by default generate all possible hand 
     combinartions 47!/(2!*45!). Output: list of hands (two cards), where any card in the hand 
     is a 2 caracter string."""
-    # Create the full deck of cards
-    deck = create_deck()
-    # Remove the cards that are already in the common hand
-    remaining_deck = [card for card in deck if card not in community_cards]
+    return deal_possible_hands([CARD_INDEX[card] for card in community_cards], number_of_hands,
+                               repeated, names=True)
+
+def deal_possible_hands(community_cards, number_of_hands=None, repeated=False, names=False):
+    """all_possible_hands for integer encoded cards, the same hands for the same random state,
+    as string cards if names. The hands without board cards come from the combos index."""
     if repeated:
-        # Generate all possible 2-card combinations from the remaining deck
-        possible_hands = list(itertools.combinations(remaining_deck, 2))
+        # All the 2-card combinations without board cards, in random order
+        pairs = COMBO_NAME_LIST if names else COMBO_LIST
+        possible_hands = [pairs[index] for index in board_combos(community_cards).tolist()]
         random.shuffle(possible_hands)
         if number_of_hands is None:
             return possible_hands
@@ -279,75 +312,1035 @@ def all_possible_hands(community_cards, number_of_hands=None, repeated=False):
 
     if number_of_hands is None:
         number_of_hands = 9
+    board_mask = cards_mask(community_cards)
+    remaining_deck = [card for card in range(52) if not board_mask >> card & 1]
     flat_hand_list = random.sample(remaining_deck, number_of_hands*2)
-    possible_hands = []
-    for i in range(number_of_hands):
-        possible_hands.append((flat_hand_list[2*i], flat_hand_list[2*i+1]))
-    return possible_hands
+    if names:
+        flat_hand_list = [CARD_NAMES[card] for card in flat_hand_list]
+    return list(zip(flat_hand_list[::2], flat_hand_list[1::2]))
 
 def best_possible_hand(community_cards, number_of_hands=None ):
     """Evaluate the best movement against with community cards for number_of_hands players 
     generated. Output: Best possible hand and its result given the generated hands"""
-    best_hand_result = WORST_POSSIBLE_HAND
-    best_pair = None
-    possible_hands = all_possible_hands(community_cards, number_of_hands)
-    #print(possible_hands)
-
-    for hand in possible_hands:
-        # Combine the pair with the 5 community cards to form a 7-card hand
-        seven_card_hand = community_cards + list(hand)
-        # Evaluate the best hand for this 7-card hand
-        current_hand = evaluate_full_hand(seven_card_hand)
-        # Update the best hand result if the current hand is better
-        if current_hand > best_hand_result:
-            best_hand_result = current_hand
-            best_pair = hand
-    return best_pair, best_hand_result
-
-def monte_carlo_training(n=10000, number_of_hands=None):
-    """monte_carlo_training method. generate n simulations with number_of_hands players and print 
-    the results. output: common cards, winner hand, hand result, execution time"""
-    i=n
-    while i>0:
-        i -= 1
+    # More than 23 players can only be dealt repeating cards, as the 1081 hands mode
+    repeated = number_of_hands is not None and number_of_hands * 2 > 47
+    possible_hands = deal_possible_hands([CARD_INDEX[card] for card in community_cards],
+                                         number_of_hands, repeated)
+    best_index, best_hand_result = best_hand_index(
+        [CARD_INDEX[card] for card in community_cards], possible_hands)
+    first, second = possible_hands[best_index]
+    return (CARD_NAMES[first], CARD_NAMES[second]), unpack_strength(best_hand_result)
+
+def best_hand_index(community_cards, hands):
+    """Position and integer strength of the best of hands (integer encoded hole pairs) with the
+    integer encoded community_cards. The board is analyzed once (hand_evaluator.BoardEvaluator)
+    and the first hand dealt wins the ties. Served by EVALUATION_MEMO when enabled."""
+    if EVALUATION_MEMO is not None:
+        return EVALUATION_MEMO.showdown(community_cards, hands)
+    strengths = BoardEvaluator(community_cards).evaluate_hands(hands)
+    best_strength = max(strengths)
+    return strengths.index(best_strength), best_strength
+
+def best_dealt_hand(community_cards, hands):
+    """best_possible_hand for integer encoded cards as dealt by dealer.Dealer.deal.
+    Output: best hand and its integer strength, the first hand dealt wins the ties."""
+    best_index, best_hand_result = best_hand_index(community_cards, hands)
+    return hands[best_index], best_hand_result
+
+def deal_batch(rng, batch_size, number_of_hands):
+    """Deal batch_size boards with number_of_hands players each from a numpy Generator.
+    Output: community_cards array (batch_size, 5) and hands array (batch_size, number_of_hands, 2)
+    of integer encoded cards (see dealer.Dealer.deal_batch)."""
+    return Dealer(rng=rng).deal_batch(batch_size, number_of_hands)
+
+def best_possible_hands_batch(community_cards, hands):
+    """Batch version of best_possible_hand. Input arrays as returned by deal_batch.
+    Output: winner hands (batch_size, 2) and their strengths (batch_size,). As in
+    best_possible_hand the first hand dealt wins the ties."""
+    strengths = hand_strengths_batch(community_cards, hands)
+    winners = strengths.argmax(axis=1)
+    boards = np.arange(len(hands))
+    return hands[boards, winners], strengths[boards, winners]
+
+def prefix_winners(strengths):
+    """Winner of every prefix of the hands dealt: for strengths (batch_size, number_of_hands)
+    returns the position (batch_size, number_of_hands) of the first best hand among the first
+    k + 1 hands at column k, as best_possible_hand would choose with k + 1 players."""
+    improved = np.ones(strengths.shape, dtype=bool)
+    improved[:, 1:] = strengths[:, 1:] > np.maximum.accumulate(strengths, axis=1)[:, :-1]
+    return np.maximum.accumulate(np.where(improved, np.arange(strengths.shape[1]), 0), axis=1)
+
+def split_showdown(strengths):
+    """Every hand tied for the best of a batch of strengths (batch_size, number_of_hands).
+    Output: board and hand positions of the tied hands, in board order, and the number of hands
+    tied in their board. Every tied hand wins 1 / tied of the pot."""
+    tied_hands = strengths == strengths.max(axis=1, keepdims=True)
+    tied = tied_hands.sum(axis=1)
+    boards, positions = np.nonzero(tied_hands)
+    return boards, positions, tied[boards]
+
+def monte_carlo_split_training(n=10000, number_of_hands=9, batch_size=None, rng=None,
+                               writer=None):
+    """Split pot version of monte_carlo_batch_training. Every hand tied for the best of a board
+    is a winner, printed in its own row with the tied column (SPLIT_OUTPUT_HEADER), or saved
+    with writer (sim_records.RecordWriter of SPLIT_RECORD_DTYPE)."""
+    if batch_size is None:
+        batch_size = max(1, DEFAULT_BATCH_HANDS // number_of_hands)
+    dealer = Dealer(rng=rng)
+    instrumentation = INSTRUMENTATION
+    i = n
+    while i > 0:
+        boards = min(batch_size, i)
+        i -= boards
         start_time = time.time()
-        community_cards = create_community_cards()
-        hand, hand_result = best_possible_hand(community_cards, number_of_hands)
-        end_time = time.time()
-        execution_time = end_time - start_time
-        print(",".join(community_cards),
-              ",".join(hand), hand_result[0],
+        if instrumentation is not None:
+            start = perf_counter_ns()
+        community_cards, hands = dealer.deal_batch(boards, number_of_hands)
+        if instrumentation is not None:
+            start = instrumentation.record("deal", start, boards * number_of_hands)
+        strengths = hand_strengths_batch(community_cards, hands)
+        rows, positions, tied = split_showdown(strengths)
+        if instrumentation is not None:
+            instrumentation.record("evaluate", start, boards * number_of_hands)
+        execution_time = (time.time() - start_time) / boards
+        results = (community_cards[rows], hands[rows, positions], strengths[rows, positions],
+                   tied)
+        if writer is None:
+            _output(lambda *batch: print_batch_results(*batch[:3], execution_time, batch[3]),
+                    *results)
+        else:
+            _output(lambda *batch: writer.write(records_from_results(*batch[:3],
+                                                                     tied=batch[3])),
+                    *results)
+
+def monte_carlo_batch_training(n=10000, number_of_hands=None, batch_size=None, rng=None):
+    """Batch version of monte_carlo_training. Deal and evaluate batch_size boards per numpy call
+    and print the same rows, execution time is the batch time divided by the boards."""
+    number_of_hands = 9 if number_of_hands is None else number_of_hands
+    if batch_size is None:
+        batch_size = max(1, DEFAULT_BATCH_HANDS // number_of_hands)
+    dealer = Dealer(rng=rng)
+    i = n
+    while i > 0:
+        boards = min(batch_size, i)
+        i -= boards
+        start_time = time.time()
+        community_cards, _, winners, strengths = _batch_showdown(dealer, boards,
+                                                                 number_of_hands)
+        execution_time = (time.time() - start_time) / boards
+        _output(print_batch_results, community_cards, winners, strengths, execution_time)
+
+def _batch_showdown(dealer, boards, number_of_hands):
+    """Deal and evaluate a batch, timing both phases when instrumentation is enabled.
+    Output: community_cards, hands, winners and strengths arrays."""
+    instrumentation = INSTRUMENTATION
+    if instrumentation is None:
+        community_cards, hands = dealer.deal_batch(boards, number_of_hands)
+        return (community_cards, hands) + best_possible_hands_batch(community_cards, hands)
+    start = perf_counter_ns()
+    community_cards, hands = dealer.deal_batch(boards, number_of_hands)
+    start = instrumentation.record("deal", start, hands.shape[0] * hands.shape[1])
+    winners, strengths = best_possible_hands_batch(community_cards, hands)
+    instrumentation.record("evaluate", start, hands.shape[0] * hands.shape[1])
+    return community_cards, hands, winners, strengths
+
+def _output(output_function, community_cards, *results):
+    """Call output_function (print rows or write records) with the results of a batch, timed as
+    the output phase when instrumentation is enabled."""
+    instrumentation = INSTRUMENTATION
+    if instrumentation is None:
+        output_function(community_cards, *results)
+        return
+    start = perf_counter_ns()
+    output_function(community_cards, *results)
+    instrumentation.record("output", start, len(community_cards))
+
+def _write_records(writer):
+    """Output function saving the results of a batch as records with writer."""
+    return lambda community_cards, winners, strengths: writer.write(
+        records_from_results(community_cards, winners, strengths))
+
+def print_batch_results(community_cards, winners, strengths, execution_time, last_column=None):
+    """Print the rows of a batch of simulations as monte_carlo_training does. last_column is an
+    optional array added as last column, as n_players (SWEEP_OUTPUT_HEADER) or tied
+    (SPLIT_OUTPUT_HEADER)."""
+    extra_columns = [()] * len(strengths) if last_column is None else [
+        (value,) for value in last_column.tolist()]
+    for board, hand, strength, extra in zip(community_cards.tolist(), winners.tolist(),
+                                            strengths.tolist(), extra_columns):
+        hand_result = unpack_strength(strength)
+        print(",".join(CARD_NAMES[card] for card in board),
+              ",".join(CARD_NAMES[card] for card in hand), hand_result[0],
               ",".join(map(str,hand_result[1])),
-              execution_time,
+              execution_time, *extra,
               sep="|")
 
+def monte_carlo_sweep_training(n=10000, number_of_hands=9, batch_size=None, rng=None,
+                               writer=None):
+    """Sweep of the number of players. Deal every board once with number_of_hands players and
+    keep the winner among the first k hands for every k from 2 to number_of_hands, the first k
+    hands dealt being a valid deal of k players. Print one row per board and k with the
+    n_players column, or save them with writer (sim_records.RecordWriter of
+    SWEEP_RECORD_DTYPE)."""
+    if batch_size is None:
+        batch_size = max(1, DEFAULT_BATCH_HANDS // number_of_hands)
+    dealer = Dealer(rng=rng)
+    instrumentation = INSTRUMENTATION
+    n_players = np.arange(2, number_of_hands + 1)
+    i = n
+    while i > 0:
+        boards = min(batch_size, i)
+        i -= boards
+        start_time = time.time()
+        if instrumentation is not None:
+            start = perf_counter_ns()
+        community_cards, hands = dealer.deal_batch(boards, number_of_hands)
+        if instrumentation is not None:
+            start = instrumentation.record("deal", start, boards * number_of_hands)
+        strengths = hand_strengths_batch(community_cards, hands)
+        winners = prefix_winners(strengths)[:, 1:]
+        if instrumentation is not None:
+            instrumentation.record("evaluate", start, boards * number_of_hands)
+        execution_time = (time.time() - start_time) / boards
+        # One row per board and number of players, boards first
+        rows = np.repeat(np.arange(boards), len(n_players))
+        winners = winners.ravel()
+        results = (community_cards[rows], hands[rows, winners], strengths[rows, winners],
+                   np.tile(n_players, boards))
+        if writer is None:
+            _output(lambda *batch: print_batch_results(*batch[:3], execution_time, batch[3]),
+                    *results)
+        else:
+            _output(lambda *batch: writer.write(records_from_results(*batch)), *results)
+
+def monte_carlo_adaptive_training(tracker, target_half_width, n=10000, number_of_hands=None,
+                                  batch_size=None, rng=None, check_every=10000, writer=None):
+    """Run batches of simulations until the confidence interval of every cell watched by tracker
+    (adaptive_sampling.ConvergenceTracker) is narrower than target_half_width, checking every
+    check_every simulations, or until n simulations. The simulations are printed as in
+    monte_carlo_training, or saved with writer (sim_records.RecordWriter).
+    Output: True if the target was reached."""
+    number_of_hands = 9 if number_of_hands is None else number_of_hands
+    if batch_size is None:
+        batch_size = max(1, DEFAULT_BATCH_HANDS // number_of_hands)
+    batch_size = min(batch_size, check_every)
+    dealer = Dealer(rng=rng)
+    next_check = check_every
+    while tracker.simulations < n:
+        boards = min(batch_size, n - tracker.simulations, next_check - tracker.simulations)
+        start_time = time.time()
+        community_cards, hands, winners, strengths = _batch_showdown(dealer, boards,
+                                                                     number_of_hands)
+        execution_time = (time.time() - start_time) / boards
+        tracker.update(hands, winners)
+        if writer is None:
+            _output(print_batch_results, community_cards, winners, strengths, execution_time)
+        else:
+            _output(_write_records(writer), community_cards, winners, strengths)
+        if tracker.simulations == next_check:
+            next_check += check_every
+            if tracker.checkpoint() <= target_half_width:
+                return True
+    if not tracker.curve or tracker.curve[-1]["simulations"] != tracker.simulations:
+        tracker.checkpoint()
+    return tracker.curve[-1]["max_half_width"] <= target_half_width
+
+def monte_carlo_training(n=10000, number_of_hands=None, batch_size=None, rng=None):
+    """monte_carlo_training method. generate n simulations with number_of_hands players and print 
+    the results. output: common cards, winner hand, hand result, execution time.
+    With batch_size the boards are dealt and evaluated in numpy batches from rng. The execution
+    time is the mean of the TIMED_BLOCK simulations of a row, timed once per block."""
+    if batch_size is not None:
+        monte_carlo_batch_training(n, number_of_hands, batch_size, rng)
+        return
+    blocks = simulation_blocks(n, number_of_hands, None, rng, TIMED_BLOCK)
+    while True:
+        start_time = time.time()
+        block = next(blocks, None)
+        if block is None:
+            return
+        execution_time = (time.time() - start_time) / len(block[0])
+        _output(lambda *results: print_batch_results(*results, execution_time), *block)
+
+def monte_carlo_records(writer, n=10000, number_of_hands=None, batch_size=None, rng=None):
+    """Binary version of monte_carlo_training. Generate n simulations and save them as records
+    with writer (sim_records.RecordWriter) in blocks instead of printing every row."""
+    for community_cards, winners, strengths in simulation_blocks(n, number_of_hands, batch_size,
+                                                                 rng):
+        _output(_write_records(writer), community_cards, winners, strengths)
+
+def simulation_blocks(n=10000, number_of_hands=None, batch_size=None, rng=None,
+                      block_size=BLOCK_RECORDS):
+    """Generate n simulations in blocks, as numpy batches of batch_size boards from rng, or one
+    by one in blocks of block_size boards without batch_size.
+    Output: yields community_cards (boards, 5), winner hands (boards, 2) and strengths arrays."""
+    number_of_hands = 9 if number_of_hands is None else number_of_hands
+    if batch_size is not None:
+        dealer = Dealer(rng=rng)
+        i = n
+        while i > 0:
+            boards = min(batch_size, i)
+            i -= boards
+            community_cards, _, winners, strengths = _batch_showdown(dealer, boards,
+                                                                     number_of_hands)
+            yield community_cards, winners, strengths
+        return
+    dealer = Dealer()
+    instrumentation = INSTRUMENTATION
+    i = n
+    while i > 0:
+        block = min(block_size, i)
+        i -= block
+        block_cards, block_hands, block_strengths = [], [], []
+        for _ in range(block):
+            if instrumentation is not None:
+                start = perf_counter_ns()
+            community_cards, hands = dealer.deal(number_of_hands)
+            if instrumentation is not None:
+                start = instrumentation.record("deal", start, number_of_hands)
+            hand, strength = best_dealt_hand(community_cards, hands)
+            if instrumentation is not None:
+                instrumentation.record("evaluate", start, number_of_hands)
+            block_cards.append(community_cards)
+            block_hands.append(hand)
+            block_strengths.append(strength)
+        yield np.array(block_cards), np.array(block_hands), np.array(block_strengths)
+
 ### data collections
 
 def data_collection():
     """Save a file with simulations results."""
     print(sys.argv, len(sys.argv) < 2, len(sys.argv) < 3)
-    simulations = 5 if len(sys.argv) < 2 else int(sys.argv[1])
-    num_of_hands = 1081 if len(sys.argv) < 3 else int(sys.argv[2])
+    parser = argparse.ArgumentParser(description='Monte Carlo simulations for poker.')
+    parser.add_argument('number_of_simulations', nargs='?', type=int, default=5)
+    parser.add_argument('number_of_players', nargs='?', type=int, default=1081)
+    parser.add_argument('-b', '--batch_size', type=int,
+                        help='deal and evaluate the boards in numpy batches of this size')
+    parser.add_argument('-w', '--workers', type=int, default=1,
+                        help='split the simulations between this number of processes')
+    parser.add_argument('-s', '--seed', type=int,
+                        help='master seed to reproduce the random streams of a run')
+    parser.add_argument('--binary', action='store_true',
+                        help='save binary record files (sim_records.py) instead of CSV')
+    parser.add_argument('--compress', action='store_true',
+                        help='compress the binary record files with zlib')
+    parser.add_argument('-t', '--target_half_width', type=float,
+                        help='stop once the confidence interval of the win probability of every '
+                             'hand class is narrower than this, number_of_simulations is the limit')
+    parser.add_argument('--cells', nargs='+',
+                        help='hand classes watched by --target_half_width, as AAP KAS KAN')
+    parser.add_argument('--check_every', type=int, default=10000,
+                        help='simulations between confidence interval checks')
+    parser.add_argument('--sweep', action='store_true',
+                        help='save the winner of every number of players from 2 to '
+                             'number_of_players (up to 23) of every board, in one file')
+    parser.add_argument('--split_pots', action='store_true',
+                        help='save every hand tied for the best as a winner with the number of '
+                             'hands tied, each one wins that fraction of the pot')
+    parser.add_argument('--memo_size', type=int, default=0,
+                        help='memoize the showdowns of up to this many suit isomorphism classes '
+                             'of boards, for the all hands runs without --batch_size')
+    parser.add_argument('--instrument', action='store_true',
+                        help='time the deal, evaluate and output phases and save a JSON summary')
+    parser.add_argument('--profile', action='store_true',
+                        help='run with cProfile and save the stats in a .prof file')
+    args = parser.parse_args()
+    simulations = args.number_of_simulations
+    num_of_hands = args.number_of_players
     file_identifier = "all" if num_of_hands >= 1000 else str(num_of_hands) + "hands"
+    if args.sweep:
+        if not 2 <= num_of_hands <= 23 or args.target_half_width is not None:
+            parser.error("--sweep needs 2 to 23 players and does not use --target_half_width.")
+        file_identifier = "sweep" + file_identifier
+    if args.split_pots:
+        if args.sweep or args.target_half_width is not None:
+            parser.error("--split_pots does not use --sweep or --target_half_width.")
+        file_identifier = "split" + file_identifier
+    try:
+        check_hands(num_of_hands)
+        check_memo(args.memo_size, num_of_hands, args.batch_size, args.sweep, args.split_pots)
+    except ValueError as error:
+        parser.error(str(error))
+    unknown_cells = [cell for cell in args.cells or () if cell not in HAND_CLASS_INDEX]
+    if unknown_cells:
+        parser.error(f"Unknown --cells {' '.join(unknown_cells)}, use hand classes as AAP KAS "
+                     "KAN.")
     time_format = datetime.now().strftime("%Y%m%d_%H%M%S")
     print(f"Running {simulations} simulations with {num_of_hands} num_of_hands at {time_format}.")
-    print("file_identifier: {file_identifier}.")
+    print(f"file_identifier: {file_identifier}.")
     file_path = os.getenv("POKER_OUT_FILE_PATH", "")
 
-    file_name = f"{file_path}poker_monte_carlo_{simulations}_{file_identifier}_{time_format}.csv"
+    file_name = f"{file_path}poker_monte_carlo_{simulations}_{file_identifier}_{time_format}"
+    seed = args.seed if args.seed is not None else np.random.SeedSequence().entropy
+    print(f"seed: {seed}.")
+    binary = args.binary or args.compress
+    compression = "zlib" if args.compress else "none"
+    if args.target_half_width is not None:
+        if args.workers > 1:
+            parser.error("--target_half_width runs in a single process, do not use --workers.")
+        adaptive_data_collection(file_name, simulations, num_of_hands, args, seed, binary,
+                                 compression)
+        return
+    settings = ShardSettings(num_of_hands, args.batch_size, binary, compression,
+                             args.instrument, args.profile, args.sweep, args.split_pots,
+                             args.memo_size)
+    if args.workers > 1:
+        parallel_data_collection(file_name, simulations, seed, args.workers, settings)
+        return
+
+    file_name += ".bin" if binary else ".csv"
     print("file_name:", file_name)
-    with open(file_name, "w", encoding="utf-8") as file:
-        sys.stdout = file
-        print("community_cards|hand|hand_result_1|hand_result_2|execution_time")
-        monte_carlo_training(simulations, num_of_hands)
-        sys.stdout = sys.__stdout__
+    simulation_shard(file_name, simulations, np.random.SeedSequence(seed), settings)
+
+def adaptive_data_collection(file_name, simulations, num_of_hands, args, seed, binary,
+                             compression):
+    """data_collection with confidence driven stopping. Save the simulations and a JSON file with
+    the estimates, their confidence intervals and the convergence curve."""
+    tracker = ConvergenceTracker(args.cells)
+    seed_sequence = np.random.SeedSequence(seed)
+    random.seed(int(seed_sequence.generate_state(1, np.uint64)[0]))
+    rng = np.random.default_rng(seed_sequence)
+    simulations_file = file_name + (".bin" if binary else ".csv")
+    print("file_name:", simulations_file)
+    with instrumented(simulations_file, args.instrument, args.profile) as instrumentation:
+        set_instrumentation(instrumentation)
+        if binary:
+            with RecordWriter(simulations_file, compression) as writer:
+                converged = monte_carlo_adaptive_training(
+                    tracker, args.target_half_width, simulations, num_of_hands, args.batch_size,
+                    rng, args.check_every, writer)
+        else:
+            with open(simulations_file, "w", encoding="utf-8") as file:
+                sys.stdout = file
+                print(OUTPUT_HEADER)
+                converged = monte_carlo_adaptive_training(
+                    tracker, args.target_half_width, simulations, num_of_hands, args.batch_size,
+                    rng, args.check_every)
+                sys.stdout = sys.__stdout__
+        set_instrumentation(None)
+
+    summary = tracker.summary()
+    summary.update({"target_half_width": args.target_half_width, "converged": converged})
+    convergence_file = f"{file_name}_convergence.json"
+    with open(convergence_file, "w", encoding="utf-8") as file:
+        json.dump(summary, file, indent=1)
+    print(f"Converged: {converged} after {tracker.simulations} simulations.")
+    for point in tracker.curve:
+        print(f"simulations: {point['simulations']}, max half width: "
+              f"{point['max_half_width']:.5f} ({point['widest_cell']}), "
+              f"mean half width: {point['mean_half_width']:.5f}")
+    print("convergence file_name:", convergence_file)
+
+def set_instrumentation(instrumentation):
+    """Enable the phase timers of the simulations with an instrumentation.Instrumentation, or
+    disable them with None."""
+    global INSTRUMENTATION  # pylint: disable=global-statement
+    INSTRUMENTATION = instrumentation
+
+def set_evaluation_memo(memo):
+    """Memoize the showdowns of the serial simulations with an isomorphism.IsomorphicMemo, or
+    disable the memo with None."""
+    global EVALUATION_MEMO  # pylint: disable=global-statement
+    EVALUATION_MEMO = memo
+
+def check_memo(memo_size, num_of_hands, batch_size=None, sweep=False, split_pots=False):
+    """Raise ValueError if a showdown memo of memo_size would not be used or would slow the run
+    down: a memo miss evaluates all the 1081 hole pairs of the board, so the memo needs all the
+    hands dealt, and only the showdowns of the runs without batch_size, sweep or split_pots go
+    through it."""
+    if memo_size > 0 and (num_of_hands < len(PAIR_POSITIONS) or batch_size is not None
+                          or sweep or split_pots):
+        raise ValueError(f"The showdown memo needs all the {len(PAIR_POSITIONS)} hands, without "
+                         "batch_size, sweep or split_pots.")
+
+@dataclass(frozen=True)
+class ShardSettings:
+    """Settings of the simulation files of a run, the same for all its shards. binary saves
+    binary records compressed with compression instead of CSV. instrument and profile save the
+    phase timers summary and the cProfile stats next to the file (see
+    instrumentation.instrumented). sweep saves the winners of every number of players (see
+    monte_carlo_sweep_training), split_pots saves every hand tied for the best (see
+    monte_carlo_split_training). memo_size enables a showdown memo of that many suit isomorphism
+    classes (see isomorphism.IsomorphicMemo and check_memo)."""
+    num_of_hands: int
+    batch_size: int = None
+    binary: bool = False
+    compression: str = "none"
+    instrument: bool = False
+    profile: bool = False
+    sweep: bool = False
+    split_pots: bool = False
+    memo_size: int = 0
+
+def simulation_shard(file_name, simulations, seed_sequence, settings):
+    """Run simulations with random streams derived from seed_sequence and save them in
+    file_name with the ShardSettings settings. Used by data_collection and by every worker of
+    parallel_data_collection. Raises ValueError if the run does not use the showdown memo of
+    the settings (see check_memo)."""
+    num_of_hands, batch_size = settings.num_of_hands, settings.batch_size
+    sweep, split_pots, memo_size = settings.sweep, settings.split_pots, settings.memo_size
+    check_memo(memo_size, num_of_hands, batch_size, sweep, split_pots)
+    random.seed(int(seed_sequence.generate_state(1, np.uint64)[0]))
+    rng = np.random.default_rng(seed_sequence)
+    with instrumented(file_name, settings.instrument, settings.profile) as instrumentation:
+        set_instrumentation(instrumentation)
+        set_evaluation_memo(IsomorphicMemo(memo_size) if memo_size > 0 else None)
+        if settings.binary:
+            dtype = RECORD_DTYPE
+            if sweep:
+                dtype = SWEEP_RECORD_DTYPE
+            elif split_pots:
+                dtype = SPLIT_RECORD_DTYPE
+            with RecordWriter(file_name, settings.compression, dtype=dtype) as writer:
+                if sweep:
+                    monte_carlo_sweep_training(simulations, num_of_hands, batch_size, rng,
+                                               writer)
+                elif split_pots:
+                    monte_carlo_split_training(simulations, num_of_hands, batch_size, rng,
+                                               writer)
+                else:
+                    monte_carlo_records(writer, simulations, num_of_hands, batch_size, rng)
+        else:
+            with open(file_name, "w", encoding="utf-8") as file:
+                previous_output = sys.stdout
+                sys.stdout = file
+                if sweep:
+                    print(SWEEP_OUTPUT_HEADER)
+                    monte_carlo_sweep_training(simulations, num_of_hands, batch_size, rng)
+                elif split_pots:
+                    print(SPLIT_OUTPUT_HEADER)
+                    monte_carlo_split_training(simulations, num_of_hands, batch_size, rng)
+                else:
+                    print(OUTPUT_HEADER)
+                    monte_carlo_training(simulations, num_of_hands, batch_size, rng)
+                sys.stdout = previous_output
+        if EVALUATION_MEMO is not None:
+            print("evaluation memo:", EVALUATION_MEMO.stats())
+        set_instrumentation(None)
+        set_evaluation_memo(None)
+    return file_name
+
+def parallel_data_collection(file_name, simulations, seed, workers, settings):
+    """Split the simulations between a pool of workers processes. Every worker has its own
+    reproducible random stream spawned from seed and saves its own shard file with the
+    ShardSettings settings. A manifest with the shard files is saved at the end, it can be used
+    as list file (-l) in data_science.py"""
+    shard_simulations = [simulations // workers + (1 if i < simulations % workers else 0)
+                         for i in range(workers)]
+    seed_sequences = np.random.SeedSequence(seed).spawn(workers)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        extension = "bin" if settings.binary else "csv"
+        futures = [executor.submit(simulation_shard, f"{file_name}_shard{i}.{extension}",
+                                   shard_simulations[i], seed_sequences[i], settings)
+                   for i in range(workers) if shard_simulations[i] > 0]
+        shard_files = [future.result() for future in futures]
+
+    manifest_name = f"{file_name}_manifest.txt"
+    with open(manifest_name, "w", encoding="utf-8") as manifest:
+        for shard_file in shard_files:
+            manifest.write(shard_file + "\n")
+    print("shard files:", shard_files)
+    print("manifest file_name:", manifest_name)
+    return manifest_name
 
 ###Testing###
 
+@contextlib.contextmanager
+def _test_directory():
+    """Temporary directory of a test, removed at the end, with the standard output discarded."""
+    with tempfile.TemporaryDirectory() as directory, contextlib.redirect_stdout(io.StringIO()):
+        yield directory
+
 def full_test():
     """Automated full testing."""
     tc2_methods_comparizon()
     tc3_validate_distinct_hands()
+    tc4_integer_evaluator()
+    tc5_batch_showdown()
+    tc6_sweep_prefixes()
+    tc7_split_showdown()
+    tc8_postflop_equity()
+    tc9_isomorphic_memo()
+    tc10_range_equity()
+    tc11_stratified_sampling()
+    tc12_campaign_resume()
+    tc13_single_pass_aggregates()
+    tc14_exhaustive_enumeration()
+    tc15_hand_history_queries()
+    tc16_equity_table_lookups()
+    tc17_aggregate_store_reingest()
+    tc18_adaptive_stopping()
+    tc19_instrumentation_histogram()
+    tc20_equity_server()
+    tc21_pipeline_report()
+
+def tc21_pipeline_report(number_of_siluations=500):
+    """Run the simulate to report pipeline and simulation_shard with the same seed, the report
+    of the pipeline should be the data_science.report_generator report of the shard file and
+    its raw side tap the same simulations. No output"""
+    # Imported here, pipeline.py imports monte_carlo
+    from pipeline import run_pipeline  # pylint: disable=import-outside-toplevel
+    with _test_directory() as directory:
+        raw_file = os.path.join(directory, "raw.bin")
+        shard_file = os.path.join(directory, "shard.csv")
+        pipeline_output, file_output = io.StringIO(), io.StringIO()
+        with contextlib.redirect_stdout(pipeline_output):
+            counts = run_pipeline(number_of_siluations, 9, 100, 21, 0, raw_file, report=False)
+        simulation_shard(shard_file, number_of_siluations, np.random.SeedSequence(21),
+                         ShardSettings(9, 100))
+        with contextlib.redirect_stdout(file_output):
+            report_generator([shard_file], 9, report=False)
+        assert counts == count_file(shard_file) == count_file(raw_file), "different counts"
+    assert sum(counts.values()) == number_of_siluations, "simulations"
+    assert pipeline_output.getvalue().endswith(file_output.getvalue()), "different reports"
+
+def tc20_equity_server():
+    """Run the equity server on an ephemeral port: suit isomorphic queries in flight share one
+    simulation, a request with a short deadline does not shorten the others, the results come
+    from the cache once finished, a query needing more samples than the cache continues from
+    its samples and a failed round answers its requests. No output"""
+
+    async def get(port, path):
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(f"GET {path} HTTP/1.1\r\nHost: localhost\r\n\r\n".encode("latin-1"))
+        response = await reader.read()
+        writer.close()
+        head, _, body = response.partition(b"\r\n\r\n")
+        return int(head.split()[1]), json.loads(body)
+
+    async def run():
+        equity_server = EquityServer(chunk_samples=1000, seed=12)
+        equity_server.start()
+        server = await asyncio.start_server(equity_server.handle, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        async with server:
+            (_, full), (_, short), (_, isomorphic) = await asyncio.gather(
+                get(port, "/equity?hand=AS,KS&board=2S,7S,9H&samples=50000&deadline_ms=10000"),
+                get(port, "/equity?hand=AS,KS&board=2S,7S,9H&samples=50000&deadline_ms=0"),
+                get(port, "/equity?hand=AH,KH&board=2H,7H,9D&samples=1000&deadline_ms=10000"))
+            assert full["samples"] == 50000 and not full["cached"], "full query shortened"
+            assert 0 < short["samples"] < 50000, f"deadline stop {short['samples']}"
+            assert isomorphic["samples"] >= 1000, "isomorphic query"
+            _, cached = await get(port, "/equity?hand=AD,KD&board=2D,7D,9C&samples=50000")
+            assert cached["cached"] and cached["equity"] == full["equity"], "cache hit"
+            _, stats = await get(port, "/stats")
+            assert stats["counters"]["coalesced"] == 2, "coalesced queries"
+            assert stats["counters"]["deadline_stops"] == 1, "deadline stops"
+            await get(port, "/equity?hand=QC,JC&samples=1000")
+            samples = equity_server.counters["samples"]
+            _, more = await get(port, "/equity?hand=QD,JD&samples=3000")
+            assert more["samples"] == 3000 and not more["cached"], "more samples"
+            assert equity_server.counters["samples"] - samples == 2000, "cached samples dropped"
+
+            def failing_round(queries):
+                raise RuntimeError("failed round")
+            equity_server._simulate_round = failing_round  # pylint: disable=protected-access
+            status, failed = await asyncio.wait_for(get(port, "/equity?hand=2C,2D"), 10)
+            assert status == 500 and "failed round" in failed["error"], "failed round"
+            assert not equity_server.active, "failed query kept"
+        equity_server.batcher.cancel()
+
+    asyncio.run(run())
+
+def tc19_instrumentation_histogram(number_of_siluations=300):
+    """Count known latencies in the power of 2 buckets of a PhaseStats and check the
+    percentiles, then the phases of an instrumented batch simulation. No output"""
+    stats = PhaseStats()
+    for elapsed_ns in (0, 1, 3, 4, 7, 1000, 1023, 1024, 1 << 80):
+        stats.add(elapsed_ns, 2)
+    expected = {0: 1, 1: 1, 2: 1, 3: 2, 10: 2, 11: 1, HISTOGRAM_BUCKETS - 1: 1}
+    assert stats.histogram == [expected.get(bucket, 0) for bucket in range(HISTOGRAM_BUCKETS)], \
+        "histogram buckets"
+    assert (stats.calls, stats.items, stats.min_ns, stats.max_ns) == (9, 18, 0, 1 << 80), "stats"
+    assert [stats.percentile(percent) for percent in (50, 80, 90)] == [8, 2048, 1 << 63], \
+        "percentiles"
+    summary = stats.summary(stats.total_ns)
+    assert sum(summary["histogram_ns"].values()) == 9 and summary["histogram_ns"]["<8"] == 2, \
+        "summary histogram"
+    with _test_directory() as directory:
+        file_name = os.path.join(directory, "instrumented.csv")
+        simulation_shard(file_name, number_of_siluations, np.random.SeedSequence(4),
+                         ShardSettings(9, 100, instrument=True))
+        with open(f"{file_name}.instrumentation.json", encoding="utf-8") as summary_file:
+            phases = json.load(summary_file)["phases"]
+    for phase in ("deal", "evaluate", "output"):
+        assert phases[phase]["calls"] == 3, f"{phase} calls"
+        assert sum(phases[phase]["histogram_ns"].values()) == 3, f"{phase} histogram"
+    assert phases["deal"]["items"] == phases["evaluate"]["items"] == 9 * number_of_siluations
+    assert phases["output"]["items"] == number_of_siluations, "output items"
+
+def tc18_adaptive_stopping(target_half_width=0.02):
+    """Run heads up simulations watching AAP until its confidence interval is narrower than
+    target_half_width, the estimate is within the half width of the exact 0.8520 (plus the ties,
+    0.0054, won by the first hand dealt). No output"""
+    tracker = ConvergenceTracker(["AAP"])
+    with contextlib.redirect_stdout(io.StringIO()):
+        converged = monte_carlo_adaptive_training(tracker, target_half_width, 500000, 2, 5000,
+                                                  np.random.default_rng(8), 5000)
+    half_width = tracker.curve[-1]["max_half_width"]
+    assert converged and half_width <= target_half_width, "not converged"
+    assert tracker.simulations < 500000, "no early stop"
+    assert len(tracker.curve) < 2 or tracker.curve[-2]["max_half_width"] > target_half_width, \
+        "stopped late"
+    estimate = tracker.estimates()[HAND_CLASS_INDEX["AAP"]]
+    assert abs(estimate - 0.8520) <= half_width + 0.0054, f"AAP estimate {estimate}"
+
+def tc17_aggregate_store_reingest(number_of_siluations=100):
+    """Ingest 3 simulation files in an aggregate store, change one of them and ingest them again
+    from the saved store: only the changed file is counted again. No output"""
+    with _test_directory() as directory:
+        file_names = [os.path.join(directory, f"shard{shard}.csv") for shard in range(3)]
+        for shard, file_name in enumerate(file_names):
+            simulation_shard(file_name, number_of_siluations, np.random.SeedSequence(shard),
+                             ShardSettings(9, 50))
+        store_file = os.path.join(directory, "store.json")
+        counted = []
+
+        def counting(file_name):
+            counted.append(file_name)
+            return count_file(file_name)
+
+        first_counts, parsed = AggregateStore(store_file).counts(file_names, counting)
+        assert parsed == file_names and counted == file_names, "first ingestion"
+        changed_time = os.stat(file_names[1]).st_mtime_ns + 10 ** 9
+        os.utime(file_names[1], ns=(changed_time, changed_time))
+        counted.clear()
+        store = AggregateStore(store_file)
+        second_counts, parsed = store.counts(file_names, counting)
+        assert parsed == counted == [file_names[1]], "only the changed file is counted again"
+        assert second_counts == first_counts, "different counts"
+        assert len(store.entries) == 3, "entry of the previous version kept"
+        assert len(AggregateStore(store_file).entries) == 3, "store not saved"
+
+def tc16_equity_table_lookups(number_of_siluations=400):
+    """Build an equity table with flop entries from binary simulation records, reopen it
+    memory mapped and compare its lookups with the wins of the records, normalized by the
+    combinations of the class dealt after the flop, and with the table of the same simulations
+    saved as CSV. Lookups of missing players or flops raise ValueError. No output"""
+    with _test_directory() as directory:
+        file_name = os.path.join(directory, "simulations.bin")
+        simulation_shard(file_name, number_of_siluations, np.random.SeedSequence(3),
+                         ShardSettings(9, 100, binary=True))
+        table_name = os.path.join(directory, "table.pkeq")
+        save_table(table_name, *values_from_simulations({9: [file_name]}, flops=True))
+        table = EquityTable(table_name)
+        records = np.concatenate(list(read_records(file_name)))
+        boards = records["community_cards"].tolist()
+        winners = [combo_class(*hand) for hand in records["hand"].tolist()]
+        for record in range(3):
+            flop, hand_class = boards[record][:3], winners[record]
+            same_flop = [canonical_board_key(board[:3]) == canonical_board_key(flop)
+                         for board in boards]
+            wins = sum(same and winner == hand_class for same, winner in zip(same_flop, winners))
+            dealt = Counter(itertools.starmap(combo_class, itertools.combinations(
+                [card for card in range(52) if card not in flop], 2)))
+            expected = wins * sum(dealt.values()) / (9 * dealt[hand_class] * sum(same_flop))
+            win, _ = table.lookup(hand_class, 9, [CARD_NAMES[card] for card in flop])
+            assert np.isclose(win, expected, rtol=1e-5), f"flop lookup {hand_class}"
+            # Suit permutations of the flop are the same entry
+            swapped = [CARD_NAMES[card ^ 1] for card in flop]
+            assert table.lookup(hand_class, 9, swapped)[0] == win, "isomorphic flop"
+            expected = winners.count(hand_class) * 1326 / (
+                9 * {"P": 6, "S": 4}.get(hand_class[2], 12) * number_of_siluations)
+            assert np.isclose(table.lookup(hand_class, 9)[0], expected, rtol=1e-5), "preflop"
+        csv_name = os.path.join(directory, "simulations.csv")
+        simulation_shard(csv_name, number_of_siluations, np.random.SeedSequence(3),
+                         ShardSettings(9, 100))
+        _, csv_values = values_from_simulations({9: [csv_name]}, flops=True)
+        assert np.array_equal(csv_values, table.values), "different CSV table"
+        preflop_name = os.path.join(directory, "preflop.pkeq")
+        save_table(preflop_name, *values_from_simulations({9: [file_name]}))
+        preflop_table = EquityTable(preflop_name)
+        for arguments in (("AAP", 2), ("AAP", 9, ["QC", "KC", "AC"])):
+            try:
+                preflop_table.lookup(*arguments)
+                raise AssertionError(f"lookup {arguments} of a preflop table")
+            except ValueError:
+                pass
+        # Release the memory maps before the directory is removed
+        del table, preflop_table
+
+def tc15_hand_history_queries(number_of_siluations=3000):
+    """Append hands of 9 and 3 players to a hand history store, the last after a segment left
+    out of the manifest by a crash, compare indexed queries with a scan of the dealt hands and the
+    counts of the store in data_science. No output"""
+    dealer = Dealer(rng=np.random.default_rng(11))
+    with _test_directory() as directory:
+        store = HandHistoryStore(directory)
+        dealt = [dealer.deal_batch(number_of_siluations, n_players) for n_players in (9, 3, 9)]
+        for community_cards, hands in dealt[:2]:
+            store.append(community_cards, hands)
+        os.makedirs(os.path.join(directory, "segment000002"))
+        assert store.append(*dealt[2])["name"] == "segment000003", "orphan segment not skipped"
+        missing = os.path.join(directory, "missing")
+        try:
+            HandHistoryStore(missing, create=False)
+            raise AssertionError("missing store opened")
+        except ValueError:
+            assert not os.path.exists(missing), "missing store created"
+        community_cards = np.concatenate([dealt[0][0], dealt[2][0]])
+        hands = np.concatenate([dealt[0][1], dealt[2][1]])
+        strengths = hand_strengths_batch(community_cards, hands)
+        is_class = CLASS_OF_CARDS[hands[..., 0], hands[..., 1]] == HAND_CLASS_INDEX["KAN"]
+        won = (is_class & (strengths == strengths.max(axis=1)[:, None])).any(axis=1)
+        best = strengths.max(axis=1)
+        for board_cards, outcome, category, expected in (
+                ((), "lost", "Two Pair", is_class.any(axis=1) & ~won),
+                (("AH",), "won", None, won),
+                ((CARD_INDEX["AH"], CARD_INDEX["7C"]), None, None, is_class.any(axis=1))):
+            if category is not None:
+                expected = expected & (best >> 20 == HAND_RANKS_REVERSE.index(category) + 1)
+            for card in board_cards:
+                expected = expected & (community_cards == CARD_INDEX.get(card, card)).any(axis=1)
+            found = [result["community_cards"] for result in
+                     HandHistoryStore(directory).query(9, "AKo", board_cards, outcome, category)]
+            found = np.concatenate(found) if found else np.empty((0, 5))
+            assert np.array_equal(found, community_cards[expected]), f"query {board_cards}"
+        winners = hands[np.arange(len(hands)), strengths.argmax(axis=1)]
+        expected_counts = Counter(HAND_CLASSES[index] for index in
+                                  CLASS_OF_CARDS[winners[:, 0], winners[:, 1]].tolist())
+        counts = count_file(directory)
+    assert players_counter(counts, 9) == expected_counts, "different store counts"
+    assert sum(players_counter(counts, 3).values()) == number_of_siluations, "3 players"
+
+def tc14_exhaustive_enumeration(deck_size=20):
+    """Enumerate all the 7 card hands of the lowest deck_size cards, compare every evaluation
+    of evaluate_batch with evaluate_full_hand and the categories of evaluate_cards. No output"""
+    # Imported here, enumerate_hands.py imports monte_carlo
+    from enumerate_hands import enumerate_hands  # pylint: disable=import-outside-toplevel
+    result = enumerate_hands("batch", True, 1, deck_size, progress=False)
+    assert result["mismatches"] == 0, f"different evaluations: {result['examples']}"
+    assert result["hands"] == sum(result["categories"]) == math.comb(deck_size, 7), "hands"
+    cards_result = enumerate_hands("cards", False, 1, deck_size, progress=False)
+    assert cards_result["categories"] == result["categories"], "different categories"
+
+def tc13_single_pass_aggregates(number_of_siluations=500):
+    """Compute the aggregates of the same split pot simulations saved as CSV and as binary
+    records, compare them and the class wins of every aggregate with count_file, report every
+    aggregate and reject the aggregates of stratified files. No output"""
+    with _test_directory() as directory:
+        results = []
+        for extension in ("csv", "bin"):
+            file_name = os.path.join(directory, f"split.{extension}")
+            simulation_shard(file_name, number_of_siluations, np.random.SeedSequence(5),
+                             ShardSettings(9, 100, extension == "bin", split_pots=True))
+            results.append(aggregate_file(file_name, [ClassWins(9), CategoryWins(9),
+                                                      ClassCategoryWins(9), BoardTextureWins(9)]))
+            assert results[-1][0].counter() == count_file(file_name), "different class wins"
+        for aggregate in results[0]:
+            aggregate.report(long_report=True)
+        try:
+            raw_to_matriz_gen([os.path.join(directory, "stratified.json")], 9,
+                              aggregates=["categories"])
+            raise AssertionError("aggregates of a stratified file")
+        except ValueError as error:
+            assert str(error) == STRATIFIED_AGGREGATES, "different stratified error"
+    for csv_aggregate, record_aggregate in zip(*results):
+        assert np.allclose(csv_aggregate.wins, record_aggregate.wins), "different aggregates"
+    class_wins, category_wins, class_category_wins, texture_wins = results[0]
+    assert np.allclose(class_category_wins.wins.sum(axis=1), class_wins.wins[0]), "class wins"
+    assert np.allclose(class_category_wins.wins.sum(axis=0), category_wins.wins), "categories"
+    assert np.allclose(texture_wins.wins.sum(axis=0), category_wins.wins), "textures"
+    assert np.isclose(category_wins.wins.sum(), number_of_siluations), "simulations"
+
+def tc12_campaign_resume(number_of_siluations=300):
+    """Run a campaign of 3 units, a worker crashes after claiming a unit and its unit is claimed
+    again, a slow worker loses the lease of a unit claimed again and finished by another one,
+    compare the merged counts with the parallel shards of the same seed. No output"""
+    # Imported here, campaign.py imports monte_carlo
+    # pylint: disable-next=import-outside-toplevel
+    from campaign import (campaign_settings, claim_unit, connect, create_campaign, finish_unit,
+                          merge_campaign, run_unit, unit_file_name, work)
+    with _test_directory() as directory:
+        campaign_file = os.path.join(directory, "campaign.db")
+        create_campaign(campaign_file, number_of_siluations, 9, number_of_siluations // 3, 50, 7)
+        work(campaign_file, "first", max_units=1)
+        connection = connect(campaign_file)
+        claim_unit(connection, "crashed")
+        connection.close()
+        assert work(campaign_file, "second") == 1, "expired unit claimed before its lease"
+        connection = connect(campaign_file)
+        unit, simulations = claim_unit(connection, "slow", lease=0)
+        assert unit == 1, "expired unit not claimed again"
+        settings = campaign_settings(connection)
+        assert work(campaign_file, "fast", lease=0) == 1, "unit of the slow worker not claimed"
+        with open(unit_file_name(campaign_file, unit, False), encoding="utf-8") as unit_file:
+            fast_rows = unit_file.read()
+        temporary_file, slow_counts = run_unit(campaign_file, settings, unit, simulations, "slow")
+        assert not finish_unit(connection, campaign_file, settings, unit, "slow",
+                               temporary_file, slow_counts), "lost lease marked done"
+        connection.close()
+        assert not os.path.exists(temporary_file), "file of the lost lease kept"
+        with open(unit_file_name(campaign_file, unit, False), encoding="utf-8") as unit_file:
+            assert unit_file.read() == fast_rows, "unit file replaced after the lost lease"
+        counts = merge_campaign(campaign_file, report=False)
+        manifest = parallel_data_collection(os.path.join(directory, "parallel"),
+                                            number_of_siluations, 7, 3, ShardSettings(9, 50))
+        with open(manifest, encoding="utf-8") as shard_files:
+            expected = Counter()
+            for shard_file in shard_files:
+                expected.update(count_file(shard_file.strip()))
+    assert counts == expected, "different campaign counts"
+
+def tc11_stratified_sampling(number_of_boards=20000):
+    """Evaluate the stratified estimates of 2 players against the exact heads up equity of
+    AAP (0.8520), 27N (0.3458) and 23S (0.3598), within 0.02. No output"""
+    tracker, _ = stratified_sampling(number_of_boards, 2, antithetic=True)
+    estimates = dict(zip(HAND_CLASSES, tracker.estimates().tolist()))
+    for hand_class, expected in (("AAP", 0.8520), ("27N", 0.3458), ("23S", 0.3598)):
+        assert abs(estimates[hand_class] - expected) < 0.02, f"different {hand_class} estimate"
+
+def tc10_range_equity(number_of_siluations=5):
+    """Evaluate ranges.parse_range combination counts, and range_equity of river boards against
+    comparing every pair of disjoint combinations with evaluate_full_hand. No output"""
+    for text, expected in (("QQ+", 18), ("AKs, AQo", 16), ("A5s-A2s", 16), ("22-55, KQ", 40),
+                           ("ATo+", 48), ("AhKh", 1)):
+        assert (parse_range(text) > 0).sum() == expected, f"different combinations in {text}"
+    hero, villain = parse_range("TT+, AK"), parse_range("99-66, KQs, AhQh")
+    for _ in range(number_of_siluations):
+        community_cards = create_community_cards()
+        board = [CARD_INDEX[card] for card in community_cards]
+        wins = ties = total = 0
+        for hero_combo in COMBOS[hero > 0].tolist():
+            for villain_combo in COMBOS[villain > 0].tolist():
+                if set(hero_combo + villain_combo) & set(board) or set(hero_combo) & set(
+                        villain_combo):
+                    continue
+                hero_result = evaluate_full_hand(
+                    community_cards + [CARD_NAMES[card] for card in hero_combo])
+                villain_result = evaluate_full_hand(
+                    community_cards + [CARD_NAMES[card] for card in villain_combo])
+                wins += hero_result > villain_result
+                ties += hero_result == villain_result
+                total += 1
+        if not total:
+            try:
+                range_equity(hero, villain, board)
+            except ValueError:
+                continue
+            raise AssertionError(f"blocked ranges without error in {community_cards}")
+        result = range_equity(hero, villain, board)
+        assert np.isclose(result["win"], wins / total), f"different win in {community_cards}"
+        assert np.isclose(result["tie"], ties / total), f"different tie in {community_cards}"
+    for hero_text, villain_text in (("AhKh", "AhQh"), ("AhAd", "AhAc, AdAs")):
+        try:
+            range_equity(parse_range(hero_text), parse_range(villain_text))
+        except ValueError:
+            continue
+        raise AssertionError(f"{hero_text} against {villain_text} blocked without error")
+    for text in ("A5s-AXs", "QQ-2X"):
+        try:
+            parse_range(text)
+        except ValueError:
+            continue
+        raise AssertionError(f"invalid range {text} without error")
+
+def tc9_isomorphic_memo(number_of_siluations=200):
+    """Evaluate IsomorphicMemo against best_hand_index without memo, on deals with 9 and 1081
+    hands and on the same deals with the suits relabeled. The results should be the same and
+    the relabeled deals should hit the memo. No output"""
+    memo = IsomorphicMemo()
+    dealer = Dealer()
+    for number_of_hands in (9, 1081):
+        for _ in range(number_of_siluations):
+            community_cards, hands = dealer.deal(number_of_hands)
+            permutation = random.sample(range(4), 4)
+            relabeled = [card & ~3 | permutation[card & 3] for card in community_cards]
+            relabeled_hands = [tuple(card & ~3 | permutation[card & 3] for card in hand)
+                               for hand in hands]
+            expected = best_hand_index(community_cards, hands)
+            assert memo.showdown(community_cards, hands) == expected, "different showdown"
+            assert memo.showdown(relabeled, relabeled_hands) == expected, "different relabeled"
+    assert memo.stats()["hits"] >= 2 * number_of_siluations, "relabeled deals not memoized"
+
+def tc8_postflop_equity(number_of_siluations=5):
+    """Evaluate exact_postflop_equity of river boards against counting all the opponent hands
+    with evaluate_full_hand. The probabilities should be the same. No output"""
+    for _ in range(number_of_siluations):
+        community_cards = create_community_cards()
+        hand = player_hand(community_cards)
+        board_ints = [CARD_INDEX[card] for card in community_cards]
+        result = evaluate_full_hand(community_cards + hand)
+        opponents = [evaluate_full_hand(community_cards + list(opponent)) for opponent in
+                     itertools.combinations(set(create_deck()) - set(community_cards + hand), 2)]
+        win, tie, _ = exact_postflop_equity(board_ints, 2, [[CARD_INDEX[card] for card in hand]])[
+            tuple(sorted(CARD_INDEX[card] for card in hand))]
+        assert win == sum(result > opponent for opponent in opponents) / len(opponents), \
+            f"different win in {community_cards + hand}"
+        assert tie == sum(result == opponent for opponent in opponents) / len(opponents), \
+            f"different tie in {community_cards + hand}"
+
+def tc7_split_showdown(number_of_siluations=100):
+    """Evaluate split_showdown against evaluate_full_hand with 2, 9 and 1081 hands. The tied
+    hands should be all the hands with the best result, and every board should share exactly
+    one pot. No output"""
+    rng = np.random.default_rng()
+    for number_of_hands in (2, 9, 1081):
+        community_cards, hands = deal_batch(rng, number_of_siluations, number_of_hands)
+        boards, positions, tied = split_showdown(hand_strengths_batch(community_cards, hands))
+        assert np.isclose(np.bincount(boards, weights=1 / tied), 1).all(), "pots not shared"
+        for board in range(number_of_siluations):
+            board_cards = [CARD_NAMES[card] for card in community_cards[board]]
+            results = [evaluate_full_hand(board_cards + [CARD_NAMES[card] for card in hand])
+                       for hand in hands[board].tolist()]
+            expected = [position for position, result in enumerate(results)
+                        if result == max(results)]
+            assert positions[boards == board].tolist() == expected, f"different {board_cards}"
+
+def tc6_sweep_prefixes(number_of_siluations=200, number_of_hands=9):
+    """Evaluate prefix_winners against best_possible_hands_batch of the first k hands for every
+    k. The winner hand and its strength should be the same in all cases. No output"""
+    community_cards, hands = deal_batch(np.random.default_rng(), number_of_siluations,
+                                        number_of_hands)
+    strengths = hand_strengths_batch(community_cards, hands)
+    winners = prefix_winners(strengths)
+    boards = np.arange(number_of_siluations)
+    for k in range(1, number_of_hands + 1):
+        expected_hands, expected_strengths = best_possible_hands_batch(community_cards,
+                                                                       hands[:, :k])
+        assert (hands[boards, winners[:, k - 1]] == expected_hands).all(), f"different hand {k}"
+        assert (strengths[boards, winners[:, k - 1]] == expected_strengths).all(), \
+            f"different strength {k}"
+
+def tc5_batch_showdown(number_of_siluations=200):
+    """Evaluate best_possible_hands_batch against evaluate_full_hand with 9 and 1081 hands. The
+    winner hand and its result should be the same in all cases. No output"""
+    rng = np.random.default_rng()
+    for number_of_hands in (9, 1081):
+        community_cards, hands = deal_batch(rng, number_of_siluations, number_of_hands)
+        winners, strengths = best_possible_hands_batch(community_cards, hands)
+        for board, board_hands, winner, strength in zip(community_cards.tolist(), hands.tolist(),
+                                                        winners.tolist(), strengths.tolist()):
+            board_cards = [CARD_NAMES[card] for card in board]
+            set_cards = set(board + sum(board_hands, []))
+            if number_of_hands * 2 <= 47:
+                assert len(set_cards) == 5 + 2 * number_of_hands, f"duplicated cards {board_hands}"
+            assert len({frozenset(hand) for hand in board_hands}) == number_of_hands, "repeated"
+            best_hand_result, best_pair = WORST_POSSIBLE_HAND, None
+            for hand in board_hands:
+                current_hand = evaluate_full_hand(board_cards + [CARD_NAMES[card] for card in hand])
+                if current_hand > best_hand_result:
+                    best_hand_result, best_pair = current_hand, hand
+            assert best_pair == winner, f"different winner in {board_cards}"
+            assert unpack_strength(strength) == best_hand_result, f"different result {board_cards}"
+
+def tc4_integer_evaluator(number_of_siluations=10000):
+    """Evaluate the integer evaluator against evaluate_full_hand. The tuples should be the same and
+    the integer strengths should keep the order of the tuples. No output"""
+    previous = None
+    for _ in range(number_of_siluations):
+        community_cards = create_community_cards()
+        seven_cards = community_cards + player_hand(community_cards)
+        expected = evaluate_full_hand(seven_cards)
+        strength = hand_strength(seven_cards)
+        assert unpack_strength(strength) == expected, f"different results for {seven_cards}"
+        seven_ints = [CARD_INDEX[card] for card in seven_cards]
+        assert BoardEvaluator(seven_ints[:5]).evaluate(*seven_ints[5:]) == strength, \
+            f"different board evaluation for {seven_cards}"
+        if previous is not None:
+            assert (strength > previous[0]) == (expected > previous[1]), "different order"
+            assert (strength == previous[0]) == (expected == previous[1]), "different order"
+        previous = (strength, expected)
 
 def tc3_validate_distinct_hands(number_of_siluations=100):
     """Evaluate that all hands given by  against evaluate_full_hand. The results should be the same
@@ -361,6 +1354,22 @@ def tc3_validate_distinct_hands(number_of_siluations=100):
             set_cards.add(hand[1])
         print("set_cards:", set_cards)
         assert len(set_cards) == 18, f"duplicated cards in {possible_hands}"
+    dealer = Dealer()
+    for number_of_hands in (2, 9, 23, 1081):
+        for _ in range(number_of_siluations):
+            community_cards, hands = dealer.deal(number_of_hands)
+            cards = community_cards + [card for hand in hands for card in hand]
+            if number_of_hands * 2 <= 47:
+                assert len(set(cards)) == 5 + 2 * number_of_hands, f"duplicated cards in {hands}"
+            else:
+                assert not set(community_cards) & set(cards[5:]), f"board card in {hands}"
+                assert len({frozenset(hand) for hand in hands}) == number_of_hands, "repeated"
+    for deal in (lambda: dealer.deal(1082), lambda: Dealer().deal_batch(2, 1082)):
+        try:
+            deal()
+            raise AssertionError("1082 hands dealt")
+        except ValueError:
+            pass
 
 def tc2_methods_comparizon(number_of_siluations=100):
     """Evaluate best_hand against evaluate_full_hand. The results should be the same
@@ -376,6 +1385,7 @@ def tc2_methods_comparizon(number_of_siluations=100):
         best2 = evaluate_full_hand(seven_cards)
         print(f"best: {best} and {best2}")
         assert best == best2, "different expressions"
+        assert evaluate_full_hand_fast(seven_cards) == best2, "different integer evaluation"
 
 def tc1_simple_hand_usage():
     """tc1 to validate the usage of basic methods created."""
@@ -0,0 +1,113 @@
+"""
+pipeline.py. Simulate and report in a single run, without writing and parsing simulation files.
+The blocks of simulations of monte_carlo.simulation_blocks are counted by winner hand class as
+they are generated, and the counts go straight to the data_science reports (raw_to_matriz_gen
+and report_generator with counts). Every refresh seconds the short report is printed again with
+the simulations so far. The raw simulations are an optional side tap, saved as CSV or as binary
+records (a file name ending in .bin) in the formats of monte_carlo.py, ready for data_science.py.
+Usage:
+    python pipeline.py [number_of_simulations] [number_of_players] [-b BATCH_SIZE] [-s SEED]
+                       [--refresh SECONDS] [--raw RAW_FILE] [-o OUTPUT_PATH] [--no_report]
+"""
+import argparse
+from collections import Counter
+import contextlib
+import random
+import time
+
+import numpy as np
+
+from combos import CLASS_OF_CARDS
+from data_science import count_classes, raw_to_matriz_gen, report_generator
+from monte_carlo import print_batch_results, simulation_blocks
+from sim_records import OUTPUT_HEADER, RecordWriter, records_from_results
+
+# Boards per block without batch_size, small enough to refresh the live report on time
+STREAM_BLOCK = 1000
+DEFAULT_REFRESH = 5.0
+
+
+def stream_counts(blocks, tap=None):
+    """Count the winner hand classes of blocks of simulations (as simulation_blocks yields).
+    tap is an optional function called with every block and its seconds per board.
+    Output: yields the Counter of the classes so far and the number of simulations."""
+    counts = Counter()
+    simulations = 0
+    start = time.time()
+    for community_cards, winners, strengths in blocks:
+        counts.update(count_classes(CLASS_OF_CARDS[winners[:, 0], winners[:, 1]]))
+        simulations += len(strengths)
+        if tap is not None:
+            tap(community_cards, winners, strengths, (time.time() - start) / len(strengths))
+        yield counts, simulations
+        start = time.time()
+
+
+@contextlib.contextmanager
+def raw_tap(raw_file):
+    """Context manager of a side tap function saving the blocks in raw_file, as binary records
+    if it ends in .bin or as CSV otherwise. The file is closed on exit."""
+    if raw_file.endswith(".bin"):
+        with RecordWriter(raw_file) as writer:
+            yield lambda community_cards, winners, strengths, _: writer.write(
+                records_from_results(community_cards, winners, strengths))
+        return
+    with open(raw_file, "w", encoding="utf-8") as raw:
+        print(OUTPUT_HEADER, file=raw)
+
+        def write_rows(community_cards, winners, strengths, execution_time):
+            with contextlib.redirect_stdout(raw):
+                print_batch_results(community_cards, winners, strengths, execution_time)
+        yield write_rows
+
+
+def live_report(counts, n_players, simulations, total, elapsed):
+    """Clear the terminal and print the short report of the simulations so far."""
+    print("\033[H\033[J", end="")
+    print(f"{simulations}/{total} simulations, {elapsed:.1f} seconds, "
+          f"{simulations / elapsed if elapsed else 0:.0f} simulations/second")
+    raw_to_matriz_gen([], n_players, counts=counts)
+
+
+def run_pipeline(simulations, n_players, batch_size=None, seed=None, refresh=DEFAULT_REFRESH,
+                 raw_file=None, output="", report=True):
+    """Run simulations with n_players and report them as data_science.py would from their
+    files, refreshing the live report every refresh seconds (never with 0). seed reproduces the
+    random streams of monte_carlo.py with the same seed. Output: Counter of the hand classes."""
+    seed_sequence = np.random.SeedSequence(seed)
+    random.seed(int(seed_sequence.generate_state(1, np.uint64)[0]))
+    rng = np.random.default_rng(seed_sequence)
+    counts = Counter()
+    start = last_refresh = time.time()
+    with contextlib.ExitStack() as stack:
+        tap = None if raw_file is None else stack.enter_context(raw_tap(raw_file))
+        blocks = simulation_blocks(simulations, n_players, batch_size, rng, STREAM_BLOCK)
+        for counts, done in stream_counts(blocks, tap):
+            if refresh and time.time() - last_refresh >= refresh:
+                live_report(counts, n_players, done, simulations, time.time() - start)
+                last_refresh = time.time()
+    print(f"{simulations} simulations in {time.time() - start:.1f} seconds.")
+    if raw_file is not None:
+        print("raw file_name:", raw_file)
+    report_generator([], n_players, output, report, counts=counts)
+    return counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Simulate and report Monte Carlo poker simulations in one run.')
+    parser.add_argument('number_of_simulations', nargs='?', type=int, default=10000)
+    parser.add_argument('number_of_players', nargs='?', type=int, default=9)
+    parser.add_argument('-b', '--batch_size', type=int,
+                        help='deal and evaluate the boards in numpy batches of this size')
+    parser.add_argument('-s', '--seed', type=int,
+                        help='master seed to reproduce the random streams of a run')
+    parser.add_argument('--refresh', type=float, default=DEFAULT_REFRESH,
+                        help='seconds between live reports, 0 disables them')
+    parser.add_argument('--raw', help='also save the simulations in this file, CSV or .bin')
+    parser.add_argument('-o', '--output_path', default="", help='path of the report file')
+    parser.add_argument('--no_report', action='store_true',
+                        help='print the final report instead of saving a report file')
+    args = parser.parse_args()
+    run_pipeline(args.number_of_simulations, args.number_of_players, args.batch_size, args.seed,
+                 args.refresh, args.raw, args.output_path, not args.no_report)
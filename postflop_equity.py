@@ -0,0 +1,116 @@
+"""
+postflop_equity.py. Exact equity of every hole pair given a flop or a turn, enumerating all the
+runouts instead of sampling boards.
+A flop leaves C(49, 2) = 1176 turn and river runouts and a turn 48 rivers. Every runout is a full
+board evaluated once for all its 1081 hole pairs, and the opponents are counted with the card
+removal of preflop_equity._board_counts (2 or 3 players), so one enumeration gives the equity of
+the whole range. The counts of every full board are memoized in an LRU cache (lru.py): a turn
+query after its flop, or the flops and turns sharing runouts, reuse them instead of evaluating
+the boards again. Evaluation follows monte_carlo.evaluate_full_hand (see hand_evaluator.py).
+"""
+import argparse
+import itertools
+import time
+from math import comb
+
+import numpy as np
+
+from hand_evaluator import CARD_INDEX, CARD_NAMES
+from lru import LRUCache
+from combos import PAIR_POSITIONS, iter_combos
+from preflop_equity import MORE_PLAYERS, SUPPORTED_PLAYERS, _board_counts
+
+CHUNK_BOARDS = {2: 64, 3: 8}
+# Win and tie counts of the 1081 hole pairs of the full boards already enumerated, ~9 KB each
+BOARD_CACHE = LRUCache(4096)
+
+
+def _opponent_deals(n_players):
+    """Opponents deals counted for a player on a full board, as _board_counts."""
+    return comb(45, 2) if n_players == 2 else comb(45, 2) * comb(43, 2) // 2
+
+
+def _hole_pairs(board):
+    """First and second cards of the 1081 hole pairs of a full board, in _board_counts order."""
+    remaining = np.setdiff1d(np.arange(52), board)
+    return remaining[PAIR_POSITIONS[:, 0]], remaining[PAIR_POSITIONS[:, 1]]
+
+
+def full_board_counts(boards, n_players=2):
+    """Win and tie counts of the 1081 hole pairs (see _hole_pairs) of every full board (5 integer
+    encoded cards), from BOARD_CACHE or enumerated in chunks. Output: list of (wins, ties)."""
+    keys = [(tuple(sorted(board)), n_players) for board in boards]
+    counts = {key: BOARD_CACHE.get(key) for key in dict.fromkeys(keys)}
+    missing = [key for key, value in counts.items() if value is None]
+    chunk_size = CHUNK_BOARDS[n_players]
+    for start in range(0, len(missing), chunk_size):
+        chunk = missing[start:start + chunk_size]
+        _, wins, ties = _board_counts([list(board) for board, _ in chunk], n_players)
+        for index, key in enumerate(chunk):
+            counts[key] = (wins[index].astype(np.int32), ties[index].astype(np.int32))
+            BOARD_CACHE.put(key, counts[key])
+    return [counts[key] for key in keys]
+
+
+def exact_postflop_equity(board, n_players=2, hands=None):
+    """Exact win/tie/loss probabilities of hole pairs against n_players - 1 random hands given a
+    board of 3, 4 or 5 integer encoded cards. hands is an optional list of hole pairs (2 integer
+    encoded cards), all the pairs without board cards by default.
+    Output: dictionary hole pair (sorted tuple) -> (win, tie, loss)."""
+    if n_players not in SUPPORTED_PLAYERS:
+        raise ValueError(MORE_PLAYERS.format(SUPPORTED_PLAYERS))
+    if len(board) not in (3, 4, 5) or len(set(board)) != len(board):
+        raise ValueError("Use a board of 3, 4 or 5 different cards.")
+    remaining = [card for card in range(52) if card not in board]
+    runouts = [list(board) + list(runout)
+               for runout in itertools.combinations(remaining, 5 - len(board))]
+    # Counts by the 2 hole cards, lowest first
+    wins = np.zeros((52, 52))
+    ties = np.zeros((52, 52))
+    valid = np.zeros((52, 52))
+    for runout, (board_wins, board_ties) in zip(runouts, full_board_counts(runouts, n_players)):
+        first, second = _hole_pairs(runout)
+        wins[first, second] += board_wins
+        ties[first, second] += board_ties
+        valid[first, second] += 1
+
+    if hands is None:
+        hands = iter_combos(board)
+    equity = {}
+    for hand in hands:
+        first, second = sorted(hand)
+        if first in board or second in board or first == second:
+            raise ValueError(f"Hand {[CARD_NAMES[card] for card in hand]} shares board cards.")
+        deals = valid[first, second] * _opponent_deals(n_players)
+        win, tie = float(wins[first, second] / deals), float(ties[first, second] / deals)
+        equity[(first, second)] = (win, tie, 1 - win - tie)
+    return equity
+
+
+def cache_stats():
+    """Hit/miss counters of the full board cache."""
+    return BOARD_CACHE.stats()
+
+
+def print_equity(equity):
+    """Print the equity of every hole pair, best first."""
+    print("hand|win|tie|loss")
+    for hand, (win, tie, loss) in sorted(equity.items(), key=lambda item: -item[1][0]):
+        print(",".join(CARD_NAMES[card] for card in hand), f"{win:.6f}", f"{tie:.6f}",
+              f"{loss:.6f}", sep="|")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Exact equity of every hole pair given a flop or a turn.')
+    parser.add_argument('board', help='3, 4 or 5 cards, as QS,JS,2D')
+    parser.add_argument('-n', '--number_of_players', type=int, default=2, choices=SUPPORTED_PLAYERS)
+    parser.add_argument('--hands', nargs='+', help='hole pairs to report, as AS,KS 7C,7D')
+    args = parser.parse_args()
+
+    start_time = time.time()
+    query_hands = None if args.hands is None else [
+        [CARD_INDEX[card] for card in hand.split(",")] for hand in args.hands]
+    print_equity(exact_postflop_equity([CARD_INDEX[card] for card in args.board.split(",")],
+                                       args.number_of_players, query_hands))
+    print(f"Execution time: {time.time() - start_time:.1f} seconds, cache: {cache_stats()}")
@@ -0,0 +1,206 @@
+"""
+preflop_equity.py. Exact preflop equity for the 169 starting hand classes of
+data_science.classify_hand, without random sampling.
+Every 5 cards board is enumerated once per suit isomorphism class: a board is identified by the
+rank masks of its 4 suits, and relabeling the suits only permutes the masks, so the boards with
+the same sorted masks share their results. Each canonical board is weighted by the number of
+boards in its class (24 suit permutations divided by the repeated masks).
+For every canonical board the 1081 possible hole pairs are evaluated in a single numpy batch and
+the opponents of each pair are counted with sorted strengths, removing the hands which share a
+card with the player (card removal).
+Heads-up and 3 players are supported: with 2 opponents the disjoint pairs of hands can still be
+counted from the number of hands per card, larger tables need matching counts with no such
+closed form and are left to the Monte Carlo simulations.
+"""
+import argparse
+import time
+from math import comb, factorial
+
+import numpy as np
+
+from combos import CLASS_COMBINATIONS, CLASS_OF_CARDS, HAND_CLASSES, PAIR_POSITIONS
+from hand_evaluator import evaluate_batch
+
+
+STRENGTH_SPAN = 1 << 24  # bigger than any hand strength
+# The opponent deals enumerated per board grow several hundred times per player, the equity of
+# more players is estimated from Monte Carlo simulations (monte_carlo.py, equity_table.py build -l)
+SUPPORTED_PLAYERS = (2, 3)
+MORE_PLAYERS = ("Exact equity supports {} players, estimate more players from Monte Carlo "
+                "simulation files (monte_carlo.py, then equity_table.py build -l).")
+MASKS_BY_COUNT = [[mask for mask in range((1 << 13) - 1, -1, -1)
+                   if bin(mask).count("1") == count] for count in range(6)]
+
+
+def _suit_partitions(cards, parts=4, largest=5):
+    """Ways to split cards in parts (suits) with non increasing number of cards."""
+    if parts == 0:
+        if cards == 0:
+            yield ()
+        return
+    for count in range(min(cards, largest), -1, -1):
+        for rest in _suit_partitions(cards - count, parts - 1, count):
+            yield (count,) + rest
+
+
+def _masks_for_partition(partition, previous=None):
+    """Rank masks for every suit of a partition, suits with the same number of cards are sorted
+    by mask so every suit isomorphism class appears once."""
+    if not partition:
+        yield ()
+        return
+    count = partition[0]
+    for mask in MASKS_BY_COUNT[count]:
+        if previous is not None and previous[0] == count and mask > previous[1]:
+            continue
+        for rest in _masks_for_partition(partition[1:], (count, mask)):
+            yield (mask,) + rest
+
+
+def canonical_board_key(cards):
+    """Suit isomorphism key of a board of integer encoded cards: the rank masks of the suits
+    sorted by number of cards and mask, the same masks yielded by canonical_boards."""
+    masks = [0, 0, 0, 0]
+    for card in cards:
+        masks[card & 3] |= 1 << (card >> 2)
+    return tuple(sorted(masks, key=lambda mask: (bin(mask).count("1"), mask), reverse=True))
+
+
+def canonical_boards(board_size=5):
+    """Generate one board per suit isomorphism class. Output: (cards, weight) where cards is a
+    list of integer encoded cards and weight the number of boards of its class."""
+    for partition in _suit_partitions(board_size):
+        for masks in _masks_for_partition(partition):
+            repeated = 1
+            for mask in set(masks):
+                repeated *= factorial(masks.count(mask))
+            cards = [rank * 4 + suit
+                     for suit, mask in enumerate(masks) for rank in range(13) if mask >> rank & 1]
+            yield cards, factorial(4) // repeated
+
+
+def _count_below(sorted_keys, keys, side):
+    """Number of sorted_keys under keys (side='left') or up to keys (side='right')."""
+    return np.searchsorted(sorted_keys, keys, side=side)
+
+
+def _board_counts(boards, n_players):
+    """Win and tie counts of the 1081 hole pairs of every board for n_players.
+    Output: classes, wins and ties arrays (boards, 1081), the wins and ties are counted over all
+    the deals of opponents which do not share cards with the board or the player."""
+    n_boards = len(boards)
+    remaining = np.array([[card for card in range(52) if card not in board] for board in boards])
+    hole_cards = remaining[:, PAIR_POSITIONS]
+    seven_cards = np.concatenate(
+        [np.broadcast_to(np.array(boards)[:, None, :], (n_boards, len(PAIR_POSITIONS), 5)),
+         hole_cards], axis=2)
+    strengths = evaluate_batch(seven_cards.reshape(-1, 7)).astype(np.int64).reshape(n_boards, -1)
+    classes = CLASS_OF_CARDS[hole_cards[..., 0], hole_cards[..., 1]]
+
+    # Every board gets its own key range so all the boards are searched at once
+    board_offset = (np.arange(n_boards) * STRENGTH_SPAN)[:, None]
+    keys = strengths + board_offset
+    sorted_keys = np.sort(keys.ravel())
+    hands_below = _count_below(sorted_keys, keys, "left") - np.arange(n_boards)[:, None] * 1081
+    hands_up_to = _count_below(sorted_keys, keys, "right") - np.arange(n_boards)[:, None] * 1081
+
+    # Hands holding a given card: key by (board, card position, strength)
+    card_keys = ((np.arange(n_boards)[:, None, None] * 47 + PAIR_POSITIONS[None]) * STRENGTH_SPAN
+                 + strengths[:, :, None])
+    sorted_card_keys = np.sort(card_keys.ravel())
+
+    def with_card(position_keys, side):
+        """Hands which hold the card of position_keys and are below/up to the player."""
+        start = position_keys * STRENGTH_SPAN
+        return (_count_below(sorted_card_keys, start + strengths, side)
+                - _count_below(sorted_card_keys, start, "left"))
+
+    first = np.arange(n_boards)[:, None] * 47 + PAIR_POSITIONS[:, 0]
+    second = np.arange(n_boards)[:, None] * 47 + PAIR_POSITIONS[:, 1]
+    # Only the player hand holds both cards, it is never below itself
+    below = hands_below - with_card(first, "left") - with_card(second, "left")
+    up_to = hands_up_to - with_card(first, "right") - with_card(second, "right") + 1
+    if n_players == 2:
+        return classes, below, up_to - below
+
+    # 2 opponents: ordered disjoint pairs of a set S = |S|^2 - sum(hands per card^2) + |S|
+    all_positions = np.arange(n_boards)[:, None, None] * 47 + np.arange(47)
+    pair_strength = np.full((n_boards, 47, 47), STRENGTH_SPAN, dtype=np.int64)
+    pair_strength[:, PAIR_POSITIONS[:, 0], PAIR_POSITIONS[:, 1]] = strengths
+    pair_strength[:, PAIR_POSITIONS[:, 1], PAIR_POSITIONS[:, 0]] = strengths
+    holds_card = ((np.arange(47) == PAIR_POSITIONS[:, :1])
+                  | (np.arange(47) == PAIR_POSITIONS[:, 1:]))
+
+    def disjoint_pairs(hands, side):
+        """Ordered pairs of disjoint opponents hands below/up to the player."""
+        start = all_positions * STRENGTH_SPAN
+        per_card = (_count_below(sorted_card_keys, start + strengths[:, :, None], side)
+                    - _count_below(sorted_card_keys, start, "left"))
+        player = strengths[:, :, None]
+        for column in (0, 1):
+            shared = pair_strength[:, PAIR_POSITIONS[:, column], :]
+            per_card -= shared < player if side == "left" else shared <= player
+        per_card[:, holds_card] = 0
+        return hands * hands - (per_card * per_card).sum(axis=2) + hands
+
+    wins = disjoint_pairs(below, "left") // 2
+    return classes, wins, disjoint_pairs(up_to, "right") // 2 - wins
+
+
+def exact_preflop_equity(n_players=2, chunk_size=None, progress=True):
+    """Exact win/tie/loss probabilities of every hand class against n_players - 1 random hands.
+    Output: dictionary class -> (win, tie, loss) and a dictionary with evaluation statistics."""
+    if n_players not in SUPPORTED_PLAYERS:
+        raise ValueError(MORE_PLAYERS.format(SUPPORTED_PLAYERS))
+    if chunk_size is None:
+        chunk_size = 64 if n_players == 2 else 8
+    opponent_deals = comb(45, 2) if n_players == 2 else comb(45, 2) * comb(43, 2) // 2
+
+    wins = np.zeros(len(HAND_CLASSES))
+    ties = np.zeros(len(HAND_CLASSES))
+    start_time = time.time()
+    boards = list(canonical_boards())
+    for start in range(0, len(boards), chunk_size):
+        chunk = boards[start:start + chunk_size]
+        classes, board_wins, board_ties = _board_counts([cards for cards, _ in chunk], n_players)
+        weights = np.array([weight for _, weight in chunk], dtype=np.float64)[:, None]
+        wins += np.bincount(classes.ravel(), (board_wins * weights).ravel(), len(HAND_CLASSES))
+        ties += np.bincount(classes.ravel(), (board_ties * weights).ravel(), len(HAND_CLASSES))
+        if progress and (start // chunk_size) % 200 == 0:
+            print(f"{start}/{len(boards)} boards, {time.time() - start_time:.1f} seconds")
+
+    deals = CLASS_COMBINATIONS * comb(50, 5) * opponent_deals
+    equity = {hand_class: (wins[i] / deals[i], ties[i] / deals[i],
+                           1 - (wins[i] + ties[i]) / deals[i])
+              for i, hand_class in enumerate(HAND_CLASSES)}
+    all_boards = comb(52, 5)
+    statistics = {
+        "boards": all_boards,
+        "canonical_boards": len(boards),
+        "evaluations": len(boards) * len(PAIR_POSITIONS),
+        "evaluations_saved": (all_boards - len(boards)) * len(PAIR_POSITIONS),
+        "execution_time": time.time() - start_time,
+    }
+    return equity, statistics
+
+
+def print_equity(equity, statistics):
+    """Print the equity table and the evaluation statistics."""
+    print("hand_class|win|tie|loss")
+    for hand_class, (win, tie, loss) in sorted(equity.items(), key=lambda item: -item[1][0]):
+        print(hand_class, f"{win:.6f}", f"{tie:.6f}", f"{loss:.6f}", sep="|")
+    print()
+    print(f"Boards: {statistics['boards']}, canonical boards: {statistics['canonical_boards']}")
+    print(f"Hand evaluations: {statistics['evaluations']}, "
+          f"saved by suit isomorphism: {statistics['evaluations_saved']}")
+    print(f"Execution time: {statistics['execution_time']:.1f} seconds")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Exact preflop equity of the 169 hand classes.')
+    parser.add_argument('number_of_players', nargs='?', type=int, default=2)
+    args = parser.parse_args()
+    if args.number_of_players not in SUPPORTED_PLAYERS:
+        parser.error(MORE_PLAYERS.format(SUPPORTED_PLAYERS))
+    print_equity(*exact_preflop_equity(args.number_of_players))
@@ -0,0 +1,167 @@
+"""
+ranges.py. Hand ranges as weight arrays over the 1326 hole pair combinations, and range vs range
+equity.
+A range is written as comma separated items, with an optional weight after a colon:
+    QQ+, AKs, AQo, A5s-A2s, KQ, 22-55, AhKh, T9s:0.5
+pairs (QQ), suited (AKs) and offsuit (AQo) classes or both (KQ), "+" raising the lower card up to
+the upper one (or the pair up to AA), ranges between 2 classes with the same upper card (or 2
+pairs) and single combinations of 2 cards. parse_range returns the 1326 weights, in the order of
+COMBOS (itertools.combinations of the integer encoded cards, see hand_evaluator.py).
+range_equity computes the equity of a range against another one for every full board of a list
+of runouts, exhaustive or sampled. The combinations blocked by the board, by the runout or by
+each other are skipped intersecting their 52 bit card masks, and every runout evaluates the
+hands of both ranges with a single hand_evaluator.evaluate_batch call.
+"""
+import argparse
+import itertools
+import time
+
+import numpy as np
+
+from combos import COMBO_CLASSES, COMBO_INDEX, COMBO_MASKS, COMBOS, HAND_CLASS_INDEX, cards_mask
+from hand_evaluator import CARD_INDEX, VALUES, evaluate_batch
+
+# Hand comparisons held in memory per chunk of runouts
+CHUNK_COMPARISONS = 1 << 22
+DEFAULT_SAMPLES = 20000
+BLOCKED_RANGES = "A range is empty or blocked by the board or by the other range."
+
+
+def _class_label(high, low, kind):
+    """data_science.classify_hand label of 2 ranks (indexes of VALUES), kind "P", "S" or "N"."""
+    if high == low:
+        return VALUES[high] * 2 + "P"
+    return VALUES[min(high, low)] + VALUES[max(high, low)] + kind
+
+
+def _item_classes(item):
+    """Class labels of a range item without weight, as QQ+, AKs, A5s-A2s or KQ."""
+    if "-" in item:
+        first, last = item.split("-", 1)
+        pairs = first[:1] == first[1:2]
+        if len(first) != len(last) or first[2:] != last[2:] or pairs != (last[:1] == last[1:2]) \
+                or not pairs and first[:1] != last[:1] \
+                or any(rank not in VALUES for rank in first[:2] + last[:2]):
+            raise ValueError(f"Invalid range {item}, use ranges as 22-55 or A5s-A2s.")
+        lows = sorted((VALUES.index(first[1]), VALUES.index(last[1])))
+        return [label for rank in range(lows[0], lows[1] + 1)
+                for label in _item_classes((VALUES[rank] * 2 if pairs else first[0] + VALUES[rank])
+                                           + first[2:])]
+    plus = item.endswith("+")
+    item = item.rstrip("+")
+    if len(item) not in (2, 3) or any(rank not in VALUES for rank in item[:2]) \
+            or item[2:] not in ("", "S", "O"):
+        raise ValueError(f"Invalid range item {item}, use items as QQ+, AKs, AQo or KQ.")
+    high, low = sorted((VALUES.index(item[0]), VALUES.index(item[1])), reverse=True)
+    if high == low and item[2:]:
+        raise ValueError(f"Invalid range item {item}, pairs are neither suited nor offsuit.")
+    kinds = {"": "SN", "S": "S", "O": "N"}[item[2:]]
+    lows = range(low, (13 if high == low else high) if plus else low + 1)
+    return [_class_label(rank, rank, "P") if high == low else _class_label(high, rank, kind)
+            for rank in lows for kind in kinds]
+
+
+def parse_range(text):
+    """Weights of the 1326 combinations (COMBOS order) of a range, see the module docstring.
+    Raises ValueError for invalid ranges."""
+    weights = np.zeros(len(COMBOS))
+    for item in text.replace(" ", "").split(","):
+        if not item:
+            continue
+        item, _, weight = item.partition(":")
+        weight = float(weight) if weight else 1.0
+        if len(item) == 4 and item[1].lower() in "cdhs" and item[3].lower() in "cdhs":
+            cards = [item[:2].upper(), item[2:].upper()]
+            if any(card not in CARD_INDEX for card in cards) or cards[0] == cards[1]:
+                raise ValueError(f"Invalid combination {item}, use combinations as AhKh.")
+            weights[COMBO_INDEX[CARD_INDEX[cards[0]], CARD_INDEX[cards[1]]]] = weight
+            continue
+        for label in _item_classes(item.upper()):
+            weights[COMBO_CLASSES == HAND_CLASS_INDEX[label]] = weight
+    return weights
+
+
+def runouts(board, samples=None, rng=None):
+    """Full boards (runouts, 5) of the integer encoded board: all of them, or samples boards
+    drawn from rng (a numpy Generator)."""
+    remaining = np.setdiff1d(np.arange(52), board)
+    missing = 5 - len(board)
+    if samples is None:
+        combinations = list(itertools.combinations(remaining, missing))
+        cards = np.array(combinations, dtype=np.int64).reshape(len(combinations), missing)
+    else:
+        cards = rng.permuted(np.tile(remaining, (samples, 1)), axis=1)[:, :missing]
+    return np.concatenate([np.tile(np.asarray(board, dtype=np.int64), (len(cards), 1)), cards],
+                          axis=1)
+
+
+def range_equity(hero, villain, board=(), samples=None, seed=None):
+    """Equity of the hero range against the villain range (1326 weights each, as parse_range)
+    given a board of 0 to 5 integer encoded cards, over all the runouts, or over samples random
+    runouts. Every disjoint pair of combinations counts with the product of their weights.
+    Output: dictionary with win, tie, loss and equity (win plus half the ties) probabilities,
+    the number of runouts and the weighted matchups. Raises ValueError if no pair of
+    combinations can be dealt with the board (BLOCKED_RANGES)."""
+    board_mask = np.uint64(cards_mask(board))
+    unblocked = (COMBO_MASKS & board_mask) == 0
+    hero_index = np.flatnonzero((hero > 0) & unblocked)
+    villain_index = np.flatnonzero((villain > 0) & unblocked)
+    if not hero_index.size or not villain_index.size:
+        raise ValueError(BLOCKED_RANGES)
+    hero_masks, villain_masks = COMBO_MASKS[hero_index], COMBO_MASKS[villain_index]
+    pair_weights = np.where((hero_masks[:, None] & villain_masks[None, :]) == 0,
+                            hero[hero_index][:, None] * villain[villain_index][None, :], 0)
+    if not pair_weights.any():
+        raise ValueError(BLOCKED_RANGES)
+    combos = np.union1d(hero_index, villain_index)
+    hero_columns = np.searchsorted(combos, hero_index)
+    villain_columns = np.searchsorted(combos, villain_index)
+
+    full_boards = runouts(list(board), samples, np.random.default_rng(seed))
+    chunk_size = max(1, CHUNK_COMPARISONS // pair_weights.size)
+    wins = ties = total = 0.0
+    for start in range(0, len(full_boards), chunk_size):
+        chunk = full_boards[start:start + chunk_size]
+        runout_masks = (np.uint64(1) << chunk.astype(np.uint64)).sum(axis=1, dtype=np.uint64)
+        free = (COMBO_MASKS[combos][None, :] & runout_masks[:, None]) == 0
+        seven_cards = np.concatenate(
+            [np.broadcast_to(chunk[:, None, :], (len(chunk), len(combos), 5)),
+             np.broadcast_to(COMBOS[combos][None], (len(chunk), len(combos), 2))], axis=2)
+        # The combinations sharing cards with the runout are not evaluated
+        strengths = np.zeros(free.shape, dtype=np.int64)
+        strengths[free] = evaluate_batch(seven_cards[free])
+        hero_free, villain_free = free[:, hero_columns], free[:, villain_columns]
+        weights = pair_weights[None] * (hero_free[:, :, None] & villain_free[:, None, :])
+        hero_strengths = strengths[:, hero_columns][:, :, None]
+        villain_strengths = strengths[:, villain_columns][:, None, :]
+        wins += float((weights * (hero_strengths > villain_strengths)).sum())
+        ties += float((weights * (hero_strengths == villain_strengths)).sum())
+        total += float(weights.sum())
+    if not total:
+        raise ValueError(BLOCKED_RANGES)
+    return {"win": wins / total, "tie": ties / total, "loss": 1 - (wins + ties) / total,
+            "equity": (wins + ties / 2) / total, "runouts": len(full_boards), "matchups": total}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Equity of a hand range against another one.')
+    parser.add_argument('hero', help='range as "QQ+, AKs, AQo"')
+    parser.add_argument('villain', help='range as "22+, A2s+, KTo+"')
+    parser.add_argument('-b', '--board', default="", help='0 to 5 cards, as QS,JS,2D')
+    parser.add_argument('--samples', type=int,
+                        help=f'random runouts, all the runouts by default with a flop or more '
+                             f'and {DEFAULT_SAMPLES} before the flop')
+    parser.add_argument('-s', '--seed', type=int)
+    args = parser.parse_args()
+
+    board_cards = [CARD_INDEX[card] for card in args.board.upper().split(",") if card]
+    number_of_samples = args.samples
+    if number_of_samples is None and len(board_cards) < 3:
+        number_of_samples = DEFAULT_SAMPLES
+    start_time = time.time()
+    result = range_equity(parse_range(args.hero), parse_range(args.villain), board_cards,
+                          number_of_samples, args.seed)
+    print("win|tie|loss|equity|runouts")
+    print(f"{result['win']:.6f}|{result['tie']:.6f}|{result['loss']:.6f}|{result['equity']:.6f}"
+          f"|{result['runouts']}")
+    print(f"Execution time: {time.time() - start_time:.1f} seconds")
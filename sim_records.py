@@ -0,0 +1,147 @@
+"""
+sim_records.py. Binary format for simulation results.
+A record file starts with MAGIC, the header length (uint32) and a JSON header with the record
+fields and the compression, padded to HEADER_ALIGNMENT bytes. The records follow as fixed width
+rows of RECORD_DTYPE: integer encoded community cards and winner hand (see hand_evaluator.py),
+hand rank and the 5 tiebreaker values (unused values are 0). Sweep files (simulations with
+the winner of every number of players, see monte_carlo.py --sweep) add the n_players field
+and split pot files (every hand tied for the best, see monte_carlo.py --split_pots) add the
+tied field, the number of hands sharing the pot. Readers take the record fields from the header.
+Without compression the records are contiguous and read as a zero copy view of a memory map.
+With zlib compression they are saved in blocks, each block with its compressed size and
+number of records (2 uint32) before the data.
+"""
+import json
+import mmap
+import zlib
+
+import numpy as np
+
+MAGIC = b"PKSR"
+VERSION = 1
+HEADER_ALIGNMENT = 64
+BLOCK_RECORDS = 65536
+COMPRESSIONS = ("none", "zlib")
+RECORD_DTYPE = np.dtype([("community_cards", "u1", (5,)),
+                         ("hand", "u1", (2,)),
+                         ("hand_rank", "u1"),
+                         ("hand_value", "u1", (5,))])
+SWEEP_RECORD_DTYPE = np.dtype(RECORD_DTYPE.descr + [("n_players", "u1")])
+SPLIT_RECORD_DTYPE = np.dtype(RECORD_DTYPE.descr + [("tied", "<u2")])
+# Header line of the CSV simulation files, the text form of the same results
+OUTPUT_HEADER = "community_cards|hand|hand_result_1|hand_result_2|execution_time"
+
+
+def records_from_results(community_cards, hands, strengths, n_players=None, tied=None):
+    """Build records from integer encoded community cards (N, 5), winner hands (N, 2) and the
+    winner strengths (N,) as returned by hand_evaluator. With n_players (N,) the records are
+    SWEEP_RECORD_DTYPE, with tied (N,) they are SPLIT_RECORD_DTYPE."""
+    strengths = np.asarray(strengths)
+    dtype = RECORD_DTYPE
+    if n_players is not None:
+        dtype = SWEEP_RECORD_DTYPE
+    elif tied is not None:
+        dtype = SPLIT_RECORD_DTYPE
+    records = np.empty(len(strengths), dtype=dtype)
+    if n_players is not None:
+        records["n_players"] = n_players
+    elif tied is not None:
+        records["tied"] = tied
+    records["community_cards"] = community_cards
+    records["hand"] = hands
+    records["hand_rank"] = strengths >> 20
+    records["hand_value"] = (strengths[:, None] >> np.array([16, 12, 8, 4, 0])) & 15
+    return records
+
+
+class RecordWriter:
+    """Write records of dtype (RECORD_DTYPE, SWEEP_RECORD_DTYPE or SPLIT_RECORD_DTYPE) to a file
+    in blocks. Use as a context manager or call close."""
+
+    def __init__(self, file_name, compression="none", block_records=BLOCK_RECORDS,
+                 dtype=RECORD_DTYPE):
+        if compression not in COMPRESSIONS:
+            raise ValueError(f"Unknown compression {compression}, use one of {COMPRESSIONS}.")
+        self.compression = compression
+        self.block_records = block_records
+        self.pending = []
+        self.pending_records = 0
+        self.records_written = 0
+        self.file = open(file_name, "wb")  # pylint: disable=consider-using-with
+        header = json.dumps({"version": VERSION, "fields": dtype.descr,
+                             "compression": compression}).encode("utf-8")
+        header += b" " * (-(len(MAGIC) + 4 + len(header)) % HEADER_ALIGNMENT)
+        self.file.write(MAGIC)
+        self.file.write(len(header).to_bytes(4, "little"))
+        self.file.write(header)
+
+    def write(self, records):
+        """Buffer records and save them once a block is full."""
+        self.pending.append(records)
+        self.pending_records += len(records)
+        if self.pending_records >= self.block_records:
+            self.flush()
+
+    def flush(self):
+        """Save the buffered records."""
+        if not self.pending_records:
+            return
+        data = np.concatenate(self.pending).tobytes()
+        if self.compression == "zlib":
+            data = zlib.compress(data)
+            self.file.write(len(data).to_bytes(4, "little"))
+            self.file.write(self.pending_records.to_bytes(4, "little"))
+        self.file.write(data)
+        self.records_written += self.pending_records
+        self.pending, self.pending_records = [], 0
+
+    def close(self):
+        """Save the remaining records and close the file."""
+        self.flush()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def is_record_file(file_name):
+    """Returns True if the file is a record file, False for the text (CSV) simulation files."""
+    with open(file_name, "rb") as record_file:
+        return record_file.read(len(MAGIC)) == MAGIC
+
+
+def _read_header(record_file):
+    """Read the header of an open record file. Output: header dictionary, data offset."""
+    if record_file.read(len(MAGIC)) != MAGIC:
+        raise ValueError(f"{record_file.name} is not a record file.")
+    header_length = int.from_bytes(record_file.read(4), "little")
+    header = json.loads(record_file.read(header_length))
+    if header["version"] != VERSION:
+        raise ValueError(f"{record_file.name} has an unsupported record version.")
+    header["dtype"] = np.dtype([tuple(field) for field in header["fields"]])
+    return header, len(MAGIC) + 4 + header_length
+
+
+def read_records(file_name):
+    """Generate the records of a file as arrays of the fields saved in its header (RECORD_DTYPE,
+    SWEEP_RECORD_DTYPE or SPLIT_RECORD_DTYPE). Uncompressed files are one zero copy view of a
+    memory map, compressed files are one array per block."""
+    with open(file_name, "rb") as record_file:
+        header, offset = _read_header(record_file)
+        dtype = header["dtype"]
+        if header["compression"] == "none":
+            file_map = mmap.mmap(record_file.fileno(), 0, access=mmap.ACCESS_READ)
+            yield np.frombuffer(file_map, dtype=dtype, offset=offset,
+                                count=(len(file_map) - offset) // dtype.itemsize)
+            return
+        while True:
+            block_header = record_file.read(8)
+            if len(block_header) < 8:
+                return
+            size = int.from_bytes(block_header[:4], "little")
+            count = int.from_bytes(block_header[4:], "little")
+            yield np.frombuffer(zlib.decompress(record_file.read(size)), dtype=dtype,
+                                count=count)
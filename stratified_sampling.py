@@ -0,0 +1,154 @@
+"""
+stratified_sampling.py. Stratified sampling of the win probability of every hand class, with the
+samples allocated toward equal precision and optional antithetic deals.
+Uniform dealing gives every class samples in proportion to its combinations (6 pairs, 4 suited,
+12 offsuit), so the suited cells of data_science.generate_matrices converge last. Here every
+board deals the community cards and number_of_players - 1 opponents at random, and a hero hand
+of every class sampled in the round is evaluated against them: a random combination of the
+class among the m ones that do not share cards with the deal. Weighting the sample by m makes
+the hero and the opponents a uniform deal, and the hero gets the expected share of its seat
+(1 / hands tied for the best, the first hand dealt wins the ties in a random seat order), so
+weighted wins / weights estimate the same probability as the uniform simulations.
+After the first round, a class is sampled in a round with a probability proportional to
+p * (1 - p), so all the classes converge toward the same confidence interval half width.
+With --antithetic every deal is paired with its rank reversed deal (rank r becomes 12 - r), a
+uniform deal as well, negatively correlated with the first one.
+The results are saved as JSON with the weighted wins and weights of every class, data_science.py
+reads them (see count_file) and reports the unbiased probability matrices.
+Usage:
+    python stratified_sampling.py [number_of_boards] [number_of_players] [-b BATCH_SIZE]
+                                  [-s SEED] [--antithetic] [-t TARGET_HALF_WIDTH]
+"""
+import argparse
+from datetime import datetime
+import json
+import os
+import time
+
+import numpy as np
+
+from adaptive_sampling import ConvergenceTracker
+from combos import COMBO_CLASSES, COMBO_MASKS, COMBOS, HAND_CLASSES
+from dealer import Dealer, MAX_DISTINCT_HANDS
+from hand_evaluator import evaluate_batch, hand_strengths_batch
+
+DEFAULT_BATCH_SIZE = 1000
+# Lowest probability of sampling a class in a round
+MIN_RATE = 0.05
+# Combinations of every class, padded with -1 (4 suited, 6 pairs, 12 offsuit)
+CLASS_COMBOS = np.full((len(HAND_CLASSES), 12), -1, dtype=np.int64)
+for _class_index in range(len(HAND_CLASSES)):
+    _combos = np.flatnonzero(COMBO_CLASSES == _class_index)
+    CLASS_COMBOS[_class_index, :len(_combos)] = _combos
+# Card of the same suit and reversed rank, for the antithetic deals
+RANK_REVERSED = np.array([(12 - (card >> 2)) * 4 + (card & 3) for card in range(52)])
+
+
+def stratified_round(dealer, boards, n_players, rates, antithetic=False):
+    """Deal boards and evaluate the hero hands of the classes sampled with rates (probability of
+    every class to be sampled on a board). Output: weighted wins, weights and samples per class
+    and the number of hand evaluations."""
+    community_cards, opponents = dealer.deal_batch(boards, n_players - 1)
+    if antithetic:
+        community_cards = np.concatenate([community_cards, RANK_REVERSED[community_cards]])
+        opponents = np.concatenate([opponents, RANK_REVERSED[opponents]])
+    opponent_strengths = hand_strengths_batch(community_cards, opponents)
+    best = opponent_strengths.max(axis=1)
+    tied = (opponent_strengths == best[:, None]).sum(axis=1)
+    dealt_masks = (np.uint64(1) << np.concatenate(
+        [community_cards, opponents.reshape(len(community_cards), -1)], axis=1).astype(
+            np.uint64)).sum(axis=1, dtype=np.uint64)
+
+    # The antithetic deal samples the same classes as its pair
+    sampled = dealer.rng.random((boards, len(HAND_CLASSES))) < rates
+    if antithetic:
+        sampled = np.concatenate([sampled, sampled])
+    compatible = (CLASS_COMBOS >= 0) & (
+        (COMBO_MASKS[CLASS_COMBOS] & dealt_masks[:, None, None]) == 0)
+    weights = compatible.sum(axis=2)
+    choice = np.where(compatible, dealer.rng.random(compatible.shape), -1).argmax(axis=2)
+    rows, classes = np.nonzero(sampled & (weights > 0))
+    heroes = COMBOS[CLASS_COMBOS[classes, choice[rows, classes]]]
+    strengths = evaluate_batch(np.concatenate([community_cards[rows], heroes], axis=1))
+    shares = (strengths > best[rows]) + (strengths == best[rows]) / (tied[rows] + 1)
+
+    sample_weights = weights[rows, classes]
+    minlength = len(HAND_CLASSES)
+    return (np.bincount(classes, sample_weights * shares, minlength),
+            np.bincount(classes, sample_weights, minlength),
+            np.bincount(classes, minlength=minlength) / (2 if antithetic else 1),
+            opponent_strengths.size + len(rows))
+
+
+def stratified_sampling(n_boards, n_players, batch_size=DEFAULT_BATCH_SIZE, seed=None,
+                        antithetic=False, target_half_width=None):
+    """Run rounds of batch_size boards (pairs of deals with antithetic) until n_boards, or until
+    the confidence interval of every class is narrower than target_half_width. The sampling
+    rates of the classes follow p * (1 - p) of the estimates so far.
+    Output: adaptive_sampling.ConvergenceTracker with the weighted wins (wins), weights (dealt)
+    and samples per class, and the number of hand evaluations."""
+    if not 2 <= n_players <= MAX_DISTINCT_HANDS:
+        raise ValueError(f"Stratified sampling supports 2 to {MAX_DISTINCT_HANDS} players.")
+    dealer = Dealer(rng=np.random.default_rng(seed))
+    tracker = ConvergenceTracker()
+    rates = np.ones(len(HAND_CLASSES))
+    evaluations = 0
+    while tracker.simulations < n_boards:
+        boards = min(batch_size, n_boards - tracker.simulations)
+        wins, weights, samples, round_evaluations = stratified_round(dealer, boards, n_players,
+                                                                     rates, antithetic)
+        tracker.add(wins, weights, samples, boards)
+        evaluations += round_evaluations
+        if tracker.checkpoint() <= (target_half_width or 0):
+            break
+        estimates = tracker.estimates()
+        variances = estimates * (1 - estimates)
+        rates = np.clip(variances / variances.max(), MIN_RATE, 1)
+    return tracker, evaluations
+
+
+def save_results(file_name, tracker, n_players, evaluations, antithetic):
+    """Save the weighted wins and weights of every class, read by data_science.count_file."""
+    summary = tracker.summary()
+    results = {"mode": "stratified", "n_players": n_players, "boards": tracker.simulations,
+               "evaluations": evaluations, "antithetic": antithetic,
+               "classes": {hand_class: {"wins": float(tracker.wins[index]),
+                                        "weights": float(tracker.dealt[index]),
+                                        "samples": float(tracker.samples[index])}
+                           for index, hand_class in enumerate(HAND_CLASSES)},
+               "estimates": summary["estimates"], "half_widths": summary["half_widths"],
+               "curve": summary["curve"]}
+    with open(file_name, "w", encoding="utf-8") as file:
+        json.dump(results, file, indent=1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Stratified sampling of the win probability of every hand class.')
+    parser.add_argument('number_of_boards', nargs='?', type=int, default=100000)
+    parser.add_argument('number_of_players', nargs='?', type=int, default=9)
+    parser.add_argument('-b', '--batch_size', type=int, default=DEFAULT_BATCH_SIZE,
+                        help='boards per round, the sampling rates are updated every round')
+    parser.add_argument('-s', '--seed', type=int)
+    parser.add_argument('--antithetic', action='store_true',
+                        help='pair every deal with its rank reversed deal')
+    parser.add_argument('-t', '--target_half_width', type=float,
+                        help='stop once the confidence interval of every hand class is '
+                             'narrower than this, number_of_boards is the limit')
+    args = parser.parse_args()
+
+    start_time = time.time()
+    result_tracker, hand_evaluations = stratified_sampling(
+        args.number_of_boards, args.number_of_players, args.batch_size, args.seed,
+        args.antithetic, args.target_half_width)
+    time_format = datetime.now().strftime("%Y%m%d_%H%M%S")
+    results_file = (f"{os.getenv('POKER_OUT_FILE_PATH', '')}poker_stratified_"
+                    f"{result_tracker.simulations}_{args.number_of_players}hands_{time_format}"
+                    ".json")
+    save_results(results_file, result_tracker, args.number_of_players, hand_evaluations,
+                 args.antithetic)
+    last_point = result_tracker.curve[-1]
+    print(f"{result_tracker.simulations} boards, {hand_evaluations} hand evaluations, "
+          f"max half width {last_point['max_half_width']:.5f} ({last_point['widest_cell']}), "
+          f"{time.time() - start_time:.1f} seconds.")
+    print("file_name:", results_file)